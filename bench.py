@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for the encode and render paths of web_app.
+
+    python bench.py                          # run and print a table
+    python bench.py --save bench-baseline.json
+    python bench.py --compare bench-baseline.json --tolerance 0.25
+
+With --compare the run fails (exit 1) when a case's p50 latency or peak memory
+grows by more than the tolerance, or its output size changes. Runs offline.
+"""
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import web_app
+
+BASE = dict(version=10, scale=10, border=4, transparent=False, backend='native')
+VERSIONS = (1, 2, 5, 10, 15, 20, 25, 30, 35, 40)
+SCALES = (1, 2, 5, 10, 25, 50)
+BORDERS = (0, 1, 4, 10, 25, 50)
+BACKEND_VERSIONS = (1, 10, 25, 40)
+
+
+class Case(NamedTuple):
+    name: str
+    kind: str  # 'generate' (cold matrix cache), 'render' (warm) or 'filename'
+    version: int
+    scale: int
+    border: int
+    transparent: bool
+    backend: str
+
+
+class Result(NamedTuple):
+    runs: int
+    ops_per_sec: float
+    p50_ms: float
+    p99_ms: float
+    peak_kib: float
+    output_bytes: int
+
+
+def payload_for_version(version: int) -> str:
+    # Longest byte-mode payload that still fits `version` at ECC L, so each
+    # case exercises the densest symbol of its version.
+    stem = "https://wplace.live/?lat=12.3456&lng=-65.4321&zoom=14.25#"
+    text = stem * (web_app.DATA_CODEWORDS['l'][version - 1] // len(stem) + 1)
+
+    def fits(n: int) -> bool:
+        try:
+            return web_app.plan_qr(text[:n]).version <= version
+        except ValueError:
+            return False
+
+    lo, hi = 1, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        lo, hi = (mid, hi) if fits(mid) else (lo, mid - 1)
+    return text[:lo]
+
+
+def build_cases(backends: List[str], quick: bool = False) -> List[Case]:
+    cases: List[Case] = []
+
+    def add(kind: str, **overrides: Any) -> None:
+        params = dict(BASE, **overrides)
+        name = "{kind}/{backend}/v{version}/s{scale}/b{border}/{alpha}".format(
+            kind=kind, alpha='transparent' if params['transparent'] else 'opaque', **params)
+        if all(c.name != name for c in cases):
+            cases.append(Case(name, kind, **params))
+
+    versions = VERSIONS[::3] if quick else VERSIONS
+    for version in versions:
+        add('generate', version=version)
+        add('render', version=version)
+    for scale in (SCALES[::2] if quick else SCALES):
+        add('render', scale=scale)
+    for border in (BORDERS[::2] if quick else BORDERS):
+        add('render', border=border)
+    for transparent in (False, True):
+        add('render', transparent=transparent)
+    for backend in backends:
+        for version in BACKEND_VERSIONS:
+            add('generate', version=version, backend=backend)
+    add('render', version=40, scale=50, border=50)
+    for version in (1, 40):
+        add('filename', version=version)
+    return cases
+
+
+def case_runner(case: Case) -> Callable[[], int]:
+    data = payload_for_version(case.version)
+    options = dict(dark_color='#000000', light_color='#ffffff', transparent=case.transparent,
+                   border=case.border, scale=case.scale)
+    if case.kind == 'filename':
+        return lambda: len(web_app.filename_for_data(data, 'png'))
+    if case.kind == 'generate':
+        def run() -> int:
+            web_app.MATRIX_CACHE.clear()
+            return len(web_app.generate_qr_bytes(data, **options)[0])
+        return run
+    encoded = web_app.encode_qr(data)
+    return lambda: len(web_app.render_qr(encoded, **options))
+
+
+_BACKENDS: Dict[str, 'web_app.QRBackend'] = {}
+
+
+def backend_for(name: str) -> 'web_app.QRBackend':
+    if name not in _BACKENDS:
+        _BACKENDS[name] = web_app.resolve_backend(name)
+    return _BACKENDS[name]
+
+
+def measure(case: Case, min_runs: int, min_time: float) -> Result:
+    web_app.use_backend(backend_for(case.backend))
+    web_app.MATRIX_CACHE.clear()
+    run = case_runner(case)
+    output = run()  # warm-up; also the output size
+
+    timings: List[float] = []
+    started = time.perf_counter()
+    while len(timings) < min_runs or time.perf_counter() - started < min_time:
+        t0 = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+
+    # Peak memory is taken on a separate run: tracemalloc would skew the timings.
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    return Result(
+        runs=len(timings),
+        ops_per_sec=round(len(timings) / sum(timings), 1),
+        p50_ms=round(statistics.median(timings) * 1000, 4),
+        p99_ms=round(p99 * 1000, 4),
+        peak_kib=round(peak / 1024, 1),
+        output_bytes=output,
+    )
+
+
+def compare(results: Dict[str, Result], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    problems = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if result.p50_ms > old['p50_ms'] * (1 + tolerance):
+            problems.append(f"{name}: p50 {old['p50_ms']:.3f} -> {result.p50_ms:.3f} ms")
+        if result.peak_kib > old['peak_kib'] * (1 + tolerance) + 16:
+            problems.append(f"{name}: peak memory {old['peak_kib']:.1f} -> {result.peak_kib:.1f} KiB")
+        if result.output_bytes != old['output_bytes']:
+            problems.append(f"{name}: output {old['output_bytes']} -> {result.output_bytes} bytes")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', metavar='JSON', help="write results as a baseline file")
+    parser.add_argument('--compare', metavar='JSON', help="fail on regressions against this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown/memory growth (default 0.25)")
+    parser.add_argument('--min-runs', type=int, default=10)
+    parser.add_argument('--min-time', type=float, default=0.25, help="seconds per case (default 0.25)")
+    parser.add_argument('--filter', default='', help="only run cases whose name contains this")
+    parser.add_argument('--quick', action='store_true', help="fewer sweep points")
+    args = parser.parse_args(argv)
+
+    backends = list(web_app.available_backends())
+    cases = [c for c in build_cases(backends, args.quick) if args.filter in c.name and c.backend in backends]
+    results: Dict[str, Result] = {}
+    print(f"{'case':<46} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'peak KiB':>10} {'bytes':>10}")
+    for case in cases:
+        result = results[case.name] = measure(case, args.min_runs, args.min_time)
+        print(f"{case.name:<46} {result.ops_per_sec:>10} {result.p50_ms:>10.3f} {result.p99_ms:>10.3f} "
+              f"{result.peak_kib:>10.1f} {result.output_bytes:>10}")
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': {name: r._asdict() for name, r in results.items()},
+            }, fh, indent=1)
+        print(f"baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        problems = compare(results, baseline['results'], args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            return 1
+        print(f"no regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""Load generator replaying live-typing traces against the app.
+
+    python loadtest.py                                  # start `serve` locally, 20 users, 30 s
+    python loadtest.py --users 100 --workers 4 --threads 8
+    python loadtest.py --server dev                     # compare with Flask's threaded server
+    python loadtest.py --url http://127.0.0.1:5000      # an instance that is already running
+    python loadtest.py --record trace.jsonl             # save the synthetic trace ...
+    python loadtest.py --trace trace.jsonl              # ... and replay exactly that later
+
+A trace is a list of sessions, one JSON object per line:
+{"events": [{"t": 0.0, "data": "h", "scale": 1, "border": 0, "optimize": false}, ...]}
+Each event is the form state after a keystroke or slider step, `t` seconds into
+the session. Like the page, a state is only sent once no newer one follows
+within --debounce. With --pattern pairs (default) every sent state is a
+/download + /meta pair. With --pattern page it is a /matrix request, plus one
+/download when the session ends.
+
+Each virtual user replays sessions back to back until --duration runs out.
+Reported: throughput, p50/p95/p99 latency per route, errors, shed requests
+(429/503), and the server's CPU time and peak RSS (Linux /proc, local servers only).
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import urlencode, urlsplit
+
+SEED_URLS = (
+    'https://wplace.live',
+    'https://wplace.live/?lat=48.8566&lng=2.3522&zoom=14.5',
+    'https://wplace.live/?lat=40.7128&lng=-74.0060&zoom=13.02',
+    'https://wplace.live/?lat=35.6762&lng=139.6503&zoom=15.75&select=0',
+    'https://wplace.live/?lat=-33.8688&lng=151.2093&zoom=12.1',
+    'https://mon5termatt.com',
+    'https://github.com/mon5termatt/qr-wplace',
+    'https://wplace.live/?lat=51.5074&lng=-0.1278&zoom=16.3#art',
+)
+SHED_STATUSES = (429, 503)
+
+
+class Sample(NamedTuple):
+    route: str
+    status: int  # 0 when the request failed without a response
+    seconds: float
+
+
+def synthetic_session(url: str, rng: random.Random) -> Dict[str, Any]:
+    # Types the URL one character at a time, then sometimes drags the scale
+    # and border sliders.
+    events = []
+    t = 0.0
+    state = dict(data='', scale=1, border=0, optimize=False)
+    for ch in url:
+        t += rng.uniform(0.05, 0.25)
+        state['data'] += ch
+        events.append(dict(state, t=round(t, 3)))
+    for field, top in (('scale', 50), ('border', 50)):
+        if rng.random() < 0.3:
+            t += rng.uniform(0.3, 1.0)
+            for value in range(state[field] + 1, rng.randint(2, top) + 1):
+                t += 0.03
+                state[field] = value
+                events.append(dict(state, t=round(t, 3)))
+    return dict(events=events)
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding='utf-8') as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def debounced(events: List[Dict[str, Any]], debounce: float) -> List[Dict[str, Any]]:
+    return [e for i, e in enumerate(events) if i + 1 == len(events) or events[i + 1]['t'] - e['t'] >= debounce]
+
+
+def requests_for(state: Dict[str, Any], pattern: str, last: bool) -> List[str]:
+    params = dict(data=state['data'], dark='#000000', light='#ffffff', transparent='0',
+                  border=state.get('border', 0), scale=state.get('scale', 1))
+    if state.get('optimize'):
+        params['optimize'] = '1'
+    if pattern == 'pairs':
+        return [f"/download?{urlencode(params)}", f"/meta?{urlencode(params)}"]
+    matrix = dict(data=state['data'], **({'optimize': '1'} if state.get('optimize') else {}))
+    return [f"/matrix?{urlencode(matrix)}"] + ([f"/download?{urlencode(params)}"] if last else [])
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, host: str, port: int, sessions: List[Dict[str, Any]], args: argparse.Namespace,
+                 deadline: float, delay: float, samples: List[Sample], index: int) -> None:
+        super().__init__(daemon=True)
+        self.host, self.port = host, port
+        self.sessions = sessions
+        self.args = args
+        self.deadline = deadline
+        self.delay = delay
+        self.samples = samples
+        self.index = index
+        self.conn: Optional[http.client.HTTPConnection] = None
+
+    def fetch(self, path: str) -> None:
+        route = path.split('?', 1)[0]
+        started = time.perf_counter()
+        status = 0
+        for attempt in (1, 2):  # one retry on a connection the server closed
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.args.timeout)
+                self.conn.request('GET', path)
+                resp = self.conn.getresponse()
+                resp.read()
+                status = resp.status
+                if resp.will_close:
+                    self.conn.close()
+                    self.conn = None
+                break
+            except (OSError, http.client.HTTPException):
+                if self.conn is not None:
+                    self.conn.close()
+                self.conn = None
+                if attempt == 2 or time.perf_counter() - started > self.args.timeout:
+                    break
+        self.samples.append(Sample(route, status, time.perf_counter() - started))
+
+    def run(self) -> None:
+        time.sleep(self.delay)
+        n = self.index
+        while time.monotonic() < self.deadline:
+            events = debounced(self.sessions[n % len(self.sessions)]['events'], self.args.debounce)
+            n += len(self.sessions) // max(1, self.args.users) + 1
+            begin = time.monotonic()
+            for i, state in enumerate(events):
+                due = begin + state['t'] / self.args.speed
+                now = time.monotonic()
+                if due >= self.deadline or now >= self.deadline:
+                    return
+                if due > now:
+                    time.sleep(due - now)
+                for path in requests_for(state, self.args.pattern, i + 1 == len(events)):
+                    self.fetch(path)
+            time.sleep(self.args.think / self.args.speed)
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids, todo = [], [pid]
+    while todo:
+        current = todo.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as fh:
+                    todo.extend(int(child) for child in fh.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _proc_usage(pid: int) -> Optional[tuple]:
+    # (cpu seconds, rss bytes) of a process and its children, from /proc.
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    cpu = rss = 0.0
+    try:
+        for p in _process_tree(pid):
+            try:
+                with open(f'/proc/{p}/stat') as fh:
+                    fields = fh.read().rsplit(')', 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / ticks
+                rss += int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+            except (OSError, IndexError, ValueError):
+                continue
+    except OSError:
+        return None
+    return cpu, rss
+
+
+class ResourceMonitor(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.5) -> None:
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.first = _proc_usage(pid)
+        self.last = self.first
+        self.peak_rss = self.first[1] if self.first else 0.0
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            usage = _proc_usage(self.pid)
+            if usage is not None:
+                self.last = usage
+                self.peak_rss = max(self.peak_rss, usage[1])
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+def start_server(args: argparse.Namespace) -> tuple:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    here = os.path.dirname(os.path.abspath(__file__))
+    if args.server == 'serve':
+        cmd = [sys.executable, os.path.join(here, 'web_app.py'), 'serve', '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(args.workers), '--threads', str(args.threads)]
+    else:
+        cmd = [sys.executable, '-c', f"import web_app; web_app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    proc = subprocess.Popen(cmd, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with status {proc.returncode}: {' '.join(cmd)}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("server did not start within 30 s")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def summarize(samples: List[Sample], seconds: float) -> Dict[str, Any]:
+    routes: Dict[str, Any] = {}
+    for route in sorted({s.route for s in samples}) + ['all']:
+        group = [s for s in samples if route == 'all' or s.route == route]
+        ok = sorted(s.seconds for s in group if 200 <= s.status < 400)
+        shed = sum(1 for s in group if s.status in SHED_STATUSES)
+        errors = len(group) - len(ok) - shed
+        routes[route] = dict(
+            requests=len(group),
+            rps=round(len(group) / seconds, 1),
+            p50_ms=round(statistics.median(ok) * 1000, 1) if ok else None,
+            p95_ms=round(percentile(ok, 0.95) * 1000, 1) if ok else None,
+            p99_ms=round(percentile(ok, 0.99) * 1000, 1) if ok else None,
+            error_rate=round(errors / len(group), 4),
+            shed_rate=round(shed / len(group), 4),
+        )
+    return routes
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="target a running instance instead of starting one")
+    parser.add_argument('--server', choices=('serve', 'dev'), default='serve', help="local server mode (default serve)")
+    parser.add_argument('--workers', type=int, default=2, help="workers for --server serve (default 2)")
+    parser.add_argument('--threads', type=int, default=8, help="threads per worker for --server serve (default 8)")
+    parser.add_argument('--users', type=int, default=20, help="concurrent virtual users (default 20)")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of load (default 30)")
+    parser.add_argument('--ramp', type=float, default=5.0, help="seconds over which users start (default 5)")
+    parser.add_argument('--trace', help="replay sessions from this JSONL trace instead of synthetic ones")
+    parser.add_argument('--urls', help="file of URLs (one per line) to type in synthetic sessions")
+    parser.add_argument('--sessions', type=int, default=200, help="synthetic sessions to generate (default 200)")
+    parser.add_argument('--record', help="write the sessions used to this JSONL trace")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--pattern', choices=('pairs', 'page'), default='pairs',
+                        help="requests per state: /download+/meta pairs or the page's /matrix (default pairs)")
+    parser.add_argument('--debounce', type=float, default=0.12, help="client debounce in seconds (default 0.12)")
+    parser.add_argument('--think', type=float, default=2.0, help="pause between a user's sessions (default 2 s)")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed factor (default 1 = real time)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="per-request timeout (default 30 s)")
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    if args.trace:
+        sessions = load_trace(args.trace)
+    else:
+        urls = SEED_URLS
+        if args.urls:
+            with open(args.urls, encoding='utf-8') as fh:
+                urls = tuple(line.strip() for line in fh if line.strip())
+        sessions = [synthetic_session(rng.choice(urls), rng) for _ in range(args.sessions)]
+    sessions = [s for s in sessions if s.get('events')]
+    if not sessions:
+        raise SystemExit("no sessions to replay")
+    if args.record:
+        with open(args.record, 'w', encoding='utf-8') as fh:
+            for session in sessions:
+                fh.write(json.dumps(session) + '\n')
+
+    proc = None
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname or '127.0.0.1', target.port or 80
+    else:
+        proc, port = start_server(args)
+        host = '127.0.0.1'
+    monitor = ResourceMonitor(proc.pid) if proc is not None and os.path.isdir(f'/proc/{proc.pid}') else None
+    if monitor is not None:
+        monitor.start()
+
+    samples: List[Sample] = []
+    started = time.monotonic()
+    deadline = started + args.duration
+    users = [VirtualUser(host, port, sessions, args, deadline, args.ramp * i / max(1, args.users), samples, i)
+             for i in range(args.users)]
+    try:
+        for user in users:
+            user.start()
+        for user in users:
+            user.join(args.duration + args.timeout + 5)
+        elapsed = time.monotonic() - started
+    finally:
+        if monitor is not None:
+            monitor.stop()
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    if not samples:
+        raise SystemExit("no requests completed")
+    routes = summarize(samples, elapsed)
+    report: Dict[str, Any] = dict(
+        target=args.url or f"local {args.server}" + (f" {args.workers}x{args.threads}" if args.server == 'serve' else ''),
+        users=args.users, pattern=args.pattern, seconds=round(elapsed, 1), routes=routes)
+    if monitor is not None and monitor.first is not None:
+        cpu = monitor.last[0] - monitor.first[0]
+        report['server'] = dict(cpu_seconds=round(cpu, 2), cpu_percent=round(100 * cpu / elapsed, 1),
+                                peak_rss_mib=round(monitor.peak_rss / 2 ** 20, 1))
+
+    print(f"{report['target']}, {args.users} users, pattern {args.pattern}, {report['seconds']} s")
+    print(f"{'route':<12} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8} {'shed':>8}")
+    for route, r in routes.items():
+        cells = [f"{r[k]:>9.1f}" if r[k] is not None else f"{'-':>9}" for k in ('p50_ms', 'p95_ms', 'p99_ms')]
+        print(f"{route:<12} {r['requests']:>9} {r['rps']:>8} {' '.join(cells)} "
+              f"{r['error_rate']:>8.2%} {r['shed_rate']:>8.2%}")
+    if 'server' in report:
+        s = report['server']
+        print(f"server: {s['cpu_seconds']} s CPU ({s['cpu_percent']}% of one core), peak RSS {s['peak_rss_mib']} MiB")
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(report, fh, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_fastest_is_resolved_once_and_passed_to_spawned_children(tmp_path):
+    script = textwrap.dedent("""
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        import web_app
+
+        def child_choice():
+            return web_app.BACKEND_CHOICE, web_app.BACKEND.name
+
+        if __name__ == '__main__':
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                choice, name = pool.submit(child_choice).result()
+            assert web_app.BACKEND_CHOICE == 'fastest'
+            assert choice == name == web_app.BACKEND.name, (choice, name, web_app.BACKEND.name)
+            print('ok')
+    """)
+    env = dict(os.environ, QR_BACKEND='fastest', PYTHONPATH=ROOT)
+    path = tmp_path / 'spawn_check.py'
+    path.write_text(script)
+    out = subprocess.run([sys.executable, str(path)], env=env, cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert out.stdout.strip() == 'ok', out.stderr
@@ -0,0 +1,30 @@
+import io
+import json
+import zipfile
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import web_app
+
+
+def test_json_batch_renders_every_item():
+    resp = web_app.app.test_client().post('/batch?scale=2', json=['https://wplace.live/a', {'data': 'b', 'format': 'svg'}])
+    assert resp.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(resp.data))
+    manifest = json.loads(archive.read('manifest.json'))
+    assert len(manifest) == 2 and all('error' not in entry for entry in manifest)
+
+
+def test_oversized_json_batch_is_refused(monkeypatch):
+    monkeypatch.setattr(web_app, 'BATCH_MAX_JSON_BYTES', 100)
+    body = json.dumps(['https://wplace.live/' + str(i) for i in range(20)])
+    client = web_app.app.test_client()
+    assert client.post('/batch', data=body, content_type='application/json').status_code == 413
+
+    # No Content-Length (a chunked upload): the read itself is bounded.
+    environ = EnvironBuilder('/batch', method='POST', input_stream=io.BytesIO(body.encode('utf-8')),
+                             content_type='application/json',
+                             environ_overrides={'wsgi.input_terminated': True}).get_environ()
+    del environ['CONTENT_LENGTH']
+    _, status, _ = run_wsgi_app(web_app.app, environ, buffered=True)
+    assert status.startswith('413')
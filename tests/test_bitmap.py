@@ -0,0 +1,22 @@
+import web_app
+
+
+def test_bitmap_options_are_clamped_to_the_page_ranges():
+    client = web_app.app.test_client()
+    big = client.get('/bitmap?text=HI&scale=200&border=80&letter_spacing=99&space_width=9')
+    capped = client.get('/bitmap?text=HI&scale=50&border=50&letter_spacing=10&space_width=5')
+    assert big.status_code == capped.status_code == 200
+    assert big.headers['X-Pixels-Total'] == capped.headers['X-Pixels-Total']
+
+
+def test_oversized_bitmap_is_refused():
+    resp = web_app.app.test_client().get('/bitmap?text=' + 'A' * 5000 + '&scale=50&border=50')
+    assert resp.status_code == 400
+
+
+def test_heavy_bitmap_is_admission_gated(monkeypatch):
+    gate = web_app.AdmissionControl(heavy=1000, slots=1, queue=0, wait=0)
+    gate.active = 1  # the only slot is taken
+    monkeypatch.setattr(web_app, 'RENDER_ADMISSION', gate)
+    resp = web_app.app.test_client().get('/bitmap?text=HELLO&scale=20')
+    assert resp.status_code == 429 and 'Retry-After' in resp.headers
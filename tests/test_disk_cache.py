@@ -0,0 +1,37 @@
+import os
+import threading
+
+import pytest
+
+import web_app
+
+
+def _sweepers():
+    return [t for t in threading.enumerate() if t.name == 'qr-disk-cache']
+
+
+def test_deferred_maintenance_sweeps_inline(tmp_path):
+    cache = web_app.DiskCache(str(tmp_path), max_bytes=1, max_age=3600)
+    with cache.deferred_maintenance():
+        cache.put_matrix('a', web_app.encode_qr('a'))
+        cache.put_matrix('b', web_app.encode_qr('b'))
+        assert not _sweepers()
+    assert not cache._maintaining
+    # Over the byte cap, the closing sweep evicted down to nothing.
+    assert cache.get_matrix('a') is None and cache.get_matrix('b') is None
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork()")
+def test_after_fork_forgets_a_running_sweep(tmp_path):
+    cache = web_app.DiskCache(str(tmp_path), max_bytes=1 << 30, max_age=3600)
+    os.register_at_fork(after_in_child=cache.after_fork)
+    cache._maintaining = True  # as if a sweep thread were running at fork
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write, b'1' if cache._maintaining else b'0')
+        os._exit(0)
+    os.close(write)
+    assert os.read(read, 1) == b'0'
+    os.waitpid(pid, 0)
+    os.close(read)
@@ -0,0 +1,91 @@
+import base64
+import json
+import os
+import socket
+import struct
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import web_app
+
+
+@pytest.fixture
+def server():
+    srv = make_server('127.0.0.1', 0, web_app.app, threaded=True)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv.server_port
+    web_app.LIVE_SHUTDOWN.set()
+    srv.shutdown()
+    web_app.LIVE_SHUTDOWN.clear()
+
+
+def _connect(port):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    sock.sendall((f"GET /live HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode('ascii'))
+    head = b''
+    while b'\r\n\r\n' not in head:
+        head += sock.recv(1)
+    assert head.startswith(b'HTTP/1.1 101')
+    return sock
+
+
+def _send(sock, message):
+    payload = json.dumps(message).encode('utf-8')
+    mask = os.urandom(4)
+    masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    sock.sendall(struct.pack('!BB', 0x81, 0x80 | len(payload)) + mask + masked)
+
+
+def _receive(sock):
+    def read(n):
+        data = b''
+        while len(data) < n:
+            chunk = sock.recv(n - len(data))
+            assert chunk, "connection closed"
+            data += chunk
+        return data
+
+    first, second = read(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', read(2))[0]
+    return first & 0x0F, read(length)
+
+
+def test_live_reports_failed_states_and_keeps_the_session(server, monkeypatch):
+    real = web_app.matrix_payload
+
+    def flaky(data, optimize):
+        if data == 'boom':
+            raise RuntimeError("boom")
+        return real(data, optimize)
+
+    monkeypatch.setattr(web_app, 'matrix_payload', flaky)
+    sock = _connect(server)
+    _send(sock, {"seq": 1, "params": {"data": "boom"}})
+    opcode, payload = _receive(sock)
+    assert opcode == 0x1
+    reply = json.loads(payload)
+    assert reply['seq'] == 1 and 'error' in reply
+    _send(sock, {"seq": 2, "params": {"data": "hello"}})
+    opcode, payload = _receive(sock)
+    assert json.loads(payload)['seq'] == 2 and 'bits' in json.loads(payload)
+    sock.close()
+
+
+def test_live_session_failure_closes_instead_of_http_500(server, monkeypatch):
+    def broken(ws):
+        raise RuntimeError("broken session")
+
+    monkeypatch.setattr(web_app, 'live_session', broken)
+    sock = _connect(server)
+    opcode, payload = _receive(sock)
+    assert opcode == 0x8 and struct.unpack('!H', payload[:2])[0] == 1011
+    sock.settimeout(2)
+    assert sock.recv(100) == b''
+    sock.close()
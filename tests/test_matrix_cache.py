@@ -0,0 +1,11 @@
+import web_app
+
+
+def test_cold_encode_counts_one_miss():
+    web_app.MATRIX_CACHE.clear()
+    before = web_app.MATRIX_CACHE.stats()
+    web_app.encode_qr('https://wplace.live/?cold-encode')
+    web_app.encode_qr('https://wplace.live/?cold-encode')
+    after = web_app.MATRIX_CACHE.stats()
+    assert after['misses'] - before['misses'] == 1
+    assert after['hits'] - before['hits'] == 1
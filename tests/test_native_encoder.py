@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+import web_app
+
+segno = pytest.importorskip('segno')
+
+# Alphabets that each pin the planner (and segno) to one mode. Latin-1 text is
+# mostly ASCII: segno reads some short Latin-1 strings that happen to be valid
+# Shift JIS (e.g. 'éa') as kanji, where the native planner picks byte mode; see
+# test_latin1_pairs_stay_byte_mode.
+ALPHABETS = {
+    'numeric': '0123456789',
+    'alphanumeric': web_app.ALPHANUMERIC_CHARS.decode('ascii'),
+    'byte': 'abcdefghijklmnopqrstuvwxyz/?=&.:-_éüßñ',
+    'byte-utf8': 'abc/?=✓→★€😀',
+    'kanji': '漢字日本語東京大阪テスト',
+}
+MODE_OF = {'byte-utf8': 'byte'}
+
+
+def payload(alphabet: str, version: int, error: str, rng: random.Random) -> str:
+    # Longest payload from `alphabet` that still fits `version`, so every
+    # version is exercised with a full data region.
+    text = ''.join(rng.choice(alphabet) for _ in range(8000))
+
+    def fits(n: int) -> bool:
+        try:
+            return web_app.plan_qr(text[:n], error).version <= version
+        except ValueError:
+            return False
+
+    lo, hi = 1, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        lo, hi = (mid, hi) if fits(mid) else (lo, mid - 1)
+    return text[:lo]
+
+
+def _segno(data: str, plan, mask):
+    qr = segno.make(data, version=plan.version, error=plan.error, mask=mask, micro=False, boost_error=False)
+    return web_app.matrix_to_int(tuple(bytes(row) for row in qr.matrix)), qr.mask
+
+
+@pytest.mark.parametrize('version', range(1, 41))
+def test_native_matches_segno(version):
+    rng = random.Random(version)
+    for e, error in enumerate(web_app.ECC_LEVELS):
+        for m, (name, alphabet) in enumerate(ALPHABETS.items()):
+            data = payload(alphabet, version, error, rng)
+            plan = web_app.plan_qr(data, error, min_version=version)
+            assert (plan.version, plan.mode) == (version, MODE_OF.get(name, name))
+            mask = (version + e + m) % 8
+            assert web_app.native_encode(plan, mask) == _segno(data, plan, mask), (name, error, mask)
+        # Automatic mask selection, one mode per (version, ECC level).
+        name, alphabet = list(ALPHABETS.items())[(version + e) % len(ALPHABETS)]
+        data = payload(alphabet, version, error, rng)
+        plan = web_app.plan_qr(data, error)
+        assert web_app.native_encode(plan) == _segno(data, plan, None), (name, error, 'auto')
+
+
+def test_native_matches_segno_on_random_urls():
+    rng = random.Random(0)
+    chars = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789/?=&.:-_%#'
+    for _ in range(200):
+        data = 'https://wplace.live/' + ''.join(rng.choice(chars) for _ in range(rng.randint(0, 300)))
+        plan = web_app.plan_qr(data, rng.choice(web_app.ECC_LEVELS))
+        assert web_app.native_encode(plan) == _segno(data, plan, None), data
+
+
+def test_latin1_pairs_stay_byte_mode():
+    # Known difference: segno tries Shift JIS on 'éa' and encodes it as one kanji.
+    assert segno.make('éa').mode == 'kanji'
+    plan = web_app.plan_qr('éa')
+    assert plan.mode == 'byte' and plan.payload == 'éa'.encode('iso-8859-1')
@@ -0,0 +1,64 @@
+import pytest
+
+import web_app
+
+pytest.importorskip('segno')
+
+
+@pytest.mark.parametrize('data', ['漢字', '漢字テスト' * 20])
+def test_kanji_payloads_optimise(data):
+    result = web_app.optimize_qr(data)
+    assert result.segments == (('kanji', data),)
+    assert result.encoded.version == web_app.plan_version(data)
+    assert result.dark == sum(row.count(1) for row in result.encoded.matrix)
+
+
+def test_kanji_segment_bits():
+    assert web_app._segment_bits('漢字', 'kanji') == 26
+    assert web_app.segmentation_bits((('kanji', '漢字'),), 1) == 4 + 8 + web_app.plan_qr('漢字').data_bits
+
+
+@pytest.mark.parametrize('path', ['/download?data=漢字&optimize=1', '/matrix?data=漢字&optimize=1', '/optimize?data=漢字'])
+def test_kanji_optimise_routes(path):
+    assert web_app.app.test_client().get(path).status_code == 200
+
+
+@pytest.mark.parametrize('data', ['ｱ' * 6 + 'a', 'ｶﾀｶﾅ https://wplace.live'])
+def test_shift_jis_byte_payloads_match_the_planner(data):
+    plan = web_app.plan_qr(data)
+    assert (plan.mode, plan.encoding) == ('byte', 'shift_jis')
+    result = web_app.optimize_qr(data)
+    assert result.segments == (('byte', data),)
+    matrix, _ = web_app.native_encode(web_app.plan_qr(data, result.error), result.mask)
+    assert web_app.matrix_to_int(result.encoded.matrix) == matrix
+
+
+@pytest.mark.parametrize('path', ['/download', '/matrix', '/meta', '/optimize'])
+def test_shift_jis_byte_optimise_routes(path):
+    resp = web_app.app.test_client().get(path, query_string={'data': 'ｱ' * 6 + 'a', 'optimize': '1'})
+    assert resp.status_code == 200
+
+
+def test_without_segno_optimize_is_reported_and_keyed_as_plain(monkeypatch):
+    monkeypatch.setattr(web_app, 'SEGNO_AVAILABLE', False)
+    client = web_app.app.test_client()
+    plain = client.get('/matrix?data=no-segno-here')
+    asked = client.get('/matrix?data=no-segno-here&optimize=1')
+    assert asked.json['optimized'] is False and asked.json == plain.json
+    assert asked.headers['ETag'] == plain.headers['ETag']
+    assert client.get('/meta?data=no-segno-here&optimize=1').json['optimized'] is False
+    assert 'optimize' not in web_app.qr_permalink('no-segno-here', dict(optimize=True))
+    assert '\x00optimize\x00no-segno-here' not in web_app.MATRIX_CACHE._items
+    assert client.get('/optimize?data=no-segno-here').status_code == 501
+
+
+@pytest.mark.parametrize('body', [{'data': 'x', 'errors': 1}, {'data': 'x', 'errors': ['l']}, {'data': 'x', 'errors': 'lz'},
+                                  {'data': 'x', 'background': 3}, {'data': 7}])
+def test_optimize_rejects_malformed_json(body):
+    resp = web_app.app.test_client().post('/optimize', json=body)
+    assert resp.status_code == 400 and 'error' in resp.json
+
+
+def test_optimize_accepts_an_ecc_subset():
+    resp = web_app.app.test_client().post('/optimize', json={'data': 'https://wplace.live', 'errors': 'QH'})
+    assert resp.status_code == 200 and resp.json['error'] in ('Q', 'H')
@@ -0,0 +1,68 @@
+import tracemalloc
+import zlib
+
+import web_app
+
+
+def _v40_matrix():
+    data = 'x' * 2900
+    assert web_app.plan_qr(data).version == 40
+    return web_app.encode_qr(data).matrix
+
+
+def _idat(png: bytes) -> bytes:
+    out, pos = b'', 8
+    while pos < len(png):
+        length = int.from_bytes(png[pos:pos + 4], 'big')
+        if png[pos + 4:pos + 8] == b'IDAT':
+            out += png[pos + 8:pos + 8 + length]
+        pos += 12 + length
+    return out
+
+
+def test_iter_png_memory_ceiling():
+    # Version 40, border 50, scale 50: 14,250 px square (over 200 Mpx). Streamed,
+    # the peak is about one pixel row plus zlib's buffers (~370 KiB measured).
+    matrix = _v40_matrix()
+    total = 0
+    tracemalloc.start()
+    try:
+        for piece in web_app.iter_png(matrix, border=50, scale=50):
+            total += len(piece)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert total > 0
+    assert peak < 512 * 1024, f"peak {peak // 1024} KiB"
+
+
+def test_iter_png_matches_write_png():
+    matrix = _v40_matrix()
+    options = dict(border=3, scale=3, transparent=True)
+    streamed = b''.join(web_app.iter_png(matrix, chunk_size=1000, **options))
+    whole = web_app.write_png(matrix, **options)
+    assert streamed[:33] == whole[:33]
+    assert zlib.decompress(_idat(streamed)) == zlib.decompress(_idat(whole))
+
+
+def test_large_download_is_streamed(monkeypatch):
+    monkeypatch.setattr(web_app, 'PNG_STREAM_PIXELS', 100_000)
+    path = '/download?data=https://wplace.live&scale=20&border=4'
+    with web_app.app.test_request_context(path):
+        resp = web_app.app.full_dispatch_request()
+        assert resp.status_code == 200 and resp.mimetype == 'image/png'
+        assert resp.is_streamed and 'Content-Length' not in resp.headers
+        assert 'attachment' in resp.headers['Content-Disposition']
+        body = b''.join(resp.response)
+        resp.close()
+    expected, *_ = web_app.generate_qr_bytes('https://wplace.live', border=4, scale=20)
+    assert zlib.decompress(_idat(body)) == zlib.decompress(_idat(expected))
+    assert web_app.RENDER_ADMISSION.active == 0
+
+
+def test_small_download_is_rendered_whole(monkeypatch):
+    monkeypatch.setattr(web_app, 'PNG_STREAM_PIXELS', 100_000)
+    with web_app.app.test_request_context('/download?data=https://wplace.live&scale=2'):
+        resp = web_app.app.full_dispatch_request()
+        assert int(resp.headers['Content-Length']) > 0
+        resp.close()
@@ -1,8 +1,37 @@
 #!/usr/bin/env python3
+import argparse
+import base64
+import csv
+import gzip
 import io
-from typing import Optional, Tuple
+import itertools
+import json
+import multiprocessing
+import os
+import select
+import shutil
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import wait as futures_wait
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
 
-from flask import Flask, render_template_string, request, send_file, jsonify, Response
+from flask import Flask, g, request, send_file, jsonify, redirect, stream_with_context, Response
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import ClosingIterator
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 import re
 import hashlib
 
@@ -28,46 +57,8 @@ PAGE = r"""
     <meta name="twitter:card" content="summary" />
     <meta name="twitter:title" content="Minimal QR Generator" />
     <meta name="twitter:description" content="Generate tiny QR codes (21x21+), live preview, download." />
-    <style>
-      :root { color-scheme: light dark; }
-      body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Helvetica, Arial, sans-serif; padding: 24px; max-width: 820px; margin: 0 auto; line-height: 1.45; }
-      main { max-width: 820px; margin: 0 auto; padding: 24px; }
-      header { display: grid; place-items: center; gap: 12px; text-align: center; color: #fff; width: 100vw; margin-left: calc(50% - 50vw); max-height: 128px; background: #000; padding: 12px 0; }
-      header a { color: inherit; }
-      .brand-logo { max-width: 90vw; max-height: 128px; height: auto; display: block; image-rendering: -webkit-optimize-contrast; }
-      .tag { opacity: 0.9; font-size: 14px; }
-      form { display: grid; gap: 12px; grid-template-columns: 1fr; align-items: center; }
-      label { display: grid; gap: 6px; }
-      .row { display: flex; gap: 12px; align-items: center; flex-wrap: wrap; }
-      .controls { display: grid; gap: 12px; }
-      input[type=text] { padding: 10px 12px; font-size: 16px; border: 1px solid #ccc; border-radius: 8px; }
-      input[type=color] { width: 42px; height: 36px; padding: 0; border: 1px solid #ccc; border-radius: 6px; }
-      input[type=range] { width: 180px; }
-      button { padding: 10px 14px; font-size: 16px; cursor: pointer; border-radius: 8px; border: 1px solid #999; background: transparent; }
-      .preview { margin-top: 24px; display: grid; gap: 12px; align-items: start; grid-template-columns: 160px 1fr; }
-      img { image-rendering: pixelated; border: 1px solid #ddd; width: 145px; height: 145px; border-radius: 6px; background: #fff; cursor: pointer; }
-      .stats { font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, "Liberation Mono", monospace; }
-      .muted { opacity: 0.7; }
-      footer { margin-top: 28px; font-size: 14px; opacity: 0.75; text-align: center; }
-      a { color: inherit; }
-      .footer-buttons { display: flex; justify-content: center; align-items: center; gap: 12px; margin-top: 8px; flex-wrap: wrap; }
-      .btn { display: inline-block; padding: 10px 14px; border-radius: 999px; text-decoration: none; font-weight: 600; border: 1px solid #888; background: #111; color: #fff; }
-      .btn:hover { filter: brightness(1.15); }
-      .btn--rainbow {
-        background: #ff0040;
-        animation: rainbowSolid 2s linear infinite;
-        border: none; color: #fff;
-      }
-      @keyframes rainbowSolid {
-        0%   { background:#ff0040; }
-        16.6%{ background:#ff8c00; }
-        33.3%{ background:#ffee00; color:#000; }
-        50%  { background:#33cc33; color:#000; }
-        66.6%{ background:#00aaff; color:#fff; }
-        83.3%{ background:#8a2be2; color:#fff; }
-        100% { background:#ff0040; color:#fff; }
-      }
-    </style>
+    <link rel="stylesheet" href="{{ assets.css }}" />
+    <script src="{{ assets.js }}" defer></script>
   </head>
   <body>
     <header>
@@ -100,6 +91,9 @@ PAGE = r"""
           <label class="row" style="align-items:center;">
             <input id="transparent" type="checkbox" name="transparent" value="1" {% if transparent %}checked{% endif %} /> Transparent background
           </label>
+          <label class="row" style="align-items:center;" title="Search ECC levels, masks and segmentations for the symbol with the fewest dark modules">
+            <input id="optimize" type="checkbox" name="optimize" value="1" {% if optimize %}checked{% endif %} /> Fewest dark pixels
+          </label>
         </div>
         <div class="row">
           <label class="row" style="align-items:center;">
@@ -116,9 +110,10 @@ PAGE = r"""
       </div>
     </form>
 
-    <div class="preview" id="preview" data-black="{{ black or 0 }}" data-version="{{ version or 3 }}" style="{{ '' if data else 'display:none' }}">
+    <div class="preview" id="preview" data-black="{{ black or 0 }}" data-version="{{ version or 3 }}" data-bits="{{ bits or '' }}" style="{{ '' if data else 'display:none' }}">
       <div>
-        <img id="qrImg" src="{{ ('/download?data=' ~ (data|urlencode) ~ '&dark=' ~ (dark|urlencode) ~ '&light=' ~ (light|urlencode) ~ '&transparent=' ~ ((1 if transparent else 0)) ~ '&border=' ~ border ~ '&scale=' ~ scale) if data else 'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///ywAAAAAAQABAAACAUwAOw==' }}" alt="QR preview" />
+        <canvas id="qrCanvas" class="qr" width="0" height="0" aria-label="QR preview"></canvas>
+        {% if data %}<noscript><img src="{{ permalink }}" alt="QR preview" /></noscript>{% endif %}
       </div>
       <div class="stats">
         <div><strong>Version</strong>: <span id="ver">{{ version or 3 }}</span> (<span id="sizeValPx">{{ size or 29 }}</span>x<span id="sizeValPx2">{{ size or 29 }}</span>)</div>
@@ -126,7 +121,7 @@ PAGE = r"""
         <div><strong>Background</strong>: <span id="whiteVal">{{ white or 0 }}</span></div>
         <div><strong>Total</strong>: <span id="totalVal">{{ total or 841 }}</span></div>
         <div style="margin-top:8px">
-          <a id="dlLink" href="{{ ('/download?data=' ~ (data|urlencode) ~ '&dark=' ~ (dark|urlencode) ~ '&light=' ~ (light|urlencode) ~ '&transparent=' ~ ((1 if transparent else 0)) ~ '&border=' ~ border ~ '&scale=' ~ scale) if data else '#' }}">Download PNG</a>
+          <a id="dlLink" href="{{ permalink if data else '#' }}">Download PNG</a>
         </div>
         <div class="muted" style="margin-top:8px">Border: <span id="borderDisp">{{ border or 0 }}</span> · Scale: <span id="scaleDisp">{{ scale or 1 }}</span> px/module</div>
       </div>
@@ -194,512 +189,598 @@ PAGE = r"""
       </div>
     </footer>
   </body>
-  <script>
-    (function(){
-      // 5x7 font for A-Z, 0-9 and dash; using '#' for on pixels per column-major rows
-      const FONT_5x7 = {
-        'A': [0b01110,0b10001,0b10001,0b11111,0b10001,0b10001,0b10001],
-        'B': [0b11110,0b10001,0b10001,0b11110,0b10001,0b10001,0b11110],
-        'C': [0b01110,0b10001,0b10000,0b10000,0b10000,0b10001,0b01110],
-        'D': [0b11110,0b10001,0b10001,0b10001,0b10001,0b10001,0b11110],
-        'E': [0b11111,0b10000,0b10000,0b11110,0b10000,0b10000,0b11111],
-        'F': [0b11111,0b10000,0b10000,0b11110,0b10000,0b10000,0b10000],
-        'G': [0b01110,0b10001,0b10000,0b10111,0b10001,0b10001,0b01110],
-        'H': [0b10001,0b10001,0b10001,0b11111,0b10001,0b10001,0b10001],
-        'I': [0b01110,0b00100,0b00100,0b00100,0b00100,0b00100,0b01110],
-        'J': [0b00111,0b00010,0b00010,0b00010,0b10010,0b10010,0b01100],
-        'K': [0b10001,0b10010,0b10100,0b11000,0b10100,0b10010,0b10001],
-        'L': [0b10000,0b10000,0b10000,0b10000,0b10000,0b10000,0b11111],
-        'M': [0b10001,0b11011,0b10101,0b10101,0b10001,0b10001,0b10001],
-        'N': [0b10001,0b11001,0b10101,0b10011,0b10001,0b10001,0b10001],
-        'O': [0b01110,0b10001,0b10001,0b10001,0b10001,0b10001,0b01110],
-        'P': [0b11110,0b10001,0b10001,0b11110,0b10000,0b10000,0b10000],
-        'Q': [0b01110,0b10001,0b10001,0b10001,0b10101,0b10010,0b01101],
-        'R': [0b11110,0b10001,0b10001,0b11110,0b10100,0b10010,0b10001],
-        'S': [0b01111,0b10000,0b10000,0b01110,0b00001,0b00001,0b11110],
-        'T': [0b11111,0b00100,0b00100,0b00100,0b00100,0b00100,0b00100],
-        'U': [0b10001,0b10001,0b10001,0b10001,0b10001,0b10001,0b01110],
-        'V': [0b10001,0b10001,0b10001,0b10001,0b01010,0b01010,0b00100],
-        'W': [0b10001,0b10001,0b10001,0b10101,0b10101,0b11011,0b10001],
-        'X': [0b10001,0b01010,0b00100,0b00100,0b00100,0b01010,0b10001],
-        'Y': [0b10001,0b01010,0b00100,0b00100,0b00100,0b00100,0b00100],
-        'Z': [0b11111,0b00001,0b00010,0b00100,0b01000,0b10000,0b11111],
-        '0': [0b01110,0b11011,0b10101,0b10101,0b10101,0b10011,0b01110],
-        '1': [0b00100,0b01100,0b00100,0b00100,0b00100,0b00100,0b01110],
-        '2': [0b01110,0b10001,0b00001,0b00010,0b00100,0b01000,0b11111],
-        '3': [0b11110,0b00001,0b00001,0b01110,0b00001,0b00001,0b11110],
-        '4': [0b00010,0b00110,0b01010,0b10010,0b11111,0b00010,0b00010],
-        '5': [0b11111,0b10000,0b11110,0b00001,0b00001,0b10001,0b01110],
-        '6': [0b00110,0b01000,0b10000,0b11110,0b10001,0b10001,0b01110],
-        '7': [0b11111,0b00001,0b00010,0b00100,0b01000,0b01000,0b01000],
-        '8': [0b01110,0b10001,0b10001,0b01110,0b10001,0b10001,0b01110],
-        '9': [0b01110,0b10001,0b10001,0b01111,0b00001,0b00010,0b11100],
-        '-': [0b00000,0b00000,0b00000,0b11111,0b00000,0b00000,0b00000],
-        ' ': [0b00000,0b00000,0b00000,0b00000,0b00000,0b00000,0b00000],
-        "'": [0b00100,0b00100,0b01000,0b00000,0b00000,0b00000,0b00000],
-        '_': [0b00000,0b00000,0b00000,0b00000,0b00000,0b00000,0b11111],
-        '+': [0b00100,0b00100,0b11111,0b00100,0b00100,0b00000,0b00000],
-        '=': [0b00000,0b11111,0b00000,0b11111,0b00000,0b00000,0b00000],
-        '[': [0b11110,0b10000,0b10000,0b10000,0b10000,0b10000,0b11110],
-        ']': [0b01111,0b00001,0b00001,0b00001,0b00001,0b00001,0b01111],
-        '{': [0b00110,0b00100,0b00100,0b11000,0b00100,0b00100,0b00110],
-        '}': [0b01100,0b00100,0b00100,0b00011,0b00100,0b00100,0b01100],
-        '|': [0b00100,0b00100,0b00100,0b00100,0b00100,0b00100,0b00100],
-        '\\': [0b10000,0b01000,0b00100,0b00010,0b00001,0b00000,0b00000],
-        '/': [0b00001,0b00010,0b00100,0b01000,0b10000,0b00000,0b00000],
-        ':': [0b00000,0b00100,0b00000,0b00000,0b00000,0b00100,0b00000],
-        ';': [0b00000,0b00100,0b00000,0b00000,0b00000,0b00100,0b01000],
-        '"': [0b01010,0b01010,0b00000,0b00000,0b00000,0b00000,0b00000],
-        '>': [0b10000,0b01000,0b00100,0b00010,0b00100,0b01000,0b10000],
-        '<': [0b00001,0b00010,0b00100,0b01000,0b00100,0b00010,0b00001],
-        '.': [0b00000,0b00000,0b00000,0b00000,0b00000,0b00100,0b00000],
-        ',': [0b00000,0b00000,0b00000,0b00000,0b00000,0b00100,0b01000],
-        '?': [0b01110,0b10001,0b00010,0b00100,0b00100,0b00000,0b00100],
-        '#': [0b01010,0b01010,0b11111,0b01010,0b11111,0b01010,0b01010]
-      };
-
-      function measureWordPx(word, px, spacing){
-        const columnsPerChar = 5; const chars = String(word).toUpperCase().split('');
-        return chars.length * (columnsPerChar*px) + Math.max(0, chars.length-1) * (spacing*px);
+  </html>
+"""
+
+
+# Served from /assets/<name>.<hash>.<ext> (see STATIC_ASSETS), not inlined into PAGE.
+PAGE_CSS = r"""
+:root { color-scheme: light dark; }
+body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Helvetica, Arial, sans-serif; padding: 24px; max-width: 820px; margin: 0 auto; line-height: 1.45; }
+main { max-width: 820px; margin: 0 auto; padding: 24px; }
+header { display: grid; place-items: center; gap: 12px; text-align: center; color: #fff; width: 100vw; margin-left: calc(50% - 50vw); max-height: 128px; background: #000; padding: 12px 0; }
+header a { color: inherit; }
+.brand-logo { max-width: 90vw; max-height: 128px; height: auto; display: block; image-rendering: -webkit-optimize-contrast; }
+.tag { opacity: 0.9; font-size: 14px; }
+form { display: grid; gap: 12px; grid-template-columns: 1fr; align-items: center; }
+label { display: grid; gap: 6px; }
+.row { display: flex; gap: 12px; align-items: center; flex-wrap: wrap; }
+.controls { display: grid; gap: 12px; }
+input[type=text] { padding: 10px 12px; font-size: 16px; border: 1px solid #ccc; border-radius: 8px; }
+input[type=color] { width: 42px; height: 36px; padding: 0; border: 1px solid #ccc; border-radius: 6px; }
+input[type=range] { width: 180px; }
+button { padding: 10px 14px; font-size: 16px; cursor: pointer; border-radius: 8px; border: 1px solid #999; background: transparent; }
+.preview { margin-top: 24px; display: grid; gap: 12px; align-items: start; grid-template-columns: 160px 1fr; }
+img, canvas.qr { image-rendering: pixelated; border: 1px solid #ddd; width: 145px; height: 145px; border-radius: 6px; background: #fff; cursor: pointer; }
+.stats { font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, "Liberation Mono", monospace; }
+.muted { opacity: 0.7; }
+footer { margin-top: 28px; font-size: 14px; opacity: 0.75; text-align: center; }
+a { color: inherit; }
+.footer-buttons { display: flex; justify-content: center; align-items: center; gap: 12px; margin-top: 8px; flex-wrap: wrap; }
+.btn { display: inline-block; padding: 10px 14px; border-radius: 999px; text-decoration: none; font-weight: 600; border: 1px solid #888; background: #111; color: #fff; }
+.btn:hover { filter: brightness(1.15); }
+.btn--rainbow {
+  background: #ff0040;
+  animation: rainbowSolid 2s linear infinite;
+  border: none; color: #fff;
+}
+@keyframes rainbowSolid {
+  0%   { background:#ff0040; }
+  16.6%{ background:#ff8c00; }
+  33.3%{ background:#ffee00; color:#000; }
+  50%  { background:#33cc33; color:#000; }
+  66.6%{ background:#00aaff; color:#fff; }
+  83.3%{ background:#8a2be2; color:#fff; }
+  100% { background:#ff0040; color:#fff; }
+}
+"""
+
+
+PAGE_JS = r"""
+(function(){
+  // 5x7 font (rows of 5 bits, MSB = leftmost column); shared with the server-side FONT_5X7
+  const FONT_5x7 = __FONT_5X7__;
+
+  function measureWordPx(word, px, spacing){
+    const columnsPerChar = 5; const chars = String(word).toUpperCase().split('');
+    return chars.length * (columnsPerChar*px) + Math.max(0, chars.length-1) * (spacing*px);
+  }
+
+  const GLYPH_CACHE = {};
+
+  function synthesizeGlyph5x7(ch){
+    // Render the character to an offscreen canvas and sample to 5x7 bitmap
+    const off = document.createElement('canvas');
+    const W = 56, H = 56; // generous draw area
+    off.width = W; off.height = H;
+    const octx = off.getContext('2d');
+    octx.clearRect(0,0,W,H);
+    octx.fillStyle = '#000';
+    // Try to fit the glyph height to 7 rows with padding
+    const targetRows = 7;
+    // Start with a font size that fits vertically and adjust
+    let fontSize = 40;
+    octx.font = `${fontSize}px monospace`;
+    octx.textBaseline = 'middle';
+    octx.textAlign = 'center';
+    // Draw center, then sample
+    octx.fillText(ch, W/2, H/2);
+    // Convert to 5x7 by sampling blocks
+    const cols = 5; const rows = 7;
+    const margin = 6; // around the glyph for safety
+    const sampleWidth = W - margin*2;
+    const sampleHeight = H - margin*2;
+    const cellW = sampleWidth / cols;
+    const cellH = sampleHeight / rows;
+    const data = octx.getImageData(0,0,W,H).data;
+    const bitmap = [];
+    for (let r=0; r<rows; r++){
+      let rowBits = 0;
+      for (let c=0; c<cols; c++){
+        // Sample a point near the center of the cell
+        const sx = Math.floor(margin + c*cellW + cellW/2);
+        const sy = Math.floor(margin + r*cellH + cellH/2);
+        const idx = (sy*W + sx) * 4;
+        const alpha = data[idx+3];
+        const on = alpha > 32 ? 1 : 0;
+        rowBits = (rowBits << 1) | on;
       }
+      bitmap.push(rowBits);
+    }
+    return bitmap;
+  }
+
+  function getGlyph5x7(ch){
+    const up = String(ch).toUpperCase();
+    if (FONT_5x7[up]) return FONT_5x7[up];
+    if (GLYPH_CACHE[up]) return GLYPH_CACHE[up];
+    const bm = synthesizeGlyph5x7(up);
+    GLYPH_CACHE[up] = bm;
+    return bm;
+  }
 
-      const GLYPH_CACHE = {};
-
-      function synthesizeGlyph5x7(ch){
-        // Render the character to an offscreen canvas and sample to 5x7 bitmap
-        const off = document.createElement('canvas');
-        const W = 56, H = 56; // generous draw area
-        off.width = W; off.height = H;
-        const octx = off.getContext('2d');
-        octx.clearRect(0,0,W,H);
-        octx.fillStyle = '#000';
-        // Try to fit the glyph height to 7 rows with padding
-        const targetRows = 7;
-        // Start with a font size that fits vertically and adjust
-        let fontSize = 40;
-        octx.font = `${fontSize}px monospace`;
-        octx.textBaseline = 'middle';
-        octx.textAlign = 'center';
-        // Draw center, then sample
-        octx.fillText(ch, W/2, H/2);
-        // Convert to 5x7 by sampling blocks
-        const cols = 5; const rows = 7;
-        const margin = 6; // around the glyph for safety
-        const sampleWidth = W - margin*2;
-        const sampleHeight = H - margin*2;
-        const cellW = sampleWidth / cols;
-        const cellH = sampleHeight / rows;
-        const data = octx.getImageData(0,0,W,H).data;
-        const bitmap = [];
-        for (let r=0; r<rows; r++){
-          let rowBits = 0;
-          for (let c=0; c<cols; c++){
-            // Sample a point near the center of the cell
-            const sx = Math.floor(margin + c*cellW + cellW/2);
-            const sy = Math.floor(margin + r*cellH + cellH/2);
-            const idx = (sy*W + sx) * 4;
-            const alpha = data[idx+3];
-            const on = alpha > 32 ? 1 : 0;
-            rowBits = (rowBits << 1) | on;
+  function drawWordAt(ctx, word, colorOrFn, xStart, yStart, px, totalWidth){
+    const columnsPerChar = 5; const rows = 7; const spacing = 2; const chars = String(word).toUpperCase().split('');
+    const isFn = typeof colorOrFn === 'function';
+    let x = xStart;
+    for (const ch of chars){
+      const glyphRows = getGlyph5x7(ch);
+      for (let row=0; row<rows; row++){
+        const bits = glyphRows[row] || 0;
+        for (let col=0; col<columnsPerChar; col++){
+          const on = (bits >> (columnsPerChar-1-col)) & 1;
+          if (on){
+            const xPos = x + col*px;
+            const t = totalWidth > 0 ? Math.min(1, Math.max(0, (xPos) / totalWidth)) : 0;
+            ctx.fillStyle = isFn ? colorOrFn(t) : colorOrFn;
+            ctx.fillRect(xPos, yStart + row*px, px, px);
           }
-          bitmap.push(rowBits);
         }
-        return bitmap;
       }
+      x += columnsPerChar*px + spacing*px;
+    }
+  }
 
-      function getGlyph5x7(ch){
-        const up = String(ch).toUpperCase();
-        if (FONT_5x7[up]) return FONT_5x7[up];
-        if (GLYPH_CACHE[up]) return GLYPH_CACHE[up];
-        const bm = synthesizeGlyph5x7(up);
-        GLYPH_CACHE[up] = bm;
-        return bm;
-      }
+  function hslToRgb(h, s, l){
+    h = (h % 360 + 360) % 360; s = Math.max(0, Math.min(1, s)); l = Math.max(0, Math.min(1, l));
+    const c = (1 - Math.abs(2*l - 1)) * s;
+    const x = c * (1 - Math.abs((h/60) % 2 - 1));
+    const m = l - c/2;
+    let r=0,g=0,b=0;
+    if (0<=h && h<60){ r=c; g=x; b=0; }
+    else if (60<=h && h<120){ r=x; g=c; b=0; }
+    else if (120<=h && h<180){ r=0; g=c; b=x; }
+    else if (180<=h && h<240){ r=0; g=x; b=c; }
+    else if (240<=h && h<300){ r=x; g=0; b=c; }
+    else { r=c; g=0; b=x; }
+    return [Math.round((r+m)*255), Math.round((g+m)*255), Math.round((b+m)*255)];
+  }
 
-      function drawWordAt(ctx, word, colorOrFn, xStart, yStart, px, totalWidth){
-        const columnsPerChar = 5; const rows = 7; const spacing = 2; const chars = String(word).toUpperCase().split('');
-        const isFn = typeof colorOrFn === 'function';
-        let x = xStart;
-        for (const ch of chars){
-          const glyphRows = getGlyph5x7(ch);
-          for (let row=0; row<rows; row++){
-            const bits = glyphRows[row] || 0;
-            for (let col=0; col<columnsPerChar; col++){
-              const on = (bits >> (columnsPerChar-1-col)) & 1;
-              if (on){
-                const xPos = x + col*px;
-                const t = totalWidth > 0 ? Math.min(1, Math.max(0, (xPos) / totalWidth)) : 0;
-                ctx.fillStyle = isFn ? colorOrFn(t) : colorOrFn;
-                ctx.fillRect(xPos, yStart + row*px, px, px);
-              }
-            }
-          }
-          x += columnsPerChar*px + spacing*px;
+  function drawLogo(canvas, topText, bottomText, color, hueOffset){
+    const ctx = canvas.getContext('2d');
+    const padding = 6; const spacingCols = 2; const lineGapPx = 8; // space between lines
+    let px = 6; // pixel block size
+    const columnsPerChar = 5; const rows = 7;
+    const wTop = measureWordPx(topText, px, spacingCols);
+    const wBot = measureWordPx(bottomText, px, spacingCols);
+    const widthPx = padding*2 + Math.max(wTop, wBot);
+    const heightPx = padding*2 + rows*px*2 + lineGapPx;
+    canvas.width = widthPx; canvas.height = heightPx;
+    ctx.clearRect(0,0,canvas.width,canvas.height);
+    // Center each line horizontally
+    const topX = padding + Math.floor((Math.max(wTop,wBot) - wTop)/2);
+    const botX = padding + Math.floor((Math.max(wTop,wBot) - wBot)/2);
+    const topY = padding;
+    const botY = padding + rows*px + lineGapPx;
+    const colorSupplier = (color === 'rainbow')
+      ? (t) => { const [r,g,b] = hslToRgb((t*360 + (hueOffset||0)), 1, 0.6); return `rgb(${r},${g},${b})`; }
+      : color;
+    drawWordAt(ctx, topText, colorSupplier, topX, topY, px, widthPx);
+    drawWordAt(ctx, bottomText, colorSupplier, botX, botY, px, widthPx);
+  }
+
+  const logo = document.getElementById('logoCanvas');
+  const darkInput = document.getElementById('dark');
+  if (logo){
+    let hue = 0;
+    function animate(ts){
+      hue = (hue + 0.6) % 360; // speed: degrees per frame
+      drawLogo(logo, 'QR Code Generator for wplace', 'by MON5TERMATT', 'rainbow', hue);
+      requestAnimationFrame(animate);
+    }
+    requestAnimationFrame(animate);
+  }
+  const qrCanvas = document.getElementById('qrCanvas');
+  const preview = document.getElementById('preview');
+  const border = document.getElementById('border');
+  const scale = document.getElementById('scale');
+  const dataInput = document.getElementById('dataInput');
+  const dark = document.getElementById('dark');
+  const light = document.getElementById('light');
+  const transparent = document.getElementById('transparent');
+  const optimize = document.getElementById('optimize');
+  if (!qrCanvas || !preview || !border || !scale) return;
+  let black = parseInt(preview.dataset.black || '0', 10);
+  let version = parseInt(preview.dataset.version || '3', 10);
+  let moduleBits = preview.dataset.bits ? decodeBits(preview.dataset.bits) : null;
+  function modulesFor(ver){ return 17 + 4 * ver; }
+  const borderVal = document.getElementById('borderVal');
+  const scaleVal = document.getElementById('scaleVal');
+  const sizeValPx = document.getElementById('sizeValPx');
+  const sizeValPx2 = document.getElementById('sizeValPx2');
+  const whiteEl = document.getElementById('whiteVal');
+  const totalEl = document.getElementById('totalVal');
+  const borderDisp = document.getElementById('borderDisp');
+  const scaleDisp = document.getElementById('scaleDisp');
+  const dl = document.getElementById('dlLink');
+  const bitmapCanvas = document.getElementById('bitmapCanvas');
+  const bitmapInput = document.getElementById('bitmapInput');
+  const bitmapScale = document.getElementById('bitmapScale');
+  const bitmapScaleVal = document.getElementById('bitmapScaleVal');
+  const bitmapBorder = document.getElementById('bitmapBorder');
+  const bitmapBorderVal = document.getElementById('bitmapBorderVal');
+  const letterSpacing = document.getElementById('letterSpacing');
+  const letterSpacingVal = document.getElementById('letterSpacingVal');
+  const spaceWidth = document.getElementById('spaceWidth');
+  const spaceWidthVal = document.getElementById('spaceWidthVal');
+  const invertColors = document.getElementById('invertColors');
+  const bitmapStats = document.getElementById('bitmapStats');
+  const bitmapBlackPixels = document.getElementById('bitmapBlackPixels');
+  const bitmapWhitePixels = document.getElementById('bitmapWhitePixels');
+  const bitmapTotalPixels = document.getElementById('bitmapTotalPixels');
+  const bitmapDownload = document.getElementById('bitmapDownload');
+
+  function currentParams() {
+    const params = new URLSearchParams(window.location.search);
+    // Pull form values directly
+    const darkVal = (dark ? dark.value : '#000000');
+    const lightVal = (light ? light.value : '#FFFFFF');
+    const transparentVal = (transparent && transparent.checked ? '1' : '0');
+    const dataField = (dataInput ? dataInput.value : '');
+    params.set('data', dataField);
+    params.set('dark', darkVal);
+    params.set('light', lightVal);
+    params.set('transparent', transparentVal);
+    params.set('border', String(border.value));
+    params.set('scale', String(scale.value));
+    if (optimize && optimize.checked) params.set('optimize', '1'); else params.delete('optimize');
+    return params;
+  }
+
+  // Only the payload and the optimiser flag change the module matrix; colours,
+  // border and scale are painted locally.
+  function matrixParams() {
+    const params = new URLSearchParams();
+    params.set('data', dataInput ? dataInput.value : '');
+    if (optimize && optimize.checked) params.set('optimize', '1');
+    return params;
+  }
+
+  function decodeBits(b64) {
+    const raw = atob(b64);
+    const out = new Uint8Array(raw.length);
+    for (let i = 0; i < raw.length; i++) out[i] = raw.charCodeAt(i);
+    return out;
+  }
+
+  function hexRgb(hex) {
+    const v = String(hex || '').replace('#', '');
+    const full = v.length === 3 ? v.split('').map(function(c){ return c + c; }).join('') : v;
+    const n = parseInt(full, 16) || 0;
+    return [(n >> 16) & 255, (n >> 8) & 255, n & 255];
+  }
+
+  // One canvas pixel per module (CSS scales it up); the bits are row-major,
+  // first module in the top bit, as served by /matrix.
+  function paint() {
+    if (!moduleBits) return;
+    const n = modulesFor(version);
+    const b = parseInt(border.value, 10);
+    const side = n + 2 * b;
+    qrCanvas.width = side; qrCanvas.height = side;
+    const ctx = qrCanvas.getContext('2d');
+    const image = ctx.createImageData(side, side);
+    const fg = hexRgb(dark ? dark.value : '#000000');
+    const bg = hexRgb(light ? light.value : '#FFFFFF');
+    const bgAlpha = (transparent && transparent.checked) ? 0 : 255;
+    const px = image.data;
+    for (let y = 0; y < side; y++) {
+      for (let x = 0; x < side; x++) {
+        const mx = x - b, my = y - b;
+        let on = false;
+        if (mx >= 0 && my >= 0 && mx < n && my < n) {
+          const k = my * n + mx;
+          on = ((moduleBits[k >> 3] >> (7 - (k & 7))) & 1) === 1;
         }
+        const c = on ? fg : bg;
+        const i = (y * side + x) * 4;
+        px[i] = c[0]; px[i + 1] = c[1]; px[i + 2] = c[2]; px[i + 3] = on ? 255 : bgAlpha;
       }
+    }
+    ctx.putImageData(image, 0, 0);
+  }
 
-      function hslToRgb(h, s, l){
-        h = (h % 360 + 360) % 360; s = Math.max(0, Math.min(1, s)); l = Math.max(0, Math.min(1, l));
-        const c = (1 - Math.abs(2*l - 1)) * s;
-        const x = c * (1 - Math.abs((h/60) % 2 - 1));
-        const m = l - c/2;
-        let r=0,g=0,b=0;
-        if (0<=h && h<60){ r=c; g=x; b=0; }
-        else if (60<=h && h<120){ r=x; g=c; b=0; }
-        else if (120<=h && h<180){ r=0; g=c; b=x; }
-        else if (180<=h && h<240){ r=0; g=x; b=c; }
-        else if (240<=h && h<300){ r=x; g=0; b=c; }
-        else { r=c; g=0; b=x; }
-        return [Math.round((r+m)*255), Math.round((g+m)*255), Math.round((b+m)*255)];
-      }
+  function buildUrl() {
+    // Deterministic URL; the server answers with an ETag and immutable caching.
+    return '/download?' + currentParams().toString();
+  }
 
-      function drawLogo(canvas, topText, bottomText, color, hueOffset){
-        const ctx = canvas.getContext('2d');
-        const padding = 6; const spacingCols = 2; const lineGapPx = 8; // space between lines
-        let px = 6; // pixel block size
-        const columnsPerChar = 5; const rows = 7;
-        const wTop = measureWordPx(topText, px, spacingCols);
-        const wBot = measureWordPx(bottomText, px, spacingCols);
-        const widthPx = padding*2 + Math.max(wTop, wBot);
-        const heightPx = padding*2 + rows*px*2 + lineGapPx;
-        canvas.width = widthPx; canvas.height = heightPx;
-        ctx.clearRect(0,0,canvas.width,canvas.height);
-        // Center each line horizontally
-        const topX = padding + Math.floor((Math.max(wTop,wBot) - wTop)/2);
-        const botX = padding + Math.floor((Math.max(wTop,wBot) - wBot)/2);
-        const topY = padding;
-        const botY = padding + rows*px + lineGapPx;
-        const colorSupplier = (color === 'rainbow')
-          ? (t) => { const [r,g,b] = hslToRgb((t*360 + (hueOffset||0)), 1, 0.6); return `rgb(${r},${g},${b})`; }
-          : color;
-        drawWordAt(ctx, topText, colorSupplier, topX, topY, px, widthPx);
-        drawWordAt(ctx, bottomText, colorSupplier, botX, botY, px, widthPx);
-      }
+  function recompute(modules) {
+    const b = parseInt(border.value, 10);
+    const s = parseInt(scale.value, 10);
+    const size = (modules + 2*b) * s;
+    const total = size * size;
+    const white = total - black;
+    if (borderVal) borderVal.textContent = String(b);
+    if (scaleVal) scaleVal.textContent = String(s);
+    if (sizeValPx) sizeValPx.textContent = String(size);
+    if (sizeValPx2) sizeValPx2.textContent = String(size);
+    if (whiteEl) whiteEl.textContent = String(white);
+    if (totalEl) totalEl.textContent = String(total);
+    if (borderDisp) borderDisp.textContent = String(b);
+    if (scaleDisp) scaleDisp.textContent = String(s);
+  }
 
-      const logo = document.getElementById('logoCanvas');
-      const darkInput = document.getElementById('dark');
-      if (logo){
-        let hue = 0;
-        function animate(ts){
-          hue = (hue + 0.6) % 360; // speed: degrees per frame
-          drawLogo(logo, 'QR Code Generator for wplace', 'by MON5TERMATT', 'rainbow', hue);
-          requestAnimationFrame(animate);
-        }
-        requestAnimationFrame(animate);
+  function update() {
+    // Use latest version for module count
+    const modules = modulesFor(version);
+    recompute(modules);
+    const url = buildUrl();
+    // Show preview when there is data, hide when empty
+    const hasData = (dataInput && dataInput.value && dataInput.value.trim().length > 0);
+    const container = document.getElementById('preview');
+    if (container) container.style.display = hasData ? '' : 'none';
+    if (!hasData) { moduleBits = null; qrCanvas.width = 0; qrCanvas.height = 0; }
+    paint();
+    if (dl) dl.href = url;
+  }
+
+  // Debounce helper
+  function debounce(fn, ms){ let t; return function(){ clearTimeout(t); t = setTimeout(fn, ms); }; }
+
+  // The packed matrix and stats arrive together, tagged with the sequence number
+  // of the edit they belong to; anything older than the latest edit is dropped.
+  let previewSeq = 0;
+  function applyPreview(meta){
+    if (typeof meta.version === 'number' && meta.bits) {
+      moduleBits = decodeBits(meta.bits);
+      version = meta.version;
+      black = meta.black;
+      const modules = modulesFor(version);
+      recompute(modules);
+      const verEl = document.getElementById('ver');
+      if (verEl) verEl.textContent = String(meta.version);
+      const blackEl = document.getElementById('blackVal');
+      if (blackEl) blackEl.textContent = String(meta.black);
+      paint();
+    }
+  }
+
+  async function fetchPreview(seq){
+    try {
+      const res = await fetch('/matrix?' + matrixParams().toString());
+      if (!res.ok || seq !== previewSeq) return;
+      const meta = await res.json();
+      if (seq === previewSeq) applyPreview(meta);
+    } catch (_) { /* ignore */ }
+  }
+
+  // Live channel: every payload edit goes out immediately and the server encodes
+  // only the newest one. Falls back to debounced /matrix fetches while it is down.
+  let live = null;
+  function connectLive(delay){
+    if (!('WebSocket' in window)) return;
+    const ws = new WebSocket((location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + '/live');
+    ws.onopen = function(){ live = ws; delay = 0; };
+    ws.onmessage = function(ev){
+      try {
+        const meta = JSON.parse(ev.data);
+        if (meta.seq !== previewSeq) return;
+        if (!meta.error) applyPreview(meta);
+      } catch (_) { /* ignore */ }
+    };
+    ws.onclose = function(){
+      const wasOpen = (live === ws);
+      if (wasOpen) { live = null; refreshPreview(); }
+      const next = Math.min(30000, Math.max(1000, (delay || 500) * 2));
+      setTimeout(function(){ connectLive(next); }, next);
+    };
+  }
+
+  function refreshPreview(){
+    const hasData = (dataInput && dataInput.value && dataInput.value.trim().length > 0);
+    const seq = ++previewSeq;
+    if (!hasData) return;
+    if (live && live.readyState === WebSocket.OPEN) {
+      live.send(JSON.stringify({seq: seq, params: Object.fromEntries(matrixParams())}));
+    } else {
+      fetchPreview(seq);
+    }
+  }
+
+  const fetchLater = debounce(refreshPreview, 120);
+  function liveUpdate(){
+    update();
+    if (live && live.readyState === WebSocket.OPEN) refreshPreview(); else fetchLater();
+  }
+  connectLive(0);
+
+  // Colours, border and scale only repaint (and update the download URL).
+  border.addEventListener('input', update);
+  scale.addEventListener('input', update);
+  if (dark) dark.addEventListener('input', update);
+  if (light) light.addEventListener('input', update);
+  if (transparent) transparent.addEventListener('change', update);
+  if (dataInput) dataInput.addEventListener('input', liveUpdate);
+  if (optimize) optimize.addEventListener('change', liveUpdate);
+  paint();
+
+  // Click the preview to download the full-size PNG
+  qrCanvas.addEventListener('click', function(e){
+    e.preventDefault();
+    if (dl) {
+      // Force latest URL, then simulate click
+      update();
+      dl.click();
+    }
+  });
+
+  // Bitmap Text Generator
+  function drawBitmap(canvas, text, px, color, borderModules, letterSpacing, spaceWidth, invert){
+    const ctx = canvas.getContext('2d');
+    const columnsPerChar = 5; const rows = 7;
+    const padding = Math.max(0, borderModules|0) * px;
+    const chars = String(text || '').toUpperCase().split('');
+    if (chars.length === 0){ canvas.width = 0; canvas.height = 0; return {black: 0, white: 0, total: 0}; }
+
+    // Calculate total width with spacing
+    let totalWidth = padding * 2;
+    for (let i = 0; i < chars.length; i++) {
+      const ch = chars[i];
+      if (ch === ' ') {
+        totalWidth += spaceWidth * px;
+      } else {
+        totalWidth += columnsPerChar * px;
       }
-      const img = document.getElementById('qrImg');
-      const preview = document.getElementById('preview');
-      const border = document.getElementById('border');
-      const scale = document.getElementById('scale');
-      const dataInput = document.getElementById('dataInput');
-      const dark = document.getElementById('dark');
-      const light = document.getElementById('light');
-      const transparent = document.getElementById('transparent');
-      if (!img || !preview || !border || !scale) return;
-      let black = parseInt(preview.dataset.black || '0', 10);
-      let version = parseInt(preview.dataset.version || '3', 10);
-      function modulesFor(ver){ return 17 + 4 * ver; }
-      const borderVal = document.getElementById('borderVal');
-      const scaleVal = document.getElementById('scaleVal');
-      const sizeValPx = document.getElementById('sizeValPx');
-      const sizeValPx2 = document.getElementById('sizeValPx2');
-      const whiteEl = document.getElementById('whiteVal');
-      const totalEl = document.getElementById('totalVal');
-      const borderDisp = document.getElementById('borderDisp');
-      const scaleDisp = document.getElementById('scaleDisp');
-      const dl = document.getElementById('dlLink');
-      const bitmapCanvas = document.getElementById('bitmapCanvas');
-      const bitmapInput = document.getElementById('bitmapInput');
-      const bitmapScale = document.getElementById('bitmapScale');
-      const bitmapScaleVal = document.getElementById('bitmapScaleVal');
-      const bitmapBorder = document.getElementById('bitmapBorder');
-      const bitmapBorderVal = document.getElementById('bitmapBorderVal');
-      const letterSpacing = document.getElementById('letterSpacing');
-      const letterSpacingVal = document.getElementById('letterSpacingVal');
-      const spaceWidth = document.getElementById('spaceWidth');
-      const spaceWidthVal = document.getElementById('spaceWidthVal');
-      const invertColors = document.getElementById('invertColors');
-      const bitmapStats = document.getElementById('bitmapStats');
-      const bitmapBlackPixels = document.getElementById('bitmapBlackPixels');
-      const bitmapWhitePixels = document.getElementById('bitmapWhitePixels');
-      const bitmapTotalPixels = document.getElementById('bitmapTotalPixels');
-      const bitmapDownload = document.getElementById('bitmapDownload');
-
-      function buildUrl() {
-        const params = new URLSearchParams(window.location.search);
-        // Pull form values directly
-        const darkVal = (dark ? dark.value : '#000000');
-        const lightVal = (light ? light.value : '#FFFFFF');
-        const transparentVal = (transparent && transparent.checked ? '1' : '0');
-        const dataField = (dataInput ? dataInput.value : '');
-        params.set('data', dataField);
-        params.set('dark', darkVal);
-        params.set('light', lightVal);
-        params.set('transparent', transparentVal);
-        params.set('border', String(border.value));
-        params.set('scale', String(scale.value));
-        params.set('t', String(Date.now())); // cache bust
-        return '/download?' + params.toString();
+      // Add letter spacing between characters (except after last character)
+      if (i < chars.length - 1) {
+        totalWidth += letterSpacing * px;
       }
+    }
 
-      function recompute(modules) {
-        const b = parseInt(border.value, 10);
-        const s = parseInt(scale.value, 10);
-        const size = (modules + 2*b) * s;
-        const total = size * size;
-        const white = total - black;
-        if (borderVal) borderVal.textContent = String(b);
-        if (scaleVal) scaleVal.textContent = String(s);
-        if (sizeValPx) sizeValPx.textContent = String(size);
-        if (sizeValPx2) sizeValPx2.textContent = String(size);
-        if (whiteEl) whiteEl.textContent = String(white);
-        if (totalEl) totalEl.textContent = String(total);
-        if (borderDisp) borderDisp.textContent = String(b);
-        if (scaleDisp) scaleDisp.textContent = String(s);
-      }
+    const heightPx = padding*2 + rows*px;
+    canvas.width = totalWidth; canvas.height = heightPx;
 
-      function update() {
-        // Use latest version for module count
-        const modules = modulesFor(version);
-        recompute(modules);
-        const url = buildUrl();
-        // Show preview when there is data, hide when empty
-        const hasData = (dataInput && dataInput.value && dataInput.value.trim().length > 0);
-        const container = document.getElementById('preview');
-        if (container) container.style.display = hasData ? '' : 'none';
-        if (hasData) img.src = url; else img.src = 'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///ywAAAAAAQABAAACAUwAOw==';
-        if (dl) dl.href = url.replace(/&t=\d+/, '');
-      }
+    // Set background color
+    if (invert) {
+      ctx.clearRect(0,0,totalWidth,heightPx);
+      ctx.fillStyle = '#FFFFFF';
+    } else {
+      ctx.clearRect(0,0,totalWidth,heightPx);
+      ctx.fillStyle = color;
+    }
+
+    let blackPixels = 0;
+    let whitePixels = 0;
+    let x = padding;
 
-      // Debounce helper
-      function debounce(fn, ms){ let t; return function(){ clearTimeout(t); t = setTimeout(fn, ms); }; }
-
-      async function refreshMeta(){
-        const params = new URLSearchParams(window.location.search);
-        const darkVal = (dark ? dark.value : '#000000');
-        const lightVal = (light ? light.value : '#FFFFFF');
-        const transparentVal = (transparent && transparent.checked ? '1' : '0');
-        const dataField = (dataInput ? dataInput.value : '');
-        params.set('data', dataField);
-        params.set('dark', darkVal);
-        params.set('light', lightVal);
-        params.set('transparent', transparentVal);
-        params.set('border', String(border.value));
-        params.set('scale', String(scale.value));
-        try {
-          const res = await fetch('/meta?' + params.toString(), { cache: 'no-store' });
-          if (!res.ok) return;
-          const meta = await res.json();
-          if (typeof meta.version === 'number') {
-            version = meta.version;
-            black = meta.black;
-            const modules = modulesFor(version);
-            recompute(modules);
-            const verEl = document.getElementById('ver');
-            if (verEl) verEl.textContent = String(meta.version);
-            const blackEl = document.getElementById('blackVal');
-            if (blackEl) blackEl.textContent = String(meta.black);
+    for (let i = 0; i < chars.length; i++) {
+      const ch = chars[i];
+      if (ch === ' ') {
+        // Skip drawing for spaces, just advance position
+        x += spaceWidth * px;
+      } else {
+        const glyph = getGlyph5x7(ch);
+        for (let r=0;r<rows;r++){
+          const bits = glyph[r] || 0;
+          for (let c=0;c<columnsPerChar;c++){
+            const on = (bits >> (columnsPerChar-1-c)) & 1;
+            if (on){ 
+              ctx.fillRect(x + c*px, padding + r*px, px, px);
+              if (invert) {
+                whitePixels += px * px;
+              } else {
+                blackPixels += px * px;
+              }
+            }
           }
-        } catch (_) { /* ignore */ }
+        }
+        x += columnsPerChar * px;
       }
+      // Add letter spacing between characters (except after last character)
+      if (i < chars.length - 1) {
+        x += letterSpacing * px;
+      }
+    }
 
-      const liveUpdate = debounce(function(){ update(); refreshMeta(); }, 120);
-
-      border.addEventListener('input', liveUpdate);
-      scale.addEventListener('input', liveUpdate);
-      if (dataInput) dataInput.addEventListener('input', liveUpdate);
-      if (dark) dark.addEventListener('input', liveUpdate);
-      if (light) light.addEventListener('input', liveUpdate);
-      if (transparent) transparent.addEventListener('change', liveUpdate);
-
-      // Click QR image to trigger download
-      if (img) img.addEventListener('click', function(e){
-        e.preventDefault();
-        if (dl) {
-          // Force latest URL, then simulate click
-          update();
-          dl.click();
-        }
-      });
-
-      // Bitmap Text Generator
-      function drawBitmap(canvas, text, px, color, borderModules, letterSpacing, spaceWidth, invert){
-        const ctx = canvas.getContext('2d');
-        const columnsPerChar = 5; const rows = 7;
-        const padding = Math.max(0, borderModules|0) * px;
-        const chars = String(text || '').toUpperCase().split('');
-        if (chars.length === 0){ canvas.width = 0; canvas.height = 0; return {black: 0, white: 0, total: 0}; }
-        
+    // Calculate total pixels and remaining pixels
+    const totalPixels = totalWidth * heightPx;
+    if (invert) {
+      // When inverted, only count white text pixels, background is transparent
+      blackPixels = 0;
+      whitePixels = whitePixels; // already calculated
+    } else {
+      // When normal, only count black text pixels, background is transparent
+      blackPixels = blackPixels; // already calculated
+      whitePixels = 0;
+    }
+
+    return {black: blackPixels, white: whitePixels, total: totalPixels};
+  }
+
+  function updateBitmap(){
+    const txt = bitmapInput ? bitmapInput.value : '';
+    const px = bitmapScale ? parseInt(bitmapScale.value, 10) : 1;
+    const b = bitmapBorder ? parseInt(bitmapBorder.value, 10) : 0;
+    const ls = letterSpacing ? parseInt(letterSpacing.value, 10) : 1;
+    const sw = spaceWidth ? parseInt(spaceWidth.value, 10) : 3;
+    const invert = invertColors ? invertColors.checked : false;
+    if (bitmapScaleVal) bitmapScaleVal.textContent = String(px);
+    if (bitmapBorderVal) bitmapBorderVal.textContent = String(b);
+    if (letterSpacingVal) letterSpacingVal.textContent = String(ls);
+    if (spaceWidthVal) spaceWidthVal.textContent = String(sw);
+    // Compute max px to fit container width
+    const container = document.getElementById('bitmapContainer');
+    let fitPx = px;
+    if (container){
+      const columnsPerChar = 5; const rows = 7;
+      const chars = String(txt || '').toUpperCase().split('');
+      const padding = Math.max(0, b|0);
+      const containerWidth = container.clientWidth || container.offsetWidth || 0;
+      if (chars.length > 0 && containerWidth > 0){
         // Calculate total width with spacing
-        let totalWidth = padding * 2;
+        let modulesWide = padding * 2;
         for (let i = 0; i < chars.length; i++) {
           const ch = chars[i];
           if (ch === ' ') {
-            totalWidth += spaceWidth * px;
+            modulesWide += sw;
           } else {
-            totalWidth += columnsPerChar * px;
+            modulesWide += columnsPerChar;
           }
           // Add letter spacing between characters (except after last character)
           if (i < chars.length - 1) {
-            totalWidth += letterSpacing * px;
-          }
-        }
-        
-        const heightPx = padding*2 + rows*px;
-        canvas.width = totalWidth; canvas.height = heightPx;
-        
-        // Set background color
-        if (invert) {
-          ctx.clearRect(0,0,totalWidth,heightPx);
-          ctx.fillStyle = '#FFFFFF';
-        } else {
-          ctx.clearRect(0,0,totalWidth,heightPx);
-          ctx.fillStyle = color;
-        }
-        
-        let blackPixels = 0;
-        let whitePixels = 0;
-        let x = padding;
-        
-        for (let i = 0; i < chars.length; i++) {
-          const ch = chars[i];
-          if (ch === ' ') {
-            // Skip drawing for spaces, just advance position
-            x += spaceWidth * px;
-          } else {
-            const glyph = getGlyph5x7(ch);
-            for (let r=0;r<rows;r++){
-              const bits = glyph[r] || 0;
-              for (let c=0;c<columnsPerChar;c++){
-                const on = (bits >> (columnsPerChar-1-c)) & 1;
-                if (on){ 
-                  ctx.fillRect(x + c*px, padding + r*px, px, px);
-                  if (invert) {
-                    whitePixels += px * px;
-                  } else {
-                    blackPixels += px * px;
-                  }
-                }
-              }
-            }
-            x += columnsPerChar * px;
-          }
-          // Add letter spacing between characters (except after last character)
-          if (i < chars.length - 1) {
-            x += letterSpacing * px;
-          }
-        }
-        
-        // Calculate total pixels and remaining pixels
-        const totalPixels = totalWidth * heightPx;
-        if (invert) {
-          // When inverted, only count white text pixels, background is transparent
-          blackPixels = 0;
-          whitePixels = whitePixels; // already calculated
-        } else {
-          // When normal, only count black text pixels, background is transparent
-          blackPixels = blackPixels; // already calculated
-          whitePixels = 0;
-        }
-        
-        return {black: blackPixels, white: whitePixels, total: totalPixels};
-      }
-
-      function updateBitmap(){
-        const txt = bitmapInput ? bitmapInput.value : '';
-        const px = bitmapScale ? parseInt(bitmapScale.value, 10) : 1;
-        const b = bitmapBorder ? parseInt(bitmapBorder.value, 10) : 0;
-        const ls = letterSpacing ? parseInt(letterSpacing.value, 10) : 1;
-        const sw = spaceWidth ? parseInt(spaceWidth.value, 10) : 3;
-        const invert = invertColors ? invertColors.checked : false;
-        if (bitmapScaleVal) bitmapScaleVal.textContent = String(px);
-        if (bitmapBorderVal) bitmapBorderVal.textContent = String(b);
-        if (letterSpacingVal) letterSpacingVal.textContent = String(ls);
-        if (spaceWidthVal) spaceWidthVal.textContent = String(sw);
-        // Compute max px to fit container width
-        const container = document.getElementById('bitmapContainer');
-        let fitPx = px;
-        if (container){
-          const columnsPerChar = 5; const rows = 7;
-          const chars = String(txt || '').toUpperCase().split('');
-          const padding = Math.max(0, b|0);
-          const containerWidth = container.clientWidth || container.offsetWidth || 0;
-          if (chars.length > 0 && containerWidth > 0){
-            // Calculate total width with spacing
-            let modulesWide = padding * 2;
-            for (let i = 0; i < chars.length; i++) {
-              const ch = chars[i];
-              if (ch === ' ') {
-                modulesWide += sw;
-              } else {
-                modulesWide += columnsPerChar;
-              }
-              // Add letter spacing between characters (except after last character)
-              if (i < chars.length - 1) {
-                modulesWide += ls;
-              }
-            }
-            const maxPx = Math.max(1, Math.floor(containerWidth / modulesWide));
-            fitPx = Math.min(px, maxPx);
-          }
-        }
-        const hasText = (txt && txt.trim().length > 0);
-        // Hide or show canvas and stats based on text
-        if (bitmapCanvas) bitmapCanvas.style.display = hasText ? '' : 'none';
-        if (bitmapStats) bitmapStats.style.display = hasText ? '' : 'none';
-        if (hasText) {
-          // Set visual background color for preview (gray for white text, white for black text)
-          if (bitmapCanvas) {
-            bitmapCanvas.style.background = invert ? '#666' : '#fff';
-          }
-          const pixelCounts = drawBitmap(bitmapCanvas, txt, fitPx, '#000', b, ls, sw, invert);
-          // Update pixel count display
-          if (bitmapBlackPixels) bitmapBlackPixels.textContent = String(pixelCounts.black);
-          if (bitmapWhitePixels) bitmapWhitePixels.textContent = String(pixelCounts.white);
-          if (bitmapTotalPixels) bitmapTotalPixels.textContent = String(pixelCounts.total);
-        } else if (bitmapCanvas) {
-          // Clear canvas when hidden
-          bitmapCanvas.width = 0; bitmapCanvas.height = 0;
-        }
-        // Update download link
-        if (bitmapDownload){
-          bitmapDownload.style.display = hasText ? '' : 'none';
-          if (hasText){
-            const dataUrl = bitmapCanvas.toDataURL('image/png');
-            bitmapDownload.href = dataUrl;
-            const slug = (txt || 'bitmap').replace(/[^A-Za-z0-9]+/g,'-').replace(/^-+|-+$/g,'').slice(0,50) || 'bitmap';
-            bitmapDownload.download = slug + '.png';
+            modulesWide += ls;
           }
         }
+        const maxPx = Math.max(1, Math.floor(containerWidth / modulesWide));
+        fitPx = Math.min(px, maxPx);
       }
-
-      if (bitmapInput){
-        bitmapInput.addEventListener('input', updateBitmap);
-      }
-      if (bitmapScale){
-        bitmapScale.addEventListener('input', updateBitmap);
-      }
-      if (bitmapBorder){
-        bitmapBorder.addEventListener('input', updateBitmap);
+    }
+    const hasText = (txt && txt.trim().length > 0);
+    // Hide or show canvas and stats based on text
+    if (bitmapCanvas) bitmapCanvas.style.display = hasText ? '' : 'none';
+    if (bitmapStats) bitmapStats.style.display = hasText ? '' : 'none';
+    if (hasText) {
+      // Set visual background color for preview (gray for white text, white for black text)
+      if (bitmapCanvas) {
+        bitmapCanvas.style.background = invert ? '#666' : '#fff';
       }
-      if (letterSpacing){
-        letterSpacing.addEventListener('input', updateBitmap);
+      const pixelCounts = drawBitmap(bitmapCanvas, txt, fitPx, '#000', b, ls, sw, invert);
+      // Update pixel count display
+      if (bitmapBlackPixels) bitmapBlackPixels.textContent = String(pixelCounts.black);
+      if (bitmapWhitePixels) bitmapWhitePixels.textContent = String(pixelCounts.white);
+      if (bitmapTotalPixels) bitmapTotalPixels.textContent = String(pixelCounts.total);
+    } else if (bitmapCanvas) {
+      // Clear canvas when hidden
+      bitmapCanvas.width = 0; bitmapCanvas.height = 0;
+    }
+    // Update download link
+    if (bitmapDownload){
+      bitmapDownload.style.display = hasText ? '' : 'none';
+      if (hasText){
+        const dataUrl = bitmapCanvas.toDataURL('image/png');
+        bitmapDownload.href = dataUrl;
+        const slug = (txt || 'bitmap').replace(/[^A-Za-z0-9]+/g,'-').replace(/^-+|-+$/g,'').slice(0,50) || 'bitmap';
+        bitmapDownload.download = slug + '.png';
       }
-      if (spaceWidth){
-        spaceWidth.addEventListener('input', updateBitmap);
-      }
-      if (invertColors){
-        invertColors.addEventListener('change', updateBitmap);
-      }
-      if (bitmapCanvas){
-        bitmapCanvas.addEventListener('click', function(){ if (bitmapDownload) bitmapDownload.click(); });
-      }
-      // initial
-      updateBitmap();
-      window.addEventListener('resize', updateBitmap);
-    })();
-  </script>
-  </html>
+    }
+  }
+
+  if (bitmapInput){
+    bitmapInput.addEventListener('input', updateBitmap);
+  }
+  if (bitmapScale){
+    bitmapScale.addEventListener('input', updateBitmap);
+  }
+  if (bitmapBorder){
+    bitmapBorder.addEventListener('input', updateBitmap);
+  }
+  if (letterSpacing){
+    letterSpacing.addEventListener('input', updateBitmap);
+  }
+  if (spaceWidth){
+    spaceWidth.addEventListener('input', updateBitmap);
+  }
+  if (invertColors){
+    invertColors.addEventListener('change', updateBitmap);
+  }
+  if (bitmapCanvas){
+    bitmapCanvas.addEventListener('click', function(){ if (bitmapDownload) bitmapDownload.click(); });
+  }
+  // initial
+  updateBitmap();
+  window.addEventListener('resize', updateBitmap);
+})();
 """
 
 
@@ -718,217 +799,2826 @@ def try_import(module_name: str) -> bool:
         return False
 
 
-def generate_qr_bytes(
-    data: str,
-    *,
-    dark_color: str = "#000000",
-    light_color: str = "#FFFFFF",
-    transparent: bool = False,
-    border: int = 0,
-    scale: int = 1,
-) -> Tuple[bytes, int, int, int, int]:
-    dark_color = _normalize_hex(dark_color)
-    light_color = _normalize_hex(light_color)
-    if border < 0:
-        border = 0
-    if scale < 1:
-        scale = 1
+# --- Metrics --------------------------------------------------------------------
+#
+# Minimal Prometheus text-exposition registry. Updates are a dict lookup and a
+# few additions under one lock. Values are per process: with `serve --workers N`
+# each scrape reports the worker that answered it (the pid label tells them apart).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._values: Dict[str, Dict[Labels, Any]] = {}
+
+    def declare(self, name: str, kind: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self._meta[name] = (kind, help_text)
+        self._values.setdefault(name, {})
+        if kind == 'histogram':
+            self._buckets[name] = buckets
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        with self._lock:
+            series = self._values[name]
+            series[labels] = series.get(labels, 0) + value
+
+    def set(self, name: str, labels: Labels = (), value: float = 0) -> None:
+        with self._lock:
+            self._values[name][labels] = value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        buckets = self._buckets[name]
+        with self._lock:
+            series = self._values[name]
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [[0] * len(buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @staticmethod
+    def _labels(labels: Labels, extra: Labels = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ''
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in self._values[name].items():
+                    if kind != 'histogram':
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, n in zip(self._buckets[name], counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{self._labels(labels, (('le', repr(float(bound))),))} {cumulative}")
+                    lines.append(f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                    lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+METRICS.declare('qr_http_requests_total', 'counter', "HTTP requests by route, method and status.")
+METRICS.declare('qr_http_request_duration_seconds', 'histogram', "Request latency per route, including response send.")
+METRICS.declare('qr_http_requests_in_flight', 'gauge', "Requests currently being handled per route.")
+METRICS.declare('qr_http_response_bytes', 'histogram', "Response body size per route (when known).", SIZE_BUCKETS)
+METRICS.declare('qr_stage_duration_seconds', 'histogram', "Time spent per internal stage (plan, encode, optimize, render, template).")
+METRICS.declare('qr_render_duration_seconds', 'histogram', "PNG render time by version range and scale range.")
+METRICS.declare('qr_render_bytes', 'histogram', "Rendered PNG size.", SIZE_BUCKETS)
+METRICS.declare('qr_matrix_cache_events_total', 'counter', "Encoded matrix cache hits, misses and evictions.")
+METRICS.declare('qr_matrix_cache_entries', 'gauge', "Encoded matrices held in the cache.")
+METRICS.declare('qr_matrix_cache_bytes', 'gauge', "Approximate bytes held by the matrix cache.")
+
+_SCALE_RANGES = ((1, '1'), (4, '2-4'), (10, '5-10'), (25, '11-25'), (50, '26-50'))
+
+
+def _version_range(version: int) -> str:
+    return '1-9' if version < 10 else ('10-26' if version < 27 else '27-40')
+
+
+def _scale_range(scale: int) -> str:
+    for upper, label in _SCALE_RANGES:
+        if scale <= upper:
+            return label
+    return '51+'
+
+
+@contextmanager
+def timed_stage(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe('qr_stage_duration_seconds', (('stage', stage),), time.perf_counter() - started)
+
+
+# ISO/IEC 18004 data capacity in codewords for versions 1..40, per error correction level.
+DATA_CODEWORDS = {
+    'l': (19, 34, 55, 80, 108, 136, 156, 194, 232, 274, 324, 370, 428, 461, 523, 589, 647, 721, 795, 861,
+          932, 1006, 1094, 1174, 1276, 1370, 1468, 1531, 1631, 1735, 1843, 1955, 2071, 2191, 2306, 2434,
+          2566, 2702, 2812, 2956),
+    'm': (16, 28, 44, 64, 86, 108, 124, 154, 182, 216, 254, 290, 334, 365, 415, 453, 507, 563, 627, 669,
+          714, 782, 860, 914, 1000, 1062, 1128, 1193, 1267, 1373, 1455, 1541, 1631, 1725, 1812, 1914,
+          1992, 2102, 2216, 2334),
+    'q': (13, 22, 34, 48, 62, 76, 88, 110, 132, 154, 180, 206, 244, 261, 295, 325, 367, 397, 445, 485,
+          512, 568, 614, 664, 718, 754, 808, 871, 911, 985, 1033, 1115, 1171, 1231, 1286, 1354, 1426,
+          1502, 1582, 1666),
+    'h': (9, 16, 26, 36, 46, 60, 66, 86, 100, 122, 140, 158, 180, 197, 223, 253, 283, 313, 341, 385,
+          406, 442, 464, 514, 538, 596, 628, 661, 701, 745, 793, 845, 901, 961, 986, 1054, 1096, 1142,
+          1222, 1276),
+}
+
+ALPHANUMERIC_CHARS = b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+
+# Character count indicator width for version ranges 1-9, 10-26 and 27-40.
+CHAR_COUNT_BITS = {
+    'numeric': (10, 12, 14),
+    'alphanumeric': (9, 11, 13),
+    'byte': (8, 16, 16),
+    'kanji': (8, 10, 12),
+}
+
+
+class QRPlan(NamedTuple):
+    version: int
+    error: str
+    mode: str
+    encoding: Optional[str]
+    payload: bytes
+    char_count: int
+    data_bits: int
+
+
+def _is_kanji(raw: bytes) -> bool:
+    if not raw or len(raw) % 2:
+        return False
+    for i in range(0, len(raw), 2):
+        code = (raw[i] << 8) | raw[i + 1]
+        if not (0x8140 <= code <= 0x9ffc or 0xe040 <= code <= 0xebbf):
+            return False
+    return True
+
+
+def _payload_segment(data: str, allow_kanji: bool = True) -> Tuple[str, Optional[str], bytes, int, int]:
+    # Same single-segment mode/charset detection segno applies to a plain string:
+    # ISO-8859-1 first, then Shift JIS (kanji), then UTF-8.
+    charsets = ('iso-8859-1', 'shift_jis', 'utf-8') if allow_kanji else ('iso-8859-1', 'utf-8')
+    for encoding in charsets:
+        try:
+            raw = data.encode(encoding)
+            break
+        except UnicodeError:
+            continue
+    n = len(raw)
+    if raw.isdigit():
+        return 'numeric', None, raw, n, 10 * (n // 3) + (0, 4, 7)[n % 3]
+    if raw and all(b in ALPHANUMERIC_CHARS for b in raw):
+        return 'alphanumeric', None, raw, n, 11 * (n // 2) + 6 * (n % 2)
+    if allow_kanji and encoding == 'shift_jis' and _is_kanji(raw):
+        return 'kanji', None, raw, n // 2, 13 * (n // 2)
+    return 'byte', encoding, raw, n, 8 * n
+
+
+def plan_qr(data: str, error: str = 'l', *, min_version: int = 1, allow_kanji: bool = True) -> QRPlan:
+    # Pick the smallest standard version whose capacity fits the payload, using the
+    # capacity tables instead of trial encodes. Raises ValueError if nothing fits.
+    error = error.lower()
+    mode, encoding, raw, char_count, data_bits = _payload_segment(data, allow_kanji)
+    capacities = DATA_CODEWORDS[error]
+    for version in range(max(1, min_version), 41):
+        ver_range = 0 if version < 10 else (1 if version < 27 else 2)
+        bits = 4 + CHAR_COUNT_BITS[mode][ver_range] + data_bits
+        if bits <= capacities[version - 1] * 8 and char_count < (1 << CHAR_COUNT_BITS[mode][ver_range]):
+            return QRPlan(version, error, mode, encoding, raw, char_count, data_bits)
+    raise ValueError(f"Data too large: {data_bits} data bits do not fit a version 40-{error.upper()} QR code")
 
-    segno_available = try_import('segno')
-    qrcode_available = try_import('qrcode')
-    if not (segno_available or qrcode_available):
-        raise SystemExit(
-            "No QR libraries found. Install one of:\n"
-            "  pip install segno\n"
-            "  or\n"
-            "  pip install qrcode[pil]"
-        )
 
-    # Enforce minimum standard QR version = 1 (21x21). No Micro QR.
-    if segno_available:
+def plan_version(data: str, error: str = 'l') -> int:
+    return plan_qr(data, error).version
+
+
+class EncodedQR(NamedTuple):
+    matrix: Tuple[bytes, ...]  # one row of 0/1 module values per entry, no quiet zone
+    version: int
+    black: int
+
+    @property
+    def modules(self) -> int:
+        return len(self.matrix)
+
+
+class MatrixCache:
+    # Thread-safe LRU of encoded matrices keyed on the payload. Bounded both by
+    # entry count and by the approximate bytes held (matrix rows + key).
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, Tuple[EncodedQR, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _cost(key: str, value: EncodedQR) -> int:
+        return len(key) + sum(len(row) for row in value.matrix)
+
+    def get(self, key: str) -> Optional[EncodedQR]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def peek(self, key: str) -> Optional[EncodedQR]:
+        # Like get(), but not counted as a hit or miss.
+        with self._lock:
+            item = self._items.get(key)
+            return item[0] if item is not None else None
+
+    def put(self, key: str, value: EncodedQR) -> None:
+        cost = self._cost(key, value)
+        if self.max_entries <= 0 or cost > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._items[key] = (value, cost)
+            self.bytes += cost
+            while len(self._items) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_cost) = self._items.popitem(last=False)
+                self.bytes -= evicted_cost
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(
+                entries=len(self._items),
+                bytes=self.bytes,
+                max_entries=self.max_entries,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
+
+
+MATRIX_CACHE = MatrixCache(
+    max_entries=int(os.environ.get('QR_CACHE_ENTRIES', '1024')),
+    max_bytes=int(os.environ.get('QR_CACHE_BYTES', str(32 * 1024 * 1024))),
+)
+
+
+# --- Encoder backends ---------------------------------------------------------
+#
+# A backend turns a payload into the module matrix of the smallest standard
+# symbol (version >= 1, ECC L, no Micro QR) and can render a matrix to PNG. The
+# active one is picked once at import from QR_BACKEND: 'auto' (default; first
+# installed in registry order, i.e. the native encoder), a backend name, or
+# 'fastest' (a quick encode benchmark over BACKEND_SAMPLE_PAYLOADS).
+
+
+class QRBackend:
+    name = ''
+    module = ''
+
+    @classmethod
+    def available(cls) -> bool:
+        return try_import(cls.module)
+
+    def encode(self, data: str) -> EncodedQR:
+        raise NotImplementedError
+
+    def render(self, encoded: EncodedQR, *, dark_color: str, light_color: str, transparent: bool,
+               border: int, scale: int) -> bytes:
+        # Every built-in adapter shares the native 1-bit PNG writer.
+        return write_png(encoded.matrix, dark_color=dark_color, light_color=light_color,
+                         transparent=transparent, border=border, scale=scale)
+
+
+BACKEND_REGISTRY: Dict[str, type] = {}
+
+
+def register_backend(cls: type) -> type:
+    BACKEND_REGISTRY[cls.name] = cls
+    return cls
+
+
+def _encoded_from_rows(matrix: Any, version: int) -> EncodedQR:
+    rows = tuple(bytes(1 if v else 0 for v in row) for row in matrix)
+    return EncodedQR(rows, version, sum(row.count(1) for row in rows))
+
+
+@register_backend
+class NativeBackend(QRBackend):
+    # The in-repo encoder (see native_encode): same symbols as segno, no dependency.
+    name = 'native'
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def encode(self, data: str) -> EncodedQR:
+        with timed_stage('plan'):
+            plan = plan_qr(data)
+        with timed_stage('encode'):
+            matrix, _ = native_encode(plan)
+            size = 17 + 4 * plan.version
+            return EncodedQR(int_to_matrix(matrix, size), plan.version, matrix.bit_count())
+
+
+@register_backend
+class SegnoBackend(QRBackend):
+    name = module = 'segno'
+
+    def __init__(self) -> None:
         import segno  # type: ignore
-        last_error: Optional[Exception] = None
-        for version in range(1, 41):
+        self._segno = segno
+
+    def encode(self, data: str) -> EncodedQR:
+        with timed_stage('plan'):
+            version = plan_version(data)
+        with timed_stage('encode'):
+            qr = self._segno.make(data, version=version, error='l', micro=False, boost_error=False)
             try:
-                qr = segno.make(
-                    data,
-                    version=version,
-                    error='l',
-                    micro=False,
-                    boost_error=False,
-                )
-                try:
-                    matrix = qr.matrix  # type: ignore[attr-defined]
-                except Exception:
-                    matrix = [list(row) for row in qr.matrix_iter(scale=1, border=0)]  # type: ignore[attr-defined]
-                black = sum(1 for row in matrix for v in row if v)
-                modules_per_side = len(matrix[0]) if matrix else (17 + 4 * version)
-                size = (modules_per_side + 2 * border) * scale
-                total = size * size
-                white = total - black
-                buf = io.BytesIO()
-                segno_light = None if transparent else light_color
-                qr.save(buf, kind='png', scale=scale, border=border, dark=dark_color, light=segno_light)
-                return buf.getvalue(), black, white, version, size
-            except Exception as exc:
-                last_error = exc
-        if last_error:
-            raise last_error
+                matrix = qr.matrix  # type: ignore[attr-defined]
+            except Exception:
+                matrix = [list(row) for row in qr.matrix_iter(scale=1, border=0)]  # type: ignore[attr-defined]
+            return _encoded_from_rows(matrix, version)
+
 
-    # Fallback to qrcode: let it choose minimal standard version
-    if qrcode_available:
+@register_backend
+class QRCodeBackend(QRBackend):
+    # qrcode has no kanji mode, so plan without it and hand over the exact bytes
+    # that were sized; it then encodes once at the planned version.
+    name = module = 'qrcode'
+
+    def __init__(self) -> None:
         import qrcode  # type: ignore
         from qrcode.constants import ERROR_CORRECT_L  # type: ignore
-        # Increment from version 1 upward until it fits
-        version = 1
-        qr = qrcode.QRCode(
-            version=version,
-            error_correction=ERROR_CORRECT_L,
-            box_size=scale,
-            border=border,
-        )
-        qr.add_data(data)
-        try:
+        self._qrcode = qrcode
+        self._level = ERROR_CORRECT_L
+
+    def encode(self, data: str) -> EncodedQR:
+        with timed_stage('plan'):
+            plan = plan_qr(data, allow_kanji=False)
+        with timed_stage('encode'):
+            qr = self._qrcode.QRCode(version=plan.version, error_correction=self._level, border=0)
+            qr.add_data(plan.payload, optimize=0)
             qr.make(fit=False)
-        except Exception:
-            # try higher versions
-            for version in range(2, 41):
-                qr = qrcode.QRCode(
-                    version=version,
-                    error_correction=ERROR_CORRECT_L,
-                    box_size=scale,
-                    border=border,
-                )
-                qr.add_data(data)
+            return _encoded_from_rows(qr.get_matrix(), plan.version)
+
+
+METRICS.declare('qr_backend_encode_seconds', 'histogram', "Encode time (plan + matrix) per backend.")
+METRICS.declare('qr_backend_benchmark_seconds', 'gauge', "Mean encode time per backend from the startup benchmark.")
+METRICS.declare('qr_backend_info', 'gauge', "Active encoder backend.")
+
+# Payload mix for QR_BACKEND=fastest: a short link, a typical share URL and a long one.
+BACKEND_SAMPLE_PAYLOADS = (
+    'https://wplace.live',
+    'https://wplace.live/?lat=48.8566&lng=2.3522&zoom=14.5',
+    'https://wplace.live/?' + '&'.join(f'p{i}=pixel-{i * 37 % 1000}' for i in range(15)),
+)
+
+
+def available_backends() -> Tuple[str, ...]:
+    return tuple(name for name, cls in BACKEND_REGISTRY.items() if cls.available())
+
+
+def benchmark_backends(names: Tuple[str, ...], payloads: Tuple[str, ...] = BACKEND_SAMPLE_PAYLOADS,
+                       rounds: int = 3) -> Dict[str, float]:
+    # Mean seconds per encode for each backend over the payload mix (best of `rounds`).
+    timings = {}
+    for name in names:
+        backend = BACKEND_REGISTRY[name]()
+        backend.encode(payloads[0])  # warm-up: imports and lazy tables
+        best = float('inf')
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for data in payloads:
+                backend.encode(data)
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best / len(payloads)
+    return timings
+
+
+def resolve_backend(choice: str = 'auto') -> QRBackend:
+    choice = (choice or 'auto').strip().lower()
+    installed = available_backends()  # never empty: 'native' needs nothing
+    if choice == 'auto':
+        return BACKEND_REGISTRY[installed[0]]()
+    if choice == 'fastest':
+        timings = benchmark_backends(installed)
+        for name, seconds in timings.items():
+            METRICS.set('qr_backend_benchmark_seconds', (('backend', name),), seconds)
+        return BACKEND_REGISTRY[min(timings, key=timings.get)]()
+    if choice not in BACKEND_REGISTRY:
+        raise SystemExit(f"Unknown QR_BACKEND {choice!r}; expected auto, fastest or one of: {', '.join(BACKEND_REGISTRY)}")
+    if choice not in installed:
+        raise SystemExit(f"QR_BACKEND={choice} is not installed (pip install {BACKEND_REGISTRY[choice].module})")
+    return BACKEND_REGISTRY[choice]()
+
+
+def use_backend(backend: QRBackend) -> None:
+    global BACKEND
+    BACKEND = backend
+    for name in BACKEND_REGISTRY:
+        METRICS.set('qr_backend_info', (('backend', name),), int(name == backend.name))
+
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key onto one computation: the
+    # first caller runs it, later callers wait for its result (or exception).
+    # Each in-flight key has a deadline; waiters that reach it stop waiting and
+    # compute on their own, and a newcomer after it starts a fresh flight, so a
+    # stuck computation cannot hold everyone else hostage.
+    class _Call:
+        __slots__ = ('done', 'result', 'error', 'deadline')
+
+        def __init__(self, deadline: float) -> None:
+            self.done = threading.Event()
+            self.result: Any = None
+            self.error: Optional[BaseException] = None
+            self.deadline = deadline
+
+    def __init__(self, name: str, timeout: float) -> None:
+        self.name = name
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, 'SingleFlight._Call'] = {}
+
+    def _count(self, outcome: str) -> None:
+        METRICS.inc('qr_singleflight_total', (('flight', self.name), ('outcome', outcome)))
+
+    def do(self, key: Any, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None or now >= call.deadline
+            if leader:
+                if call is not None:
+                    self._count('expired')
+                call = self._calls[key] = SingleFlight._Call(now + (self.timeout if timeout is None else timeout))
+        if not leader:
+            if not call.done.wait(max(0.0, call.deadline - now)):
+                self._count('timeout')
+                return fn()
+            self._count('collapsed')
+            if call.error is not None:
+                raise call.error
+            return call.result
+        self._count('leader')
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+METRICS.declare('qr_singleflight_total', 'counter',
+                "Single-flight calls by outcome: leader (computed), collapsed (shared a result), "
+                "timeout (gave up waiting), expired (replaced a flight past its deadline).")
+SINGLEFLIGHT_TIMEOUT = float(os.environ.get('QR_SINGLEFLIGHT_TIMEOUT', '10'))
+ENCODE_FLIGHTS = SingleFlight('encode', SINGLEFLIGHT_TIMEOUT)
+RENDER_FLIGHTS = SingleFlight('render', SINGLEFLIGHT_TIMEOUT)
+
+
+class Overloaded(Exception):
+    # Raised when admission control sheds a request: 429 when the queue is full,
+    # 503 when a queued request reached its deadline. Both carry Retry-After.
+    def __init__(self, status: int, retry_after: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    # Bounds concurrent expensive renders. Work estimated below `heavy` (output
+    # pixels, see render_cost) is never gated, so cheap previews do not queue
+    # behind big downloads. Heavy work takes one of `slots`; when all are busy,
+    # up to `queue` callers wait at most `wait` seconds for one and everyone
+    # else is refused at once. slots=0 disables the gate.
+    def __init__(self, heavy: int, slots: int, queue: int, wait: float) -> None:
+        self.heavy = heavy
+        self.slots = slots
+        self.queue = queue
+        self.wait = wait
+        self.active = 0
+        self.waiting = 0
+        self._seconds = 1.0  # moving average of one heavy render, for Retry-After
+        self._cond = threading.Condition()
+
+    def _count(self, outcome: str) -> None:
+        METRICS.inc('qr_admission_total', (('outcome', outcome),))
+
+    def retry_after(self) -> int:
+        # Time for the current backlog to drain through the slots, in whole seconds.
+        backlog = (self.active + self.waiting) / max(1, self.slots)
+        return max(1, int(self._seconds * backlog + 0.999))
+
+    @contextmanager
+    def admit(self, cost: int):
+        if cost < self.heavy or self.slots <= 0:
+            self._count('cheap')
+            yield
+            return
+        with self._cond:
+            if self.active < self.slots:
+                self._count('admitted')
+            elif self.waiting >= self.queue:
+                self._count('rejected')
+                raise Overloaded(429, self.retry_after(), "Too many large renders in progress, retry later")
+            else:
+                self.waiting += 1
+                deadline = time.monotonic() + self.wait
                 try:
-                    qr.make(fit=False)
-                    break
-                except Exception:
-                    continue
-        fill = dark_color
-        back = (255, 255, 255, 0) if transparent else light_color
-        img = qr.make_image(fill_color=fill, back_color=back)
-        img = img.convert('RGBA' if transparent else 'RGB')
-        width, height = img.size
-        matrix = qr.get_matrix()
-        black = sum(1 for row in matrix for v in row if v)
-        modules_per_side = len(matrix[0]) if matrix else (17 + 4 * version)
-        size = (modules_per_side + 2 * border) * scale
-        total = size * size
-        white = total - black
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        version = (modules_per_side - 17) // 4 if modules_per_side >= 21 else 1
-        return buf.getvalue(), black, white, version, size
-
-    raise RuntimeError("No QR libraries available.")
+                    while self.active >= self.slots:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._count('timeout')
+                            raise Overloaded(503, self.retry_after(), "Server busy with large renders, retry later")
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                self._count('queued')
+            self.active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._seconds = 0.8 * self._seconds + 0.2 * (time.monotonic() - started)
+                self._cond.notify()
 
 
-def filename_for_data(data: str, ext: str = 'png') -> str:
-    # Create a readable slug plus a short hash for uniqueness
-    slug = re.sub(r"[^A-Za-z0-9]+", "-", data.strip()).strip("-")
-    if len(slug) > 50:
-        slug = slug[:50].rstrip('-')
-    if not slug:
-        slug = "qr"
-    digest = hashlib.sha256(data.encode('utf-8')).hexdigest()[:10]
-    return f"{slug}-{digest}.{ext}"
+def render_cost(version: int, border: int, scale: int, format: str = 'png') -> int:
+    # Output pixels for PNG; the other formats only depend on the module count.
+    side = 17 + 4 * version + 2 * max(0, border)
+    return side * side * (max(1, scale) ** 2 if format == 'png' else 1)
 
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
-    data = request.form.get('data') if request.method == 'POST' else request.args.get('data')
-    dark = (request.form.get('dark') if request.method == 'POST' else request.args.get('dark')) or '#000000'
-    light = (request.form.get('light') if request.method == 'POST' else request.args.get('light')) or '#FFFFFF'
-    transparent = (request.form.get('transparent') == '1') if request.method == 'POST' else (request.args.get('transparent') == '1')
-    try:
-        border = int(request.form.get('border') if request.method == 'POST' else (request.args.get('border') or 0))
-    except Exception:
-        border = 0
-    try:
-        scale = int(request.form.get('scale') if request.method == 'POST' else (request.args.get('scale') or 1))
-    except Exception:
-        scale = 1
-    png_b64 = None
-    context = dict(data=data or '', dark=dark, light=light, transparent=transparent, border=border, scale=scale)
-    if data:
-        png_bytes, black, white, version, size = generate_qr_bytes(
-            data,
-            dark_color=dark,
-            light_color=light,
-            transparent=transparent,
-            border=border,
-            scale=scale,
-        )
-        import base64
-        png_b64 = base64.b64encode(png_bytes).decode('ascii')
-        context.update(dict(png_data=png_b64, black=black, white=white, total=size * size, version=version, size=size))
-    return render_template_string(PAGE, **context)
+METRICS.declare('qr_admission_total', 'counter',
+                "Render admission decisions: cheap (not gated), admitted, queued (waited for a slot), "
+                "rejected (429, queue full), timeout (503, waited too long).")
+METRICS.declare('qr_admission_active', 'gauge', "Heavy renders running.")
+METRICS.declare('qr_admission_waiting', 'gauge', "Heavy renders queued for a slot.")
+# Defaults suit the threaded dev server; `serve` derives slots and queue from --threads.
+RENDER_ADMISSION = AdmissionControl(
+    heavy=int(os.environ.get('QR_HEAVY_PIXELS', str(4_000_000))),
+    slots=int(os.environ.get('QR_HEAVY_CONCURRENCY', '2')),
+    queue=int(os.environ.get('QR_HEAVY_QUEUE', '8')),
+    wait=float(os.environ.get('QR_HEAVY_WAIT', '5')),
+)
 
 
-@app.route('/download')
-def download():
-    data = request.args.get('data') or ''
-    dark = request.args.get('dark') or '#000000'
-    light = request.args.get('light') or '#FFFFFF'
-    transparent = (request.args.get('transparent') == '1')
-    try:
-        border = int(request.args.get('border') or 0)
-    except Exception:
-        border = 0
-    try:
-        scale = int(request.args.get('scale') or 1)
-    except Exception:
-        scale = 1
-    if not data:
-        return "Missing data", 400
-    png_bytes, black, white, version, size = generate_qr_bytes(
-        data,
-        dark_color=dark,
-        light_color=light,
-        transparent=transparent,
-        border=border,
-        scale=scale,
-    )
-    fname = filename_for_data(data, 'png')
-    return send_file(io.BytesIO(png_bytes), mimetype='image/png', as_attachment=True, download_name=fname)
+class DiskCache:
+    # Content-addressed, file-per-key cache shared by all worker processes and
+    # kept across restarts. Entries are written to a temp file and renamed into
+    # place, so readers never see a partial file. An entry's mtime is its
+    # last-use time: hits refresh it (at most once a minute), and a background
+    # sweep, run by one process at a time under an flock, drops entries older
+    # than max_age and then the least recently used ones until under the cap.
+    TOUCH_INTERVAL = 60.0
+    MAINTAIN_INTERVAL = 300.0
 
+    def __init__(self, root: str, max_bytes: int, max_age: float) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._approx_bytes = 0
+        self._last_maintain = 0.0
+        self._maintaining = False
+        self._deferred = False
 
-@app.route('/meta')
-def meta():
-    data = request.args.get('data') or ''
-    if not data:
-        return jsonify({"error": "Missing data"}), 400
-    dark = request.args.get('dark') or '#000000'
-    light = request.args.get('light') or '#FFFFFF'
-    transparent = (request.args.get('transparent') == '1')
-    try:
-        border = int(request.args.get('border') or 0)
-    except Exception:
-        border = 0
-    try:
-        scale = int(request.args.get('scale') or 1)
-    except Exception:
-        scale = 1
-    png_bytes, black, white, version, size = generate_qr_bytes(
-        data,
-        dark_color=dark,
-        light_color=light,
-        transparent=transparent,
-        border=border,
-        scale=scale,
-    )
-    return jsonify(dict(version=version, black=black, white=white, total=size * size, size=size))
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.root, kind, key[:2], key)
 
+    def get(self, kind: str, key: str) -> Optional[bytes]:
+        path = self._path(kind, key)
+        try:
+            with open(path, 'rb') as fh:
+                value = fh.read()
+                mtime = os.fstat(fh.fileno()).st_mtime
+        except OSError:
+            METRICS.inc('qr_disk_cache_events_total', (('kind', kind), ('event', 'miss')))
+            return None
+        age = time.time() - mtime
+        if age > self.max_age:
+            METRICS.inc('qr_disk_cache_events_total', (('kind', kind), ('event', 'miss')))
+            return None
+        if age > self.TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        METRICS.inc('qr_disk_cache_events_total', (('kind', kind), ('event', 'hit')))
+        return value
 
-@app.get('/favicon.svg')
-def favicon_svg() -> Response:
-    svg = (
-        "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 64 64'>"
-        "<rect width='64' height='64' rx='8' fill='#000'/>"
-        "<rect x='10' y='10' width='44' height='44' fill='#fff'/>"
-        "<rect x='14' y='14' width='12' height='12' fill='#000'/>"
-        "<rect x='38' y='14' width='12' height='12' fill='#000'/>"
+    def put(self, kind: str, key: str, value: bytes) -> None:
+        path = self._path(kind, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(value)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError:
+            METRICS.inc('qr_disk_cache_events_total', (('kind', kind), ('event', 'write_error')))
+            return
+        METRICS.inc('qr_disk_cache_events_total', (('kind', kind), ('event', 'write')))
+        with self._lock:
+            self._approx_bytes += len(value)
+        self.maybe_maintain()
+
+    def get_matrix(self, key: str) -> Optional[EncodedQR]:
+        value = self.get('matrix', _short_digest(key, 32))
+        if not value:
+            return None
+        version = value[0]
+        bits = int.from_bytes(value[1:], 'big')
+        return EncodedQR(int_to_matrix(bits, 17 + 4 * version), version, bin(bits).count('1'))
+
+    def put_matrix(self, key: str, encoded: EncodedQR) -> None:
+        size = encoded.modules
+        packed = matrix_to_int(encoded.matrix).to_bytes((size * size + 7) // 8, 'big')
+        self.put('matrix', _short_digest(key, 32), bytes((encoded.version,)) + packed)
+
+    def get_render(self, key: str) -> Optional[Tuple[bytes, int, int, int, int]]:
+        value = self.get('png', key)
+        if value is None or len(value) < 16:
+            return None
+        black, white, version, size = struct.unpack('!IIII', value[:16])
+        return value[16:], black, white, version, size
+
+    def put_render(self, key: str, result: Tuple[bytes, int, int, int, int]) -> None:
+        png, black, white, version, size = result
+        self.put('png', key, struct.pack('!IIII', black, white, version, size) + png)
+
+    def maybe_maintain(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            due = now - self._last_maintain > self.MAINTAIN_INTERVAL or self._approx_bytes > self.max_bytes
+            if not due or self._maintaining or self._deferred:
+                return
+            self._maintaining = True
+            self._last_maintain = now
+        threading.Thread(target=self.maintain, name='qr-disk-cache', daemon=True).start()
+
+    @contextmanager
+    def deferred_maintenance(self):
+        # No sweep threads inside the block (the pre-fork master must not fork
+        # while one runs); one sweep runs in this thread when it ends.
+        self._deferred = True
+        try:
+            yield
+        finally:
+            self._deferred = False
+            with self._lock:
+                self._maintaining = True
+                self._last_maintain = time.monotonic()
+            self.maintain()
+
+    def after_fork(self) -> None:
+        # The child has no sweep thread even if the parent had one running.
+        self._lock = threading.Lock()
+        self._maintaining = False
+        self._last_maintain = time.monotonic()
+
+    def maintain(self) -> None:
+        try:
+            self.sweep()
+            HOT_KEYS.save()
+        finally:
+            with self._lock:
+                self._maintaining = False
+
+    def sweep(self) -> None:
+        with _file_lock(os.path.join(self.root, '.sweep.lock'), blocking=False) as locked:
+            if not locked:
+                return  # another worker is sweeping
+            now = time.time()
+            entries = []
+            total = evicted = 0
+            for kind in os.scandir(self.root):
+                if not kind.is_dir() or kind.name.startswith('.'):
+                    continue
+                for shard in os.scandir(kind.path):
+                    for entry in os.scandir(shard.path):
+                        try:
+                            st = entry.stat()
+                            if entry.name.startswith('.tmp-'):
+                                if now - st.st_mtime > 3600:  # abandoned by a crashed writer
+                                    os.unlink(entry.path)
+                                continue
+                            if now - st.st_mtime > self.max_age:
+                                os.unlink(entry.path)
+                                evicted += 1
+                                continue
+                        except OSError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                        total += st.st_size
+            if total > self.max_bytes:
+                entries.sort()
+                target = self.max_bytes * 0.9
+                for _, size, path in entries:
+                    if total <= target:
+                        break
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        continue
+                    total -= size
+                    evicted += 1
+            METRICS.inc('qr_disk_cache_events_total', (('kind', 'all'), ('event', 'evict')), evicted)
+            METRICS.set('qr_disk_cache_bytes', (), total)
+            with self._lock:
+                self._approx_bytes = total
+
+
+@contextmanager
+def _file_lock(path: str, blocking: bool = True):
+    # Advisory inter-process lock (fcntl.flock); yields whether it was acquired.
+    # Closing the file releases it. Without fcntl (Windows) it always succeeds.
+    with open(path, 'a') as fh:
+        if not try_import('fcntl'):
+            yield True
+            return
+        import fcntl
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            yield False
+            return
+        yield True
+
+
+class HotKeys:
+    # Request counts for permalink/download renders, merged by every worker into
+    # one JSON snapshot of the most requested (data, options) pairs. `serve`
+    # renders the top entries into the disk cache before forking workers.
+    def __init__(self, path: str, limit: int) -> None:
+        self.path = path
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._counts: Dict[str, list] = {}
+
+    def record(self, key: str, data: str, options: Dict[str, Any]) -> None:
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                if len(self._counts) >= self.limit * 4:
+                    # Keep memory bounded: drop the colder half.
+                    for stale in sorted(self._counts, key=lambda k: self._counts[k][0])[:len(self._counts) // 2]:
+                        del self._counts[stale]
+                entry = self._counts[key] = [0, data, canonical_options(options)]
+            entry[0] += 1
+
+    def load(self) -> list:
+        try:
+            with open(self.path) as fh:
+                return list(json.load(fh).get('keys', []))
+        except (OSError, ValueError, AttributeError):
+            return []
+
+    def save(self) -> None:
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with _file_lock(self.path + '.lock'):
+            merged: Dict[str, Dict[str, Any]] = {}
+            for item in self.load():
+                try:
+                    merged[render_key(item['data'], item['options'])] = item
+                except (KeyError, TypeError, ValueError):
+                    continue
+            now = int(time.time())
+            for key, (hits, data, options) in counts.items():
+                item = merged.setdefault(key, dict(data=data, options=options, hits=0))
+                item['hits'] += hits
+                item['seen'] = now
+            keys = sorted(merged.values(), key=lambda item: item['hits'], reverse=True)[:self.limit]
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump({'keys': keys}, fh)
+            os.replace(tmp, self.path)
+
+    def warm(self, count: int, budget: float) -> int:
+        # Render the hottest entries into the disk cache (no-op for those already there).
+        deadline = time.monotonic() + budget
+        warmed = 0
+        for item in self.load()[:count]:
+            if time.monotonic() > deadline:
+                break
+            try:
+                data, options = item['data'], dict(item['options'])
+                key = render_key(data, options)
+                if DISK_CACHE is not None and DISK_CACHE.get_render(key) is None:
+                    DISK_CACHE.put_render(key, generate_qr_bytes(data, **options))
+                encode_qr(data, bool(options.get('optimize')))
+            except (KeyError, TypeError, ValueError):
+                continue
+            warmed += 1
+        return warmed
+
+
+METRICS.declare('qr_disk_cache_events_total', 'counter', "Disk cache hits, misses, writes and evictions.")
+METRICS.declare('qr_disk_cache_bytes', 'gauge', "Disk cache size as of the last sweep.")
+# Disabled unless QR_DISK_CACHE_DIR is set (e.g. a volume shared by all workers).
+DISK_CACHE_DIR = os.environ.get('QR_DISK_CACHE_DIR', '')
+DISK_CACHE: Optional[DiskCache] = DiskCache(
+    DISK_CACHE_DIR,
+    max_bytes=int(os.environ.get('QR_DISK_CACHE_BYTES', str(256 * 1024 * 1024))),
+    max_age=float(os.environ.get('QR_DISK_CACHE_MAX_AGE', str(7 * 24 * 3600))),
+) if DISK_CACHE_DIR else None
+if DISK_CACHE is not None and hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=DISK_CACHE.after_fork)
+HOT_KEYS = HotKeys(
+    os.environ.get('QR_HOT_KEYS_FILE') or os.path.join(DISK_CACHE_DIR or '.', 'hot-keys.json'),
+    limit=int(os.environ.get('QR_HOT_KEYS', '200')),
+)
+
+
+def encode_qr(data: str, optimize: bool = False) -> EncodedQR:
+    # The module matrix depends only on the payload, so colour/border/scale
+    # changes are served from the cache and only need re-rendering. Without
+    # segno there is no optimiser, and the plain matrix is cached as such.
+    optimize = optimize and SEGNO_AVAILABLE
+    key = ('\x00optimize\x00' + data) if optimize else data
+    cached = MATRIX_CACHE.get(key)
+    if cached is not None:
+        return cached
+    return ENCODE_FLIGHTS.do(key, lambda: _encode_qr_uncached(data, optimize, key))
+
+
+def _encode_qr_uncached(data: str, optimize: bool, key: str) -> EncodedQR:
+    cached = MATRIX_CACHE.peek(key)  # another flight may have just filled it
+    if cached is None and DISK_CACHE is not None:
+        cached = DISK_CACHE.get_matrix(key)
+        if cached is not None:
+            MATRIX_CACHE.put(key, cached)
+    if cached is not None:
+        return cached
+    encoded = _encode_qr_fresh(data, optimize, key)
+    if DISK_CACHE is not None:
+        DISK_CACHE.put_matrix(key, encoded)
+    return encoded
+
+
+def _encode_qr_fresh(data: str, optimize: bool, key: str) -> EncodedQR:
+    if optimize:
+        with timed_stage('optimize'):
+            encoded = optimize_qr(data).encoded
+        MATRIX_CACHE.put(key, encoded)
+        return encoded
+
+    backend = BACKEND
+    started = time.perf_counter()
+    encoded = backend.encode(data)
+    METRICS.observe('qr_backend_encode_seconds', (('backend', backend.name),), time.perf_counter() - started)
+    MATRIX_CACHE.put(key, encoded)
+    return encoded
+
+
+class QRStats(NamedTuple):
+    black: int
+    white: int
+    version: int
+    size: int
+
+    @property
+    def total(self) -> int:
+        return self.size * self.size
+
+
+def qr_stats(encoded: EncodedQR, *, border: int = 0, scale: int = 1) -> QRStats:
+    # Pure arithmetic on the matrix dimensions; no image is produced.
+    border = max(0, border)
+    scale = max(1, scale)
+    size = (encoded.modules + 2 * border) * scale
+    return QRStats(encoded.black, size * size - encoded.black, encoded.version, size)
+
+
+PNG_COMPRESSLEVEL = int(os.environ.get('QR_PNG_COMPRESSLEVEL', '6'))
+
+
+def _parse_color(color: str) -> Tuple[int, int, int]:
+    c = _normalize_hex(color)
+    if re.fullmatch(r"#[0-9A-Fa-f]{6}", c):
+        return int(c[1:3], 16), int(c[3:5], 16), int(c[5:7], 16)
+    if re.fullmatch(r"#[0-9A-Fa-f]{3}", c):
+        return int(c[1] * 2, 16), int(c[2] * 2, 16), int(c[3] * 2, 16)
+    if try_import('PIL'):
+        from PIL import ImageColor  # type: ignore
+        return ImageColor.getrgb(c)[:3]
+    raise ValueError(f"Unsupported colour: {color!r}")
+
+
+def _png_chunk(tag: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', len(payload)) + tag + payload + struct.pack('>I', zlib.crc32(tag + payload))
+
+
+def _png_header(width: int, height: int, dark: Tuple[int, int, int], light: Tuple[int, int, int],
+                transparent: bool) -> bytes:
+    # 1-bit indexed image: palette entry 0 is the light colour, 1 the dark one.
+    head = b'\x89PNG\r\n\x1a\n'
+    head += _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 3, 0, 0, 0))
+    head += _png_chunk(b'PLTE', bytes(light) + bytes(dark))
+    if transparent:
+        head += _png_chunk(b'tRNS', b'\x00')
+    return head
+
+
+_PNG_TRAILER = _png_chunk(b'IEND', b'')
+
+
+def _png_scanlines(matrix: Tuple[bytes, ...], border: int, scale: int):
+    # Yields filtered 1-bit scanlines. Each module row is packed once; the
+    # remaining scale-1 pixel rows use the PNG "Up" filter on an all-zero row.
+    side = (len(matrix[0]) + 2 * border) * scale
+    row_bytes = (side + 7) // 8
+    blank = b'\x00' * (row_bytes + 1)
+    same_as_above = b'\x02' + b'\x00' * row_bytes
+    edge = '0' * (border * scale)
+    on, off = '1' * scale, '0' * scale
+    pad = '0' * (row_bytes * 8 - side)
+    for _ in range(border * scale):
+        yield blank
+    for row in matrix:
+        bits = edge + ''.join(on if v else off for v in row) + edge + pad
+        yield b'\x00' + int(bits, 2).to_bytes(row_bytes, 'big')
+        for _ in range(scale - 1):
+            yield same_as_above
+    for _ in range(border * scale):
+        yield blank
+
+
+def write_png(
+    matrix: Tuple[bytes, ...],
+    *,
+    dark_color: str = "#000000",
+    light_color: str = "#FFFFFF",
+    transparent: bool = False,
+    border: int = 0,
+    scale: int = 1,
+    compresslevel: Optional[int] = None,
+) -> bytes:
+    return b''.join(iter_png(matrix, dark_color=dark_color, light_color=light_color, transparent=transparent,
+                             border=border, scale=scale, compresslevel=compresslevel, chunk_size=None))
+
+
+# PNGs of at least this many pixels are streamed by /download instead of built in memory.
+PNG_STREAM_PIXELS = int(os.environ.get('QR_STREAM_PIXELS', str(16_000_000)))
+PNG_STREAM_CHUNK = 64 * 1024
+
+
+def iter_png(
+    matrix: Tuple[bytes, ...],
+    *,
+    dark_color: str = "#000000",
+    light_color: str = "#FFFFFF",
+    transparent: bool = False,
+    border: int = 0,
+    scale: int = 1,
+    compresslevel: Optional[int] = None,
+    chunk_size: Optional[int] = PNG_STREAM_CHUNK,
+):
+    # Yields the PNG piece by piece: header, one IDAT chunk per `chunk_size`
+    # bytes of compressed data (a single IDAT when None), then IEND. Scanlines
+    # are compressed as they are generated, so only one pixel row is ever held
+    # uncompressed.
+    width = (len(matrix[0]) + 2 * border) * scale
+    height = (len(matrix) + 2 * border) * scale
+    yield _png_header(width, height, _parse_color(dark_color), _parse_color(light_color), transparent)
+    compressor = zlib.compressobj(PNG_COMPRESSLEVEL if compresslevel is None else compresslevel)
+    pending: list = []
+    buffered = 0
+    for line in _png_scanlines(matrix, border, scale):
+        out = compressor.compress(line)
+        if out:
+            pending.append(out)
+            buffered += len(out)
+            if chunk_size is not None and buffered >= chunk_size:
+                yield _png_chunk(b'IDAT', b''.join(pending))
+                pending, buffered = [], 0
+    pending.append(compressor.flush())
+    yield _png_chunk(b'IDAT', b''.join(pending))
+    yield _PNG_TRAILER
+
+
+# Scale-independent alternatives to PNG, written straight from the matrix.
+# Sizes stay small whatever the scale: the SVG only carries the scale in its
+# width/height attributes, the packed bits and runs are in module units.
+class OutputFormat(NamedTuple):
+    mimetype: str
+    ext: str
+
+
+OUTPUT_FORMATS = {
+    'png': OutputFormat('image/png', 'png'),
+    'svg': OutputFormat('image/svg+xml', 'svg'),
+    'bits': OutputFormat('application/octet-stream', 'bin'),  # row-major, 1 bit per module, MSB first
+    'runs': OutputFormat('application/json', 'json'),
+}
+
+
+def dark_runs(matrix: Tuple[bytes, ...]):
+    # Yields (x, y, length) for every horizontal run of dark modules.
+    for y, row in enumerate(matrix):
+        for run in re.finditer(b'\x01+', row):
+            yield run.start(), y, run.end() - run.start()
+
+
+def write_svg(matrix: Tuple[bytes, ...], *, dark_color: str = "#000000", light_color: str = "#FFFFFF",
+              transparent: bool = False, border: int = 0, scale: int = 1) -> bytes:
+    # One <path>, one subpath per horizontal run, in module units.
+    side = len(matrix) + 2 * border
+    dark = '#%02x%02x%02x' % _parse_color(dark_color)
+    light = '#%02x%02x%02x' % _parse_color(light_color)
+    path = ''.join(f"M{x + border} {y + border}h{n}v1h-{n}z" for x, y, n in dark_runs(matrix))
+    background = '' if transparent else f'<rect width="{side}" height="{side}" fill="{light}"/>'
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{side * scale}" height="{side * scale}" '
+            f'viewBox="0 0 {side} {side}" shape-rendering="crispEdges">{background}'
+            f'<path fill="{dark}" d="{path}"/></svg>\n').encode('ascii')
+
+
+def write_bits(matrix: Tuple[bytes, ...]) -> bytes:
+    # No quiet zone; the module count is sqrt(len * 8) rounded down, or see
+    # the X-QR-Modules header.
+    count = len(matrix) * len(matrix)
+    return (matrix_to_int(matrix) << (-count % 8)).to_bytes((count + 7) // 8, 'big')
+
+
+def write_runs(encoded: EncodedQR, *, border: int = 0) -> bytes:
+    # Dark pixel spans of the scale-1 image, quiet zone included.
+    runs = [[x + border, y + border, n] for x, y, n in dark_runs(encoded.matrix)]
+    return json.dumps(dict(version=encoded.version, size=encoded.modules + 2 * border, border=border,
+                           black=encoded.black, runs=runs), separators=(',', ':')).encode('ascii')
+
+
+def render_output(
+    encoded: EncodedQR,
+    format: str = 'png',
+    *,
+    dark_color: str = "#000000",
+    light_color: str = "#FFFFFF",
+    transparent: bool = False,
+    border: int = 0,
+    scale: int = 1,
+) -> bytes:
+    if format == 'png':
+        return render_qr(encoded, dark_color=dark_color, light_color=light_color, transparent=transparent,
+                         border=border, scale=scale)
+    border, scale = max(0, border), max(1, scale)
+    with timed_stage('render'):
+        if format == 'svg':
+            return write_svg(encoded.matrix, dark_color=dark_color, light_color=light_color,
+                             transparent=transparent, border=border, scale=scale)
+        if format == 'bits':
+            return write_bits(encoded.matrix)
+        if format == 'runs':
+            return write_runs(encoded, border=border)
+    raise ValueError(f"Unsupported format {format!r}; expected one of: {', '.join(OUTPUT_FORMATS)}")
+
+
+def render_qr(
+    encoded: EncodedQR,
+    *,
+    dark_color: str = "#000000",
+    light_color: str = "#FFFFFF",
+    transparent: bool = False,
+    border: int = 0,
+    scale: int = 1,
+) -> bytes:
+    scale = max(1, scale)
+    started = time.perf_counter()
+    png = BACKEND.render(
+        encoded,
+        dark_color=dark_color,
+        light_color=light_color,
+        transparent=transparent,
+        border=max(0, border),
+        scale=scale,
+    )
+    elapsed = time.perf_counter() - started
+    METRICS.observe('qr_stage_duration_seconds', (('stage', 'render'),), elapsed)
+    METRICS.observe('qr_render_duration_seconds',
+                    (('versions', _version_range(encoded.version)), ('scale', _scale_range(scale))), elapsed)
+    METRICS.observe('qr_render_bytes', (), len(png))
+    return png
+
+
+def generate_qr_bytes(
+    data: str,
+    *,
+    dark_color: str = "#000000",
+    light_color: str = "#FFFFFF",
+    transparent: bool = False,
+    border: int = 0,
+    scale: int = 1,
+    optimize: bool = False,
+    format: str = 'png',
+) -> Tuple[bytes, int, int, int, int]:
+    # Returns the image (or other OUTPUT_FORMATS body) and the pixel counts.
+    if format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported format {format!r}; expected one of: {', '.join(OUTPUT_FORMATS)}")
+
+    def run() -> Tuple[bytes, int, int, int, int]:
+        # Costed from the planned version before any work is done; only the
+        # flight leader takes an admission slot.
+        with RENDER_ADMISSION.admit(render_cost(plan_version(data), border, scale, format)):
+            encoded = encode_qr(data, optimize)
+            stats = qr_stats(encoded, border=border, scale=scale)
+            body = render_output(
+                encoded,
+                format,
+                dark_color=dark_color,
+                light_color=light_color,
+                transparent=transparent,
+                border=border,
+                scale=scale,
+            )
+        return body, stats.black, stats.white, stats.version, stats.size
+    # Identical concurrent requests (a shared link opened by many visitors) share one render.
+    options = dict(dark_color=dark_color, light_color=light_color, transparent=transparent, border=border,
+                   scale=scale, optimize=optimize, format=format)
+    return RENDER_FLIGHTS.do(render_key(data, options), run)
+
+
+# --- Fewest-dark-modules optimiser -------------------------------------------
+#
+# Every symbol for a payload at a given version differs only in ECC level,
+# segmentation and mask. The optimiser encodes once per (ECC level,
+# segmentation) candidate that fits, then derives all 8 masks arithmetically:
+# matrices are held as ints (one bit per module, row-major, top-left = MSB), so
+# re-masking is an XOR over the data region plus swapping the format bits.
+
+ECC_LEVELS = ('l', 'm', 'q', 'h')
+_FORMAT_ECC_BITS = {'l': 1, 'm': 0, 'q': 3, 'h': 2}
+_BIT_TEXT_TABLE = bytes.maketrans(b'\x00\x01', b'01')
+_BIT_CHAR_TABLE = bytes.maketrans(b'01', b'\x00\x01')
+
+
+class _SymbolLayout(NamedTuple):
+    size: int
+    data: int  # encoding region
+    format: int  # both format information copies (the fixed dark module excluded)
+    masks: Tuple[int, ...]  # the 8 mask patterns restricted to the encoding region
+
+
+def matrix_to_int(matrix: Tuple[bytes, ...]) -> int:
+    return int(b''.join(matrix).translate(_BIT_TEXT_TABLE), 2)
+
+
+def int_to_matrix(value: int, size: int) -> Tuple[bytes, ...]:
+    flat = format(value, f'0{size * size}b').encode('ascii').translate(_BIT_CHAR_TABLE)
+    return tuple(flat[i:i + size] for i in range(0, size * size, size))
+
+
+def alignment_positions(version: int) -> Tuple[int, ...]:
+    if version == 1:
+        return ()
+    count = version // 7 + 2
+    step = 26 if version == 32 else (version * 4 + count * 2 + 1) // (count * 2 - 2) * 2
+    last = 17 + 4 * version - 7
+    return (6,) + tuple(reversed([last - i * step for i in range(count - 1)]))
+
+
+def format_information(error: str, mask: int) -> int:
+    # 15-bit BCH(15,5) format word, ISO/IEC 18004 section 7.9.1
+    data = (_FORMAT_ECC_BITS[error] << 3) | mask
+    rem = data << 10
+    for i in range(14, 9, -1):
+        if rem >> i & 1:
+            rem ^= 0x537 << (i - 10)
+    return ((data << 10) | rem) ^ 0x5412
+
+
+def _format_cells(size: int) -> Tuple[Tuple[Tuple[int, int], int], ...]:
+    # (row, col) of every format bit with the bit index placed there.
+    cells = []
+    for i in range(8):
+        offset = i if i < 6 else i + 1
+        cells.append(((offset, 8), i))
+        cells.append(((8, offset), 14 - i))
+        cells.append(((8, size - 1 - i), i))
+        if i < 7:
+            cells.append(((size - 1 - i, 8), 14 - i))
+    return tuple(cells)
+
+
+@lru_cache(maxsize=None)
+def _symbol_layout(version: int) -> _SymbolLayout:
+    size = 17 + 4 * version
+    total = size * size
+
+    def bit(r: int, c: int) -> int:
+        return 1 << (total - 1 - (r * size + c))
+
+    function = 0
+    for r0, c0 in ((0, 0), (0, size - 8), (size - 8, 0)):  # finders + separators
+        for r in range(r0, r0 + 8):
+            for c in range(c0, c0 + 8):
+                function |= bit(r, c)
+    for i in range(size):  # timing patterns
+        function |= bit(6, i) | bit(i, 6)
+    positions = alignment_positions(version)
+    for r in positions:
+        for c in positions:
+            if (r, c) in ((6, 6), (6, positions[-1]), (positions[-1], 6)):
+                continue
+            for dr in range(-2, 3):
+                for dc in range(-2, 3):
+                    function |= bit(r + dr, c + dc)
+    for i in range(9):  # format areas and the dark module
+        function |= bit(i, 8) | bit(8, i)
+    for i in range(8):
+        function |= bit(8, size - 1 - i) | bit(size - 1 - i, 8)
+    if version >= 7:  # version information
+        for i in range(6):
+            for j in range(size - 11, size - 8):
+                function |= bit(i, j) | bit(j, i)
+    data = ((1 << total) - 1) & ~function
+    fmt = 0
+    for (r, c), _ in _format_cells(size):
+        fmt |= bit(r, c)
+    patterns = (
+        lambda i, j: (i + j) % 2 == 0,
+        lambda i, j: i % 2 == 0,
+        lambda i, j: j % 3 == 0,
+        lambda i, j: (i + j) % 3 == 0,
+        lambda i, j: (i // 2 + j // 3) % 2 == 0,
+        lambda i, j: (i * j) % 2 + (i * j) % 3 == 0,
+        lambda i, j: ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+        lambda i, j: ((i + j) % 2 + (i * j) % 3) % 2 == 0,
+    )
+    masks = []
+    for pattern in patterns:
+        rows = ''.join('1' if pattern(i, j) else '0' for i in range(size) for j in range(size))
+        masks.append(int(rows, 2) & data)
+    return _SymbolLayout(size, data, fmt, tuple(masks))
+
+
+@lru_cache(maxsize=None)
+def _format_int(version: int, error: str, mask: int) -> int:
+    size = 17 + 4 * version
+    total = size * size
+    word = format_information(error, mask)
+    value = 0
+    for (r, c), index in _format_cells(size):
+        if word >> index & 1:
+            value |= 1 << (total - 1 - (r * size + c))
+    return value
+
+
+def remask(matrix: int, version: int, error: str, from_mask: int, to_mask: int) -> int:
+    layout = _symbol_layout(version)
+    swapped = (matrix ^ layout.masks[from_mask] ^ layout.masks[to_mask]) & ~layout.format
+    return swapped | _format_int(version, error, to_mask)
+
+
+_SEGNO_MODES = {'numeric': 1, 'alphanumeric': 2, 'byte': 4, 'kanji': 8}
+
+
+def _byte_payload(chunk: str) -> bytes:
+    # Byte segments use the charset plan_qr would pick for them.
+    for encoding in ('iso-8859-1', 'shift_jis'):
+        try:
+            return chunk.encode(encoding)
+        except UnicodeError:
+            continue
+    return chunk.encode('utf-8')
+
+
+def _segment_bits(chunk: str, mode: str) -> int:
+    n = len(chunk)
+    if mode == 'numeric':
+        return 10 * (n // 3) + (0, 4, 7)[n % 3]
+    if mode == 'alphanumeric':
+        return 11 * (n // 2) + 6 * (n % 2)
+    if mode == 'kanji':
+        return 13 * n
+    return 8 * len(_byte_payload(chunk))
+
+
+def segmentation_bits(segments: Tuple[Tuple[str, str], ...], version: int) -> int:
+    ver_range = 0 if version < 10 else (1 if version < 27 else 2)
+    return sum(4 + CHAR_COUNT_BITS[mode][ver_range] + _segment_bits(chunk, mode) for mode, chunk in segments)
+
+
+def candidate_segmentations(data: str) -> Tuple[Tuple[Tuple[str, str], ...], ...]:
+    # The planner's single segment, all-byte, and mixed numeric/alphanumeric/byte
+    # splits at a few run-length thresholds (short runs cost more in mode and
+    # count headers than they save).
+    plan = plan_qr(data)
+    found = [((plan.mode, data),)]
+    if plan.mode == 'kanji':
+        return tuple(found)
+    try:
+        data.encode('iso-8859-1')
+    except UnicodeError:
+        return tuple(found)
+    found.append((('byte', data),))
+    alnum = set(ALPHANUMERIC_CHARS.decode('ascii'))
+    for min_numeric, min_alnum in ((4, 7), (6, 11), (9, 16), (13, 24)):
+        pieces = []
+        for run in re.finditer(r"[%s]+|[^%s]+" % ((re.escape(''.join(sorted(alnum))),) * 2), data):
+            text = run.group()
+            if text[0] not in alnum:
+                pieces.append(['byte', text])
+                continue
+            for part in re.finditer(r"\d{%d,}|(?:(?!\d{%d,})[^\n])+" % (min_numeric, min_numeric), text):
+                chunk = part.group()
+                if chunk.isdigit() and len(chunk) >= min_numeric:
+                    pieces.append(['numeric', chunk])
+                else:
+                    pieces.append(['alphanumeric' if len(chunk) >= min_alnum else 'byte', chunk])
+        merged = []
+        for mode, chunk in pieces:
+            if merged and merged[-1][0] == mode:
+                merged[-1][1] += chunk
+            else:
+                merged.append([mode, chunk])
+        found.append(tuple((mode, chunk) for mode, chunk in merged))
+    unique = []
+    for segments in found:
+        if segments not in unique:
+            unique.append(segments)
+    return tuple(unique)
+
+
+def _optimizer_encode(segments: Tuple[Tuple[str, str], ...], version: int, error: str) -> Tuple[int, int]:
+    import segno  # type: ignore
+    content = [(_byte_payload(chunk) if mode == 'byte' else chunk, _SEGNO_MODES[mode]) for mode, chunk in segments]
+    qr = segno.make(content, version=version, error=error, micro=False, boost_error=False, mask=0)
+    return matrix_to_int(tuple(bytes(row) for row in qr.matrix)), qr.mask
+
+
+class OptimizedQR(NamedTuple):
+    encoded: EncodedQR
+    error: str
+    mask: int
+    segments: Tuple[Tuple[str, str], ...]
+    dark: int
+    differing: Optional[int]
+    candidates: int  # full symbols scored (ECC level x segmentation x mask)
+    encodes: int  # real encodes performed; everything else was derived by re-masking
+
+
+def optimize_qr(
+    data: str,
+    *,
+    errors: str = 'lmqh',
+    background: Optional[Tuple[bytes, ...]] = None,
+) -> OptimizedQR:
+    # Searches ECC levels (from `errors`) that fit the minimal version, candidate
+    # segmentations and all 8 masks for the valid symbol with the fewest dark
+    # modules, or, with `background` (module rows of 0/1, symbol-sized), the
+    # fewest modules differing from it. Candidates that do not fit are pruned
+    # from their bit length before encoding.
+    version = plan_version(data)
+    layout = _symbol_layout(version)
+    target = matrix_to_int(background) if background is not None else None
+    if background is not None and (len(background) != layout.size or any(len(r) != layout.size for r in background)):
+        raise ValueError(f"background must be {layout.size}x{layout.size} modules for version {version}")
+
+    jobs = []
+    for error in ECC_LEVELS:
+        if error not in errors.lower():
+            continue
+        capacity = DATA_CODEWORDS[error][version - 1] * 8
+        for segments in candidate_segmentations(data):
+            if segmentation_bits(segments, version) <= capacity:
+                jobs.append((segments, error))
+    if not jobs:
+        raise ValueError("No allowed error correction level fits the payload at its minimal version")
+
+    results = [_optimizer_encode(seg, version, err) for seg, err in jobs]
+
+    best = None
+    for (segments, error), (matrix, mask0) in zip(jobs, results):
+        for mask in range(8):
+            candidate = remask(matrix, version, error, mask0, mask)
+            dark = candidate.bit_count()
+            differing = (candidate ^ target).bit_count() if target is not None else None
+            score = (differing if differing is not None else dark, dark, ECC_LEVELS.index(error) * -1)
+            if best is None or score < best[0]:
+                best = (score, candidate, error, mask, segments, dark, differing)
+    _, matrix, error, mask, segments, dark, differing = best
+    rows = int_to_matrix(matrix, layout.size)
+    return OptimizedQR(EncodedQR(rows, version, dark), error, mask, segments, dark, differing,
+                       candidates=len(jobs) * 8, encodes=len(jobs))
+
+
+# --- Native encoder ---------------------------------------------------------
+#
+# A dependency-free encoder producing the same symbols as segno (same version,
+# ECC level, mask choice and module placement). Reed-Solomon uses one 256-entry
+# table per generator polynomial, so each data codeword is a shift and an XOR on
+# a big int. Codeword placement is a per-version itemgetter permutation of the
+# bit stream. Mask selection scores all 8 candidates as bit-parallel ints: the
+# symbol is laid out with 4 guard modules before each row and 4 guard rows above
+# and below, so shifting by 1 steps along a row, shifting by the row width steps
+# down a column, and runs never wrap between rows.
+
+# Error correction codewords per block and number of blocks for versions 1..40.
+ECC_CODEWORDS_PER_BLOCK = {
+    'l': (7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+          28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'm': (10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+          26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    'q': (13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+          28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'h': (17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+          30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+ECC_BLOCKS = {
+    'l': (1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+          8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    'm': (1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+          17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    'q': (1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+          23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    'h': (1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+          25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+_MODE_INDICATORS = {'numeric': 1, 'alphanumeric': 2, 'byte': 4, 'kanji': 8}
+_GF_EXP = [0] * 512
+_GF_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    _GF_EXP[_i] = _GF_EXP[_i + 255] = _x
+    _GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+del _x, _i
+
+
+def _gf_mul(a: int, b: int) -> int:
+    return _GF_EXP[_GF_LOG[a] + _GF_LOG[b]] if a and b else 0
+
+
+@lru_cache(maxsize=None)
+def _rs_table(degree: int) -> Tuple[int, ...]:
+    # Generator polynomial (leading 1 dropped, highest term first), then for each
+    # feedback byte f the product f * generator packed into `degree` bytes.
+    divisor = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            divisor[j] = _gf_mul(divisor[j], root)
+            if j + 1 < degree:
+                divisor[j] ^= divisor[j + 1]
+        root = _gf_mul(root, 2)
+    return tuple(int.from_bytes(bytes(_gf_mul(c, f) for c in divisor), 'big') for f in range(256))
+
+
+def rs_remainder(data: bytes, degree: int) -> bytes:
+    table = _rs_table(degree)
+    top = 8 * (degree - 1)
+    keep = (1 << top) - 1
+    rem = 0
+    for byte in data:
+        rem = ((rem & keep) << 8) ^ table[byte ^ (rem >> top)]
+    return rem.to_bytes(degree, 'big')
+
+
+def _data_codewords(plan: QRPlan) -> bytes:
+    version = plan.version
+    ver_range = 0 if version < 10 else (1 if version < 27 else 2)
+    payload = plan.payload
+    acc, length = _MODE_INDICATORS[plan.mode], 4
+
+    def push(value: int, bits: int) -> None:
+        nonlocal acc, length
+        acc = (acc << bits) | value
+        length += bits
+
+    push(plan.char_count, CHAR_COUNT_BITS[plan.mode][ver_range])
+    if plan.mode == 'numeric':
+        for i in range(0, len(payload), 3):
+            chunk = payload[i:i + 3]
+            push(int(chunk), (0, 4, 7, 10)[len(chunk)])
+    elif plan.mode == 'alphanumeric':
+        values = [ALPHANUMERIC_CHARS.index(b) for b in payload]
+        for i in range(0, len(values) - 1, 2):
+            push(values[i] * 45 + values[i + 1], 11)
+        if len(values) % 2:
+            push(values[-1], 6)
+    elif plan.mode == 'kanji':
+        for i in range(0, len(payload), 2):
+            code = (payload[i] << 8) | payload[i + 1]
+            code -= 0x8140 if code <= 0x9ffc else 0xc140
+            push((code >> 8) * 0xc0 + (code & 0xff), 13)
+    else:
+        push(int.from_bytes(payload, 'big'), 8 * len(payload))
+    capacity = DATA_CODEWORDS[plan.error][version - 1]
+    push(0, min(4, capacity * 8 - length))  # terminator
+    # segno always appends 8 - length % 8 padding bits, i.e. a whole zero
+    # codeword when the stream is already byte aligned; do the same so the
+    # symbols match.
+    push(0, 8 - length % 8)
+    data = acc.to_bytes(length // 8, 'big')[:capacity]
+    return data + (b'\xec\x11' * capacity)[:capacity - len(data)]
+
+
+def _final_codewords(plan: QRPlan) -> bytes:
+    # Split into ECC blocks (short blocks first), append each block's RS
+    # remainder, then interleave data and error correction codewords.
+    data = _data_codewords(plan)
+    version, error = plan.version, plan.error
+    blocks = ECC_BLOCKS[error][version - 1]
+    degree = ECC_CODEWORDS_PER_BLOCK[error][version - 1]
+    long_blocks = len(data) % blocks
+    short_len = len(data) // blocks
+    chunks = []
+    offset = 0
+    for i in range(blocks):
+        n = short_len + (i >= blocks - long_blocks)
+        chunks.append(data[offset:offset + n])
+        offset += n
+    out = bytearray()
+    for i in range(short_len + 1):
+        out.extend(chunk[i] for chunk in chunks if i < len(chunk))
+    ecc = [rs_remainder(chunk, degree) for chunk in chunks]
+    for i in range(degree):
+        out.extend(block[i] for block in ecc)
+    return bytes(out)
+
+
+def version_information(version: int) -> int:
+    # 18-bit BCH(18,6) version word, ISO/IEC 18004 section 7.10
+    rem = version << 12
+    for i in range(17, 11, -1):
+        if rem >> i & 1:
+            rem ^= 0x1f25 << (i - 12)
+    return (version << 12) | rem
+
+
+class _NativeLayout(NamedTuple):
+    place: Callable[[str], Tuple[str, ...]]  # bit stream + '0' -> module characters, row-major
+    stream_bits: int
+    patterns: int  # finder, timing and alignment modules (dark ones set)
+    extras: int  # version information and the fixed dark module
+    pad_width: int
+    full: int  # real modules in the guarded layout
+    guard: int  # guard modules in the guarded layout
+    masks: Tuple[int, ...]  # layout masks, guarded layout
+
+
+def _guarded(value: int, size: int) -> int:
+    # Row-major int (top-left = MSB) -> guarded layout, also top-left first.
+    flat = format(value, f'0{size * size}b')
+    width = size + 4
+    rows = ''.join('0000' + flat[i:i + size] for i in range(0, size * size, size))
+    return int(rows + '0' * (4 * width), 2)  # the leading guard rows are zeros
+
+
+@lru_cache(maxsize=None)
+def _native_layout(version: int) -> _NativeLayout:
+    layout = _symbol_layout(version)
+    size = layout.size
+    total = size * size
+
+    def bit(r: int, c: int) -> int:
+        return 1 << (total - 1 - (r * size + c))
+
+    patterns = 0
+    for r0, c0 in ((0, 0), (0, size - 7), (size - 7, 0)):
+        for dr in range(7):
+            for dc in range(7):
+                if max(abs(dr - 3), abs(dc - 3)) != 2:
+                    patterns |= bit(r0 + dr, c0 + dc)
+    for i in range(8, size - 8, 2):
+        patterns |= bit(6, i) | bit(i, 6)
+    positions = alignment_positions(version)
+    for r in positions:
+        for c in positions:
+            if (r, c) in ((6, 6), (6, positions[-1]), (positions[-1], 6)):
+                continue
+            for dr in range(-2, 3):
+                for dc in range(-2, 3):
+                    if max(abs(dr), abs(dc)) != 1:
+                        patterns |= bit(r + dr, c + dc)
+
+    extras = bit(size - 8, 8)
+    if version >= 7:
+        word = version_information(version)
+        for i in range(18):
+            if word >> i & 1:
+                extras |= bit(size - 11 + i % 3, i // 3) | bit(i // 3, size - 11 + i % 3)
+
+    # Codeword placement order (ISO/IEC 18004 section 7.7.3), as segno walks it.
+    stream_bits = layout.data.bit_count()
+    order = [stream_bits] * total
+    index = 0
+    for right in range(size - 1, 0, -2):
+        if right <= 6:
+            right -= 1
+        for vertical in range(size):
+            for j in (right, right - 1):
+                upwards = ((right & 2) == 0) ^ (j < 6)
+                i = size - 1 - vertical if upwards else vertical
+                if layout.data & bit(i, j):
+                    order[i * size + j] = index
+                    index += 1
+
+    width = size + 4
+    full = _guarded((1 << total) - 1, size)
+    guard = ((1 << ((size + 8) * width)) - 1) ^ full
+    return _NativeLayout(itemgetter(*order), stream_bits, patterns, extras, width, full, guard,
+                         tuple(_guarded(mask, size) for mask in layout.masks))
+
+
+def _run_penalty(x: int, step: int) -> int:
+    # N1 for one colour and direction: a run of n >= 5 scores n - 2, i.e. one
+    # point per 5-module window plus 2 per run of windows.
+    windows = x & x << step & x << 2 * step & x << 3 * step & x << 4 * step
+    return windows.bit_count() + 2 * (windows & ~(windows << step)).bit_count()
+
+
+def _finder_penalty(dark: int, light: int, step: int) -> int:
+    # N3: 1:1:3:1:1 with four light (or off-symbol) modules before or after. Like
+    # segno, a counted match makes the scan skip the next six modules, which only
+    # matters when matches overlap (offsets 4 and 6).
+    matches = (dark & light << step & dark << 2 * step & dark << 3 * step & dark << 4 * step
+               & light << 5 * step & dark << 6 * step)
+    if not matches:
+        return 0
+    before = light >> step & light >> 2 * step & light >> 3 * step & light >> 4 * step
+    after = light << 7 * step & light << 8 * step & light << 9 * step & light << 10 * step
+    counted = matches & (before | after)
+    if not matches & (matches << 4 * step | matches << 6 * step):
+        return 40 * counted.bit_count()
+    score = 0
+    skipped = 0
+    while matches:
+        top = 1 << (matches.bit_length() - 1)
+        matches ^= top
+        if top & counted and not top & skipped:
+            score += 40
+            skipped |= top >> 4 * step | top >> 6 * step
+    return score
+
+
+def mask_penalty(dark: int, full: int, guard: int, width: int, modules: int) -> int:
+    # ISO/IEC 18004 section 7.8.3 penalty of a guarded-layout symbol.
+    light = full & ~dark
+    score = 0
+    for x in (dark, light):
+        score += _run_penalty(x, 1) + _run_penalty(x, width)
+        score += 3 * (x & x << 1 & x << width & x << (width + 1)).bit_count()
+    light |= guard
+    score += _finder_penalty(dark, light, 1) + _finder_penalty(dark, light, width)
+    return score + 10 * int(abs(float(dark.bit_count()) / modules * 100 - 50) / 5)
+
+
+def native_encode(plan: QRPlan, mask: Optional[int] = None) -> Tuple[int, int]:
+    # Returns (matrix as a row-major int, mask). Without `mask`, the one with the
+    # lowest penalty wins (first on ties), as in segno.
+    version = plan.version
+    layout = _symbol_layout(version)
+    native = _native_layout(version)
+    codewords = _final_codewords(plan)
+    stream = format(int.from_bytes(codewords, 'big'), f'0{8 * len(codewords)}b')
+    stream = stream.ljust(native.stream_bits, '0') + '0'
+    unmasked = int(''.join(native.place(stream)), 2) | native.patterns
+    if mask is None:
+        guarded = _guarded(unmasked, layout.size)
+        penalties = [mask_penalty(guarded ^ m, native.full, native.guard, native.pad_width, layout.size ** 2)
+                     for m in native.masks]
+        mask = penalties.index(min(penalties))
+    matrix = unmasked ^ layout.masks[mask] | _format_int(version, plan.error, mask) | native.extras
+    return matrix, mask
+
+
+# Resolved here, once the native encoder is defined, so 'fastest' can time it.
+BACKEND: QRBackend
+BACKEND_CHOICE = os.environ.get('QR_BACKEND', 'auto')
+use_backend(resolve_backend(BACKEND_CHOICE))
+# Spawned /batch and bulk processes re-import this module; handing them the
+# resolved name means 'fastest' is benchmarked once, in the parent.
+os.environ['QR_BACKEND'] = BACKEND.name
+# The fewest-dark-modules optimiser drives segno directly, whichever backend is active.
+SEGNO_AVAILABLE = SegnoBackend.available()
+
+
+# 5x7 pixel font shared with the page script: 7 rows of 5 bits, MSB = leftmost column.
+FONT_5X7: Dict[str, Tuple[int, ...]] = {
+    'A': (0b01110,0b10001,0b10001,0b11111,0b10001,0b10001,0b10001),
+    'B': (0b11110,0b10001,0b10001,0b11110,0b10001,0b10001,0b11110),
+    'C': (0b01110,0b10001,0b10000,0b10000,0b10000,0b10001,0b01110),
+    'D': (0b11110,0b10001,0b10001,0b10001,0b10001,0b10001,0b11110),
+    'E': (0b11111,0b10000,0b10000,0b11110,0b10000,0b10000,0b11111),
+    'F': (0b11111,0b10000,0b10000,0b11110,0b10000,0b10000,0b10000),
+    'G': (0b01110,0b10001,0b10000,0b10111,0b10001,0b10001,0b01110),
+    'H': (0b10001,0b10001,0b10001,0b11111,0b10001,0b10001,0b10001),
+    'I': (0b01110,0b00100,0b00100,0b00100,0b00100,0b00100,0b01110),
+    'J': (0b00111,0b00010,0b00010,0b00010,0b10010,0b10010,0b01100),
+    'K': (0b10001,0b10010,0b10100,0b11000,0b10100,0b10010,0b10001),
+    'L': (0b10000,0b10000,0b10000,0b10000,0b10000,0b10000,0b11111),
+    'M': (0b10001,0b11011,0b10101,0b10101,0b10001,0b10001,0b10001),
+    'N': (0b10001,0b11001,0b10101,0b10011,0b10001,0b10001,0b10001),
+    'O': (0b01110,0b10001,0b10001,0b10001,0b10001,0b10001,0b01110),
+    'P': (0b11110,0b10001,0b10001,0b11110,0b10000,0b10000,0b10000),
+    'Q': (0b01110,0b10001,0b10001,0b10001,0b10101,0b10010,0b01101),
+    'R': (0b11110,0b10001,0b10001,0b11110,0b10100,0b10010,0b10001),
+    'S': (0b01111,0b10000,0b10000,0b01110,0b00001,0b00001,0b11110),
+    'T': (0b11111,0b00100,0b00100,0b00100,0b00100,0b00100,0b00100),
+    'U': (0b10001,0b10001,0b10001,0b10001,0b10001,0b10001,0b01110),
+    'V': (0b10001,0b10001,0b10001,0b10001,0b01010,0b01010,0b00100),
+    'W': (0b10001,0b10001,0b10001,0b10101,0b10101,0b11011,0b10001),
+    'X': (0b10001,0b01010,0b00100,0b00100,0b00100,0b01010,0b10001),
+    'Y': (0b10001,0b01010,0b00100,0b00100,0b00100,0b00100,0b00100),
+    'Z': (0b11111,0b00001,0b00010,0b00100,0b01000,0b10000,0b11111),
+    '0': (0b01110,0b11011,0b10101,0b10101,0b10101,0b10011,0b01110),
+    '1': (0b00100,0b01100,0b00100,0b00100,0b00100,0b00100,0b01110),
+    '2': (0b01110,0b10001,0b00001,0b00010,0b00100,0b01000,0b11111),
+    '3': (0b11110,0b00001,0b00001,0b01110,0b00001,0b00001,0b11110),
+    '4': (0b00010,0b00110,0b01010,0b10010,0b11111,0b00010,0b00010),
+    '5': (0b11111,0b10000,0b11110,0b00001,0b00001,0b10001,0b01110),
+    '6': (0b00110,0b01000,0b10000,0b11110,0b10001,0b10001,0b01110),
+    '7': (0b11111,0b00001,0b00010,0b00100,0b01000,0b01000,0b01000),
+    '8': (0b01110,0b10001,0b10001,0b01110,0b10001,0b10001,0b01110),
+    '9': (0b01110,0b10001,0b10001,0b01111,0b00001,0b00010,0b11100),
+    '-': (0b00000,0b00000,0b00000,0b11111,0b00000,0b00000,0b00000),
+    ' ': (0b00000,0b00000,0b00000,0b00000,0b00000,0b00000,0b00000),
+    "'": (0b00100,0b00100,0b01000,0b00000,0b00000,0b00000,0b00000),
+    '_': (0b00000,0b00000,0b00000,0b00000,0b00000,0b00000,0b11111),
+    '+': (0b00100,0b00100,0b11111,0b00100,0b00100,0b00000,0b00000),
+    '=': (0b00000,0b11111,0b00000,0b11111,0b00000,0b00000,0b00000),
+    '[': (0b11110,0b10000,0b10000,0b10000,0b10000,0b10000,0b11110),
+    ']': (0b01111,0b00001,0b00001,0b00001,0b00001,0b00001,0b01111),
+    '{': (0b00110,0b00100,0b00100,0b11000,0b00100,0b00100,0b00110),
+    '}': (0b01100,0b00100,0b00100,0b00011,0b00100,0b00100,0b01100),
+    '|': (0b00100,0b00100,0b00100,0b00100,0b00100,0b00100,0b00100),
+    '\\': (0b10000,0b01000,0b00100,0b00010,0b00001,0b00000,0b00000),
+    '/': (0b00001,0b00010,0b00100,0b01000,0b10000,0b00000,0b00000),
+    ':': (0b00000,0b00100,0b00000,0b00000,0b00000,0b00100,0b00000),
+    ';': (0b00000,0b00100,0b00000,0b00000,0b00000,0b00100,0b01000),
+    '"': (0b01010,0b01010,0b00000,0b00000,0b00000,0b00000,0b00000),
+    '>': (0b10000,0b01000,0b00100,0b00010,0b00100,0b01000,0b10000),
+    '<': (0b00001,0b00010,0b00100,0b01000,0b00100,0b00010,0b00001),
+    '.': (0b00000,0b00000,0b00000,0b00000,0b00000,0b00100,0b00000),
+    ',': (0b00000,0b00000,0b00000,0b00000,0b00000,0b00100,0b01000),
+    '?': (0b01110,0b10001,0b00010,0b00100,0b00100,0b00000,0b00100),
+    '#': (0b01010,0b01010,0b11111,0b01010,0b11111,0b01010,0b01010),
+}
+
+GLYPH_WIDTH = 5
+GLYPH_HEIGHT = 7
+
+
+def _pack_glyph(rows: Tuple[int, ...]) -> int:
+    packed = 0
+    for bits in rows:
+        packed = (packed << GLYPH_WIDTH) | bits
+    return packed
+
+
+# Glyph atlas indexed by code point (ASCII): each entry packs the 7 rows into a
+# 35-bit int, top row in the most significant bits. None marks a missing glyph.
+GLYPH_ATLAS: Tuple[Optional[int], ...] = tuple(
+    _pack_glyph(FONT_5X7[chr(cp)]) if chr(cp) in FONT_5X7 else None for cp in range(128)
+)
+_FALLBACK_GLYPH = GLYPH_ATLAS[ord('?')]
+_GLYPH_ROW_MASK = (1 << GLYPH_WIDTH) - 1
+
+
+class TextBitmap(NamedTuple):
+    png: bytes
+    foreground: int
+    background: int
+    width: int
+    height: int
+
+    @property
+    def total(self) -> int:
+        return self.width * self.height
+
+
+def text_bitmap_rows(text: str, *, letter_spacing: int = 1, space_width: int = 3) -> Tuple[bytes, ...]:
+    # Lays out one line of text as 7 module rows. Each row is built as a single
+    # int (one bit per column) by OR-ing shifted glyph rows into place, then
+    # expanded to 0/1 bytes in one translate(). Characters without a glyph (the
+    # page synthesises those from a canvas font) render as '?'.
+    chars = str(text or '').upper()
+    letter_spacing = max(0, letter_spacing)
+    space_width = max(0, space_width)
+    advances = [space_width if ch == ' ' else GLYPH_WIDTH for ch in chars]
+    width = sum(advances) + letter_spacing * max(0, len(chars) - 1)
+    rows = [0] * GLYPH_HEIGHT
+    x = 0
+    for ch, advance in zip(chars, advances):
+        if ch != ' ':
+            cp = ord(ch)
+            glyph = GLYPH_ATLAS[cp] if cp < 128 else None
+            if glyph is None:
+                glyph = _FALLBACK_GLYPH
+            shift = width - x - GLYPH_WIDTH
+            for r in range(GLYPH_HEIGHT):
+                rows[r] |= ((glyph >> (GLYPH_WIDTH * (GLYPH_HEIGHT - 1 - r))) & _GLYPH_ROW_MASK) << shift
+        x += advance + letter_spacing
+    if not width:
+        return ()
+    return tuple(format(row, f'0{width}b').encode('ascii').translate(_BIT_CHAR_TABLE) for row in rows)
+
+
+def render_text_bitmap(
+    text: str,
+    *,
+    border: int = 0,
+    scale: int = 1,
+    letter_spacing: int = 1,
+    space_width: int = 3,
+    invert: bool = False,
+) -> TextBitmap:
+    # Same output as the page's Pixel Art Text Generator download: black text
+    # (white when inverted) on a transparent background.
+    border = max(0, border)
+    scale = max(1, scale)
+    rows = text_bitmap_rows(text, letter_spacing=letter_spacing, space_width=space_width)
+    if not rows:
+        return TextBitmap(b'', 0, 0, 0, 0)
+    width = (len(rows[0]) + 2 * border) * scale
+    height = (len(rows) + 2 * border) * scale
+    foreground = sum(row.count(1) for row in rows) * scale * scale
+    png = write_png(rows, dark_color='#FFFFFF' if invert else '#000000', light_color='#000000' if invert else '#FFFFFF',
+                    transparent=True, border=border, scale=scale)
+    return TextBitmap(png, foreground, width * height - foreground, width, height)
+
+
+def _short_digest(text: str, length: int = 10) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:length]
+
+
+def filename_for_data(data: str, ext: str = 'png') -> str:
+    # Create a readable slug plus a short hash for uniqueness
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", data.strip()).strip("-")
+    if len(slug) > 50:
+        slug = slug[:50].rstrip('-')
+    if not slug:
+        slug = "qr"
+    digest = _short_digest(data)
+    return f"{slug}-{digest}.{ext}"
+
+
+def canonical_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    # Normalise render options so equivalent requests share one cache key/URL.
+    return dict(
+        dark_color='#%02x%02x%02x' % _parse_color(options.get('dark_color', '#000000')),
+        light_color='#%02x%02x%02x' % _parse_color(options.get('light_color', '#FFFFFF')),
+        transparent=bool(options.get('transparent', False)),
+        border=max(0, int(options.get('border', 0))),
+        scale=max(1, int(options.get('scale', 1))),
+        optimize=bool(options.get('optimize', False)) and SEGNO_AVAILABLE,
+        format=options.get('format') or 'png',
+    )
+
+
+def render_key(data: str, options: Dict[str, Any]) -> str:
+    canon = canonical_options(options)
+    fields = [data, canon['dark_color'], canon['light_color'], canon['transparent'], canon['border'], canon['scale']]
+    if canon['optimize']:
+        fields.append('optimize')
+    if canon['format'] != 'png':
+        fields.append(canon['format'])
+    return _short_digest(json.dumps(fields, ensure_ascii=False), 32)
+
+
+def qr_permalink(data: str, options: Dict[str, Any]) -> str:
+    canon = canonical_options(options)
+    fields = dict(
+        data=data,
+        dark=canon['dark_color'],
+        light=canon['light_color'],
+        transparent='1' if canon['transparent'] else '0',
+        border=canon['border'],
+        scale=canon['scale'],
+    )
+    if canon['optimize']:
+        fields['optimize'] = '1'
+    if canon['format'] != 'png':
+        fields['format'] = canon['format']
+    query = urlencode(fields)
+    return f"/qr/{render_key(data, canon)}.{OUTPUT_FORMATS[canon['format']].ext}?{query}"
+
+
+# Renders are a pure function of their canonical parameters, so any response
+# addressed by them can be cached forever.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _immutable_response(etag: str, build: Callable[[], Response]) -> Response:
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = build()
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return resp
+
+
+class StaticAsset(NamedTuple):
+    url: str
+    mimetype: str
+    etag: str
+    bodies: Dict[str, bytes]  # content-coding -> body ('identity', 'gzip', 'br')
+
+
+# Preferred order when the client accepts several codings equally.
+ASSET_ENCODINGS = ('br', 'gzip', 'identity')
+
+
+def build_asset(name: str, mimetype: str, text: str) -> StaticAsset:
+    # Content-hashed URL so the body can be cached forever; compressed once here
+    # rather than per request. Brotli is used when the optional module is installed.
+    raw = text.encode('utf-8')
+    digest = _short_digest(text, 12)
+    stem, ext = name.rsplit('.', 1)
+    bodies = {'identity': raw}
+    gz = gzip.compress(raw, compresslevel=9, mtime=0)
+    if len(gz) < len(raw):
+        bodies['gzip'] = gz
+    if try_import('brotli'):
+        import brotli  # type: ignore
+        br = brotli.compress(raw, mode=brotli.MODE_TEXT, quality=11)
+        if len(br) < len(raw):
+            bodies['br'] = br
+    return StaticAsset(f"/assets/{stem}.{digest}.{ext}", mimetype, digest, bodies)
+
+
+def _build_static_assets() -> Dict[str, StaticAsset]:
+    font = json.dumps(FONT_5X7, separators=(',', ':'), sort_keys=True)
+    return {
+        'css': build_asset('app.css', 'text/css', PAGE_CSS),
+        'js': build_asset('app.js', 'text/javascript', PAGE_JS.replace('__FONT_5X7__', font)),
+    }
+
+
+STATIC_ASSETS = _build_static_assets()
+ASSET_URLS = {kind: asset.url for kind, asset in STATIC_ASSETS.items()}
+_ASSETS_BY_URL = {asset.url: asset for asset in STATIC_ASSETS.values()}
+
+
+def negotiate_encoding(available: Dict[str, bytes]) -> str:
+    accept = request.accept_encodings
+    best, best_q = 'identity', 0.0
+    for coding in ASSET_ENCODINGS:
+        if coding not in available:
+            continue
+        q = accept[coding] if coding != 'identity' else (accept['identity'] if 'identity' in accept else 0.001)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+@app.get('/assets/<name>')
+def static_asset(name: str) -> Response:
+    asset = _ASSETS_BY_URL.get(f"/assets/{name}")
+    if asset is None:
+        return Response("Not found", status=404, mimetype='text/plain')
+    coding = negotiate_encoding(asset.bodies)
+
+    def build() -> Response:
+        resp = Response(asset.bodies[coding], mimetype=asset.mimetype)
+        if coding != 'identity':
+            resp.headers['Content-Encoding'] = coding
+        return resp
+    resp = _immutable_response(f"{asset.etag}-{coding}", build)
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+
+# Compiled once; render_template_string would re-parse PAGE on every request.
+PAGE_TEMPLATE = app.jinja_env.from_string(PAGE)
+# Pre-rendered landing pages keyed by url_root (it appears in og:url); bounded
+# because the Host header is client-controlled.
+LANDING_CACHE_HOSTS = 16
+_LANDING_PAGES: Dict[str, Tuple[str, Dict[str, bytes]]] = {}
+
+
+def render_page(data: str, options: Dict[str, Any]) -> str:
+    context = dict(data=data, dark=options['dark_color'], light=options['light_color'],
+                   transparent=options['transparent'], border=options['border'], scale=options['scale'],
+                   optimize=options['optimize'])
+    if data:
+        # The counts shown next to the preview and the packed matrix the page paints.
+        encoded = encode_qr(data, options['optimize'])
+        stats = qr_stats(encoded, border=options['border'], scale=options['scale'])
+        context.update(dict(black=stats.black, white=stats.white, total=stats.total, version=stats.version,
+                            size=stats.size, permalink=qr_permalink(data, options),
+                            bits=base64.b64encode(write_bits(encoded.matrix)).decode('ascii')))
+    with timed_stage('template'):
+        return PAGE_TEMPLATE.render(request=request, assets=ASSET_URLS, **context)
+
+
+def _landing_page() -> Response:
+    root = request.url_root
+    cached = _LANDING_PAGES.get(root)
+    if cached is None:
+        html = render_page('', _qr_request_options({})[1])
+        raw = html.encode('utf-8')
+        cached = (_short_digest(html, 16), {'identity': raw, 'gzip': gzip.compress(raw, compresslevel=9, mtime=0)})
+        if len(_LANDING_PAGES) >= LANDING_CACHE_HOSTS:
+            _LANDING_PAGES.pop(next(iter(_LANDING_PAGES)), None)
+        _LANDING_PAGES[root] = cached
+    etag, bodies = cached
+    coding = negotiate_encoding(bodies)
+    if request.if_none_match.contains(f"{etag}-{coding}"):
+        resp = Response(status=304)
+    else:
+        resp = Response(bodies[coding], mimetype='text/html')
+        if coding != 'identity':
+            resp.headers['Content-Encoding'] = coding
+    resp.set_etag(f"{etag}-{coding}")
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+
+@app.route('/', methods=['GET', 'POST'])
+def index():
+    params = request.form if request.method == 'POST' else request.args
+    if not params:
+        return _landing_page()
+    data, options = _qr_request_options(params)
+    return render_page(data, options)
+
+
+@app.route('/optimize', methods=['GET', 'POST'])
+def optimizer():
+    # Fewest-dark-modules search with details: chosen ECC level, mask,
+    # segmentation and how many candidates were scored. POST a JSON body to
+    # pass `background` (module rows as "0101..." strings) for the fewest
+    # modules differing from what is already painted.
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    params = body if isinstance(body, dict) else request.args
+    data = params.get('data') or ''
+    if not data or not isinstance(data, str):
+        return jsonify({"error": "Missing data"}), 400
+    if not SEGNO_AVAILABLE:
+        return jsonify({"error": "The optimiser needs segno (pip install segno)"}), 501
+    errors = params.get('errors') or 'lmqh'
+    if not isinstance(errors, str) or not set(errors.lower()) <= set(ECC_LEVELS):
+        return jsonify({"error": "errors must be a string of ECC levels from 'lmqh'"}), 400
+    background = params.get('background')
+    if background is not None and not isinstance(background, list):
+        return jsonify({"error": "background must be a list of module rows"}), 400
+    try:
+        if background is not None:
+            background = tuple(str(row).encode('ascii').translate(_BIT_CHAR_TABLE) for row in background)
+        result = optimize_qr(data, errors=errors, background=background)
+    except (ValueError, UnicodeError) as exc:
+        return jsonify({"error": str(exc)}), 400
+    return jsonify(dict(
+        version=result.encoded.version,
+        error=result.error.upper(),
+        mask=result.mask,
+        dark=result.dark,
+        differing=result.differing,
+        baseline_dark=encode_qr(data).black,
+        candidates=result.candidates,
+        encodes=result.encodes,
+        segments=[dict(mode=mode, length=len(chunk)) for mode, chunk in result.segments],
+        matrix=[row.translate(_BIT_TEXT_TABLE).decode('ascii') for row in result.encoded.matrix],
+    ))
+
+
+def _qr_request_options(args) -> Tuple[str, Dict[str, Any]]:
+    data = args.get('data') or ''
+    dark = args.get('dark') or '#000000'
+    light = args.get('light') or '#FFFFFF'
+    transparent = (args.get('transparent') == '1')
+    try:
+        border = int(args.get('border') or 0)
+    except Exception:
+        border = 0
+    try:
+        scale = int(args.get('scale') or 1)
+    except Exception:
+        scale = 1
+    optimize = (args.get('optimize') == '1') and SEGNO_AVAILABLE  # unoptimised (and keyed so) without segno
+    output = (args.get('format') or 'png').lower()
+    if output not in OUTPUT_FORMATS:
+        output = 'png'
+    return data, dict(dark_color=dark, light_color=light, transparent=transparent, border=border, scale=scale,
+                      optimize=optimize, format=output)
+
+
+def _render_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    # render_qr() keywords; `optimize` only affects encoding, `format` picks the writer.
+    return {k: v for k, v in options.items() if k not in ('optimize', 'format')}
+
+
+def _qr_download(data: str, options: Dict[str, Any]) -> Response:
+    key = render_key(data, options)
+    output = OUTPUT_FORMATS[options['format']]
+
+    def build() -> Response:
+        result = DISK_CACHE.get_render(key) if DISK_CACHE is not None else None
+        if result is None and options['format'] == 'png':
+            cost = render_cost(plan_version(data), options['border'], options['scale'])
+            if cost >= PNG_STREAM_PIXELS:
+                return _streamed_png(data, options, cost)
+        if result is None:
+            result = generate_qr_bytes(data, **options)
+            if DISK_CACHE is not None:
+                DISK_CACHE.put_render(key, result)
+        fname = filename_for_data(data, output.ext)
+        resp = send_file(io.BytesIO(result[0]), mimetype=output.mimetype, as_attachment=True, download_name=fname)
+        resp.headers['X-QR-Version'] = str(result[3])
+        resp.headers['X-QR-Modules'] = str(17 + 4 * result[3])
+        return resp
+    if DISK_CACHE is not None:
+        HOT_KEYS.record(key, data, options)
+        DISK_CACHE.maybe_maintain()
+    return _immutable_response(key, build)
+
+
+def _streamed_png(data: str, options: Dict[str, Any], cost: int) -> Response:
+    # Huge PNGs go out as a chunked body generated scanline by scanline, so
+    # memory stays around one pixel row whatever the scale. The admission slot
+    # is held until the body is closed. Not disk-cached or shared between
+    # identical requests: nothing is buffered to share.
+    gate = ExitStack()
+    gate.enter_context(RENDER_ADMISSION.admit(cost))
+    try:
+        encoded = encode_qr(data, options['optimize'])
+        render = dict(_render_options(options), border=max(0, options['border']), scale=max(1, options['scale']))
+        resp = Response(iter_png(encoded.matrix, **render), mimetype='image/png')
+    except BaseException:
+        gate.close()
+        raise
+    resp.call_on_close(gate.close)
+    resp.headers.set('Content-Disposition', 'attachment', filename=filename_for_data(data, 'png'))
+    resp.headers['X-QR-Version'] = str(encoded.version)
+    resp.headers['X-QR-Modules'] = str(encoded.modules)
+    return resp
+
+
+@app.route('/download')
+def download():
+    data, options = _qr_request_options(request.args)
+    if not data:
+        return "Missing data", 400
+    return _qr_download(data, options)
+
+
+@app.route('/qr/<key>.<ext>')
+def permalink(key: str, ext: str):
+    data, options = _qr_request_options(request.args)
+    if not data:
+        return "Missing data", 400
+    if key != render_key(data, options) or ext != OUTPUT_FORMATS[options['format']].ext:
+        return redirect(qr_permalink(data, options), code=301)
+    return _qr_download(data, options)
+
+
+@app.route('/meta')
+def meta():
+    data, options = _qr_request_options(request.args)
+    if not data:
+        return jsonify({"error": "Missing data"}), 400
+
+    def build() -> Response:
+        # Colours do not affect the counts; only the matrix, border and scale do.
+        stats = qr_stats(encode_qr(data, options['optimize']), border=options['border'], scale=options['scale'])
+        return jsonify(dict(version=stats.version, black=stats.black, white=stats.white, total=stats.total,
+                            size=stats.size, optimized=options['optimize']))
+    return _immutable_response(render_key(data, options) + '-meta', build)
+
+
+@app.route('/preview')
+def preview():
+    # Image and /meta stats in one round trip for the live preview.
+    data, options = _qr_request_options(request.args)
+    if not data:
+        return jsonify({"error": "Missing data"}), 400
+
+    return _immutable_response(render_key(data, options) + '-preview', lambda: jsonify(preview_payload(data, options)))
+
+
+def matrix_key(data: str, optimize: bool) -> str:
+    return _short_digest(json.dumps([data, 'optimize' if optimize else ''], ensure_ascii=False), 32)
+
+
+def matrix_payload(data: str, optimize: bool = False) -> Dict[str, Any]:
+    # Packed module matrix (write_bits, base64) and its stats; the page paints
+    # it locally in any colours, border and scale.
+    encoded = encode_qr(data, optimize)
+    return dict(version=encoded.version, modules=encoded.modules, black=encoded.black,
+                bits=base64.b64encode(write_bits(encoded.matrix)).decode('ascii'),
+                optimized=optimize and SEGNO_AVAILABLE)
+
+
+@app.route('/matrix')
+def matrix():
+    data, options = _qr_request_options(request.args)
+    if not data:
+        return jsonify({"error": "Missing data"}), 400
+    return _immutable_response(matrix_key(data, options['optimize']) + '-matrix',
+                               lambda: jsonify(matrix_payload(data, options['optimize'])))
+
+
+def preview_payload(data: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    png_bytes, black, white, version, size = generate_qr_bytes(data, **dict(options, format='png'))
+    image = 'data:image/png;base64,' + base64.b64encode(png_bytes).decode('ascii')
+    return dict(version=version, black=black, white=white, total=size * size,
+                size=size, image=image, url=qr_permalink(data, options))
+
+
+# --- Live preview channel ------------------------------------------------------
+#
+# The page streams every payload edit over one WebSocket as {"seq": n, "params":
+# {...}}. The session keeps only the newest state: edits that arrive while an
+# encode is running replace the pending one, and a finished one is dropped
+# unsent when a newer state is already waiting. Replies are the /matrix payload
+# plus `seq`. The handshake needs the raw socket from Werkzeug's server (`serve`
+# and the dev server); elsewhere /live answers 501 and the page keeps using /matrix.
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+LIVE_MAX_MESSAGE = 64 * 1024
+LIVE_IDLE_TIMEOUT = float(os.environ.get('QR_LIVE_IDLE_TIMEOUT', '300'))
+LIVE_PING_INTERVAL = 30.0
+# Each live connection holds a request thread for its lifetime; `serve` lowers
+# this to half of --threads so live clients cannot starve ordinary requests.
+LIVE_MAX_CONNECTIONS = int(os.environ.get('QR_LIVE_MAX_CONNECTIONS', '64'))
+LIVE_SHUTDOWN = threading.Event()
+_live_lock = threading.Lock()
+_live_connections = 0
+
+METRICS.declare('qr_live_connections', 'gauge', "Open live-preview WebSocket connections.")
+METRICS.declare('qr_live_states_total', 'counter', "Live-preview states by outcome (rendered, superseded, invalid, error).")
+
+
+class LiveSocket:
+    # Minimal RFC 6455 server endpoint: unfragmented text frames plus ping/pong/close.
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self._buffer = bytearray()
+
+    def _read(self, n: int) -> bytes:
+        while len(self._buffer) < n:
+            chunk = self.sock.recv(max(4096, n - len(self._buffer)))
+            if not chunk:
+                raise ConnectionResetError("live socket closed by peer")
+            self._buffer += chunk
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    def readable(self, timeout: float) -> bool:
+        if self._buffer:
+            return True
+        return bool(select.select([self.sock], [], [], timeout)[0])
+
+    def send(self, opcode: int, payload: bytes) -> None:
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('!BB', 0x80 | opcode, n)
+        elif n < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+        self.sock.sendall(header + payload)
+
+    def close(self, code: int = 1000) -> None:
+        try:
+            self.send(0x8, struct.pack('!H', code))
+        except OSError:
+            pass
+
+    def receive(self) -> Optional[str]:
+        # Returns the next text message, or None after handling a control frame.
+        first, second = self._read(2)
+        opcode, length = first & 0x0F, second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._read(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._read(8))[0]
+        if not second & 0x80 or length > LIVE_MAX_MESSAGE:
+            self.close(1002 if not second & 0x80 else 1009)
+            raise ConnectionAbortedError("unmasked or oversized live frame")
+        mask = self._read(4)
+        payload = self._read(length)
+        if length:
+            keystream = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(length, 'big')
+        if opcode == 0x8:
+            self.send(0x8, payload[:2])
+            raise ConnectionResetError("live socket closed by peer")
+        if opcode == 0x9:
+            self.send(0xA, payload)
+            return None
+        if opcode == 0xA:
+            return None
+        if opcode != 0x1 or not first & 0x80:
+            self.close(1003)
+            raise ConnectionAbortedError("only unfragmented text frames are supported")
+        return payload.decode('utf-8')
+
+
+def _live_state(message: str) -> Optional[Tuple[int, str, Dict[str, Any]]]:
+    try:
+        body = json.loads(message)
+        seq = int(body['seq'])
+        params = {str(k): str(v) for k, v in dict(body['params']).items()}
+    except (ValueError, KeyError, TypeError):
+        return None
+    data, options = _qr_request_options(params)
+    return seq, data, options
+
+
+def live_session(ws: LiveSocket) -> None:
+    latest_seq = -1
+    pending: Optional[Tuple[int, str, Dict[str, Any]]] = None
+    last_seen = last_ping = time.monotonic()
+
+    def drain(timeout: float) -> bool:
+        # Read everything that has arrived, keeping only the newest state.
+        nonlocal pending, latest_seq, last_seen
+        newer = False
+        while ws.readable(timeout):
+            timeout = 0
+            message = ws.receive()
+            last_seen = time.monotonic()
+            state = _live_state(message) if message is not None else None
+            if message is not None and (state is None or not state[1]):
+                METRICS.inc('qr_live_states_total', (('outcome', 'invalid'),))
+                continue
+            if state is None or state[0] <= latest_seq:
+                continue
+            if pending is not None:
+                METRICS.inc('qr_live_states_total', (('outcome', 'superseded'),))
+            latest_seq, pending, newer = state[0], state, True
+        return newer
+
+    while not LIVE_SHUTDOWN.is_set():
+        if pending is None:
+            drain(1.0)
+        if pending is None:
+            now = time.monotonic()
+            if now - last_seen > LIVE_IDLE_TIMEOUT:
+                ws.close(1001)
+                return
+            if now - last_ping > LIVE_PING_INTERVAL:
+                ws.send(0x9, b'')
+                last_ping = now
+            continue
+        seq, data, options = pending
+        pending = None
+        try:
+            reply = matrix_payload(data, options['optimize'])
+        except ValueError as exc:
+            reply = {"error": str(exc)}
+        except Exception:
+            # One bad state must not end the session (or leak a traceback).
+            app.logger.exception("live preview failed for seq %s", seq)
+            METRICS.inc('qr_live_states_total', (('outcome', 'error'),))
+            reply = {"error": "Internal error while generating this preview"}
+        if drain(0):
+            # The user typed past this state while it rendered; don't send it.
+            METRICS.inc('qr_live_states_total', (('outcome', 'superseded'),))
+            continue
+        reply['seq'] = seq
+        ws.send(0x1, json.dumps(reply).encode('utf-8'))
+        METRICS.inc('qr_live_states_total', (('outcome', 'rendered'),))
+    ws.close(1001)
+
+
+class _LiveResponseBody:
+    # WSGI body that runs the session on the raw socket, then reports the
+    # connection as dropped so Werkzeug does not write an HTTP response after it.
+    def __init__(self, sock: socket.socket, accept: str) -> None:
+        self.sock = sock
+        self.accept = accept
+
+    def __iter__(self):
+        global _live_connections
+        try:
+            self.sock.settimeout(LIVE_PING_INTERVAL)
+            self.sock.sendall(
+                b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                b"Sec-WebSocket-Accept: " + self.accept.encode('ascii') + b"\r\n\r\n"
+            )
+            METRICS.inc('qr_live_connections')
+            ws = LiveSocket(self.sock)
+            try:
+                live_session(ws)
+            except (ConnectionError, socket.timeout):
+                pass
+            except Exception:
+                # After the 101 nothing may be written as HTTP: close the socket
+                # with "internal error" instead of letting Werkzeug send a 500.
+                app.logger.exception("live session failed")
+                ws.close(1011)
+            finally:
+                METRICS.inc('qr_live_connections', value=-1)
+                try:
+                    # Ends the TCP connection too; otherwise Werkzeug waits on it
+                    # for another keep-alive request.
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        finally:
+            with _live_lock:
+                _live_connections -= 1
+        raise ConnectionAbortedError("live session finished")
+
+
+@app.route('/live', websocket=True)
+def live() -> Response:
+    # Werkzeug only routes here for Upgrade: websocket requests.
+    global _live_connections
+    key = request.headers.get('Sec-WebSocket-Key', '')
+    if not key:
+        return Response("Missing Sec-WebSocket-Key", status=400, mimetype='text/plain')
+    sock = request.environ.get('werkzeug.socket')
+    if sock is None:
+        return Response("Live preview is not available on this server", status=501, mimetype='text/plain')
+    with _live_lock:
+        if _live_connections >= LIVE_MAX_CONNECTIONS:
+            return Response("Too many live connections", status=503, mimetype='text/plain',
+                            headers={'Retry-After': '30'})
+        _live_connections += 1
+    accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+    # Not status=101: Werkzeug would send an empty body without running the session.
+    return Response(_LiveResponseBody(sock, accept))
+
+
+# No text bitmap may be larger than the largest QR download (v40, border 50, scale 50).
+BITMAP_MAX_PIXELS = render_cost(40, 50, 50)
+
+
+@app.route('/bitmap')
+def bitmap():
+    # Server-side Pixel Art Text Generator; counts are returned in headers.
+    text = request.args.get('text') or ''
+    if not text.strip():
+        return "Missing text", 400
+    options = {}
+    # Same ranges as the page's sliders.
+    for name, default, low, high in (('border', 0, 0, 50), ('scale', 1, 1, 50),
+                                     ('letter_spacing', 1, 0, 10), ('space_width', 3, 1, 5)):
+        try:
+            options[name] = min(high, max(low, int(request.args.get(name) or default)))
+        except Exception:
+            options[name] = default
+    options['invert'] = (request.args.get('invert') == '1')
+    rows = text_bitmap_rows(text, letter_spacing=options['letter_spacing'], space_width=options['space_width'])
+    side = 2 * options['border']
+    cost = (len(rows[0]) + side) * (len(rows) + side) * options['scale'] ** 2 if rows else 0
+    if cost > BITMAP_MAX_PIXELS:
+        return "Text too long for this scale and border", 400
+
+    def build() -> Response:
+        with RENDER_ADMISSION.admit(cost):
+            result = render_text_bitmap(text, **options)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", text).strip("-")[:50] or "bitmap"
+        resp = send_file(io.BytesIO(result.png), mimetype='image/png', as_attachment=True,
+                         download_name=f"{slug}.png")
+        resp.headers['X-Pixels-Foreground'] = str(result.foreground)
+        resp.headers['X-Pixels-Background'] = str(result.background)
+        resp.headers['X-Pixels-Total'] = str(result.total)
+        resp.headers['Access-Control-Expose-Headers'] = 'X-Pixels-Foreground, X-Pixels-Background, X-Pixels-Total'
+        return resp
+    key = _short_digest(json.dumps([text, options], sort_keys=True, ensure_ascii=False), 32)
+    return _immutable_response(key + '-bitmap', build)
+
+
+BATCH_MAX_ITEMS = int(os.environ.get('QR_BATCH_MAX_ITEMS', '10000'))
+BATCH_PROCESSES = int(os.environ.get('QR_BATCH_PROCESSES', '0')) or os.cpu_count() or 1
+# JSON bodies are parsed whole before rendering starts, so they are capped; CSV
+# bodies are read row by row and are not.
+BATCH_MAX_JSON_BYTES = int(os.environ.get('QR_BATCH_MAX_JSON_BYTES', str(8 * 1024 * 1024)))
+
+_batch_pool: Optional[ProcessPoolExecutor] = None
+_batch_pool_lock = threading.Lock()
+
+
+def batch_pool() -> ProcessPoolExecutor:
+    # Created on first use. "spawn" keeps children independent of the threads
+    # (and any locks they hold) in the serving process.
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = ProcessPoolExecutor(max_workers=BATCH_PROCESSES,
+                                              mp_context=multiprocessing.get_context('spawn'))
+        return _batch_pool
+
+
+def _batch_item_options(item: Any, shared: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    # An item is a bare payload or an object with the /download query fields;
+    # its fields override the shared ones.
+    fields = dict(shared)
+    fields.update(item if isinstance(item, dict) else {'data': item})
+    args = {k: ('1' if v is True else '0' if v is False else str(v)) for k, v in fields.items() if v is not None}
+    return _qr_request_options(args)
+
+
+def _batch_render(data: str, options: Dict[str, Any]) -> Tuple[bytes, Dict[str, Any]]:
+    png_bytes, black, white, version, size = generate_qr_bytes(data, **options)
+    return png_bytes, dict(version=version, black=black, white=white, total=size * size, size=size,
+                           format=options['format'])
+
+
+class _ZipSink:
+    # Write-only file object for zipfile; chunks are handed out with drain().
+    def __init__(self) -> None:
+        self._chunks: list = []
+
+    def write(self, b: bytes) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = b''.join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+class BatchSummary:
+    # Running totals for a batch: throughput, output bytes and version histogram.
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.rendered = 0
+        self.errors = 0
+        self.bytes = 0
+        self.pixels = 0
+        self.versions: Dict[int, int] = {}
+
+    def add(self, png_bytes: Optional[bytes], info: Dict[str, Any]) -> None:
+        if png_bytes is None:
+            self.errors += 1
+            return
+        self.rendered += 1
+        self.bytes += len(png_bytes)
+        self.pixels += info['total']
+        self.versions[info['version']] = self.versions.get(info['version'], 0) + 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        seconds = time.perf_counter() - self.started
+        return dict(
+            items=self.rendered + self.errors,
+            rendered=self.rendered,
+            errors=self.errors,
+            seconds=round(seconds, 3),
+            items_per_sec=round(self.rendered / seconds, 1) if seconds > 0 else None,
+            bytes=self.bytes,
+            pixels=self.pixels,
+            versions=dict(sorted(self.versions.items())),
+        )
+
+
+def iter_batch_results(items, shared: Optional[Dict[str, Any]] = None, *, executor=None, window: int = 0,
+                       limit: Optional[int] = BATCH_MAX_ITEMS, summary: Optional[BatchSummary] = None):
+    # Renders `items` on a process pool and yields (index, data, png_bytes, info)
+    # in completion order; `info` holds the stats, or an "error" and png_bytes is
+    # None. Items are consumed lazily with at most `window` renders in flight, so
+    # memory stays flat however long `items` is.
+    shared = shared or {}
+    executor = executor or batch_pool()
+    window = window or 2 * BATCH_PROCESSES
+    pending: Dict[Any, Tuple[int, str]] = {}
+
+    def finish(done):
+        for future in done:
+            index, data = pending.pop(future)
+            try:
+                png_bytes, stats = future.result()
+            except Exception as exc:
+                png_bytes, stats = None, dict(error=str(exc))
+            if summary is not None:
+                summary.add(png_bytes, stats)
+            yield index, data, png_bytes, stats
+
+    for index, item in enumerate(items):
+        if limit is not None and index >= limit:
+            yield index, '', None, dict(error=f"batch limit of {limit} items reached")
+            break
+        data, options = _batch_item_options(item, shared)
+        if not data:
+            if summary is not None:
+                summary.errors += 1
+            yield index, data, None, dict(error="Missing data")
+            continue
+        pending[executor.submit(_batch_render, data, options)] = (index, data)
+        if len(pending) >= window:
+            done, _ = futures_wait(pending, return_when=FIRST_COMPLETED)
+            yield from finish(done)
+    while pending:
+        done, _ = futures_wait(pending, return_when=FIRST_COMPLETED)
+        yield from finish(done)
+
+
+class _UniqueNames:
+    # filename_for_data() names, suffixed -2, -3, ... when a payload repeats.
+    def __init__(self) -> None:
+        self._used: set = set()
+
+    def __call__(self, data: str, ext: str = 'png') -> str:
+        name = filename_for_data(data, ext)
+        stem, n = name[:-(len(ext) + 1)], 1
+        while name in self._used:
+            n += 1
+            name = f"{stem}-{n}.{ext}"
+        self._used.add(name)
+        return name
+
+
+def stream_qr_zip(items, shared: Optional[Dict[str, Any]] = None, **kwargs: Any):
+    # Yields a ZIP archive (one image per item + manifest.json) chunk by chunk, one
+    # chunk per completed item. The manifest is spooled and appended last.
+    # Keyword arguments are passed to iter_batch_results().
+    sink = _ZipSink()
+    manifest = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+b')
+    unique_name = _UniqueNames()
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for index, data, png_bytes, info in iter_batch_results(items, shared, **kwargs):
+            entry: Dict[str, Any] = dict(index=index, data=data)
+            if png_bytes is not None:
+                entry['name'] = unique_name(data, OUTPUT_FORMATS[info['format']].ext)
+                zf.writestr(entry['name'], png_bytes)
+            entry.update(info)
+            manifest.write(((',\n' if manifest.tell() else '') + json.dumps(entry, ensure_ascii=False)).encode('utf-8'))
+            yield sink.drain()
+        manifest.seek(0)
+        with zf.open('manifest.json', 'w') as out:
+            out.write(b'[\n')
+            shutil.copyfileobj(manifest, out)
+            out.write(b'\n]\n')
+        manifest.close()
+    yield sink.drain()
+
+
+def _csv_items(text):
+    # One payload per row; a header row naming "data" enables per-row option columns.
+    header = None
+    for row in csv.reader(text):
+        if not row:
+            continue
+        if header is None and 'data' in row:
+            header = row
+            continue
+        if header is None:
+            yield row[0]
+        else:
+            yield {k: v for k, v in zip(header, row) if v != ''}
+
+
+def _jsonl_items(text):
+    for line in text:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _batch_items_from_request():
+    # JSON: a list of items, or {"items": [...], "options": {...}}. CSV: see _csv_items().
+    shared: Dict[str, Any] = {k: v for k, v in request.args.items()}
+    if request.mimetype == 'application/json':
+        if (request.content_length or 0) > BATCH_MAX_JSON_BYTES:
+            raise RequestEntityTooLarge()
+        raw = request.stream.read(BATCH_MAX_JSON_BYTES + 1)  # also bounds chunked bodies
+        if len(raw) > BATCH_MAX_JSON_BYTES:
+            raise RequestEntityTooLarge()
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            shared.update(body.get('options') or {})
+            body = body.get('items')
+        if not isinstance(body, list):
+            return None, shared
+        return iter(body), shared
+    return _csv_items(io.TextIOWrapper(request.stream, encoding='utf-8', newline='')), shared
+
+
+@app.post('/batch')
+def batch():
+    try:
+        items, shared = _batch_items_from_request()
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"JSON body over {BATCH_MAX_JSON_BYTES} bytes; split it or send CSV"}), 413
+    if items is None:
+        return jsonify({"error": "Expected a JSON list of items or CSV rows"}), 400
+    return Response(
+        stream_with_context(stream_qr_zip(items, shared)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=qr-batch.zip'},
+    )
+
+
+def _route_label() -> str:
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def _metrics_start() -> None:
+    g.metrics_started = time.perf_counter()
+    g.metrics_route = _route_label()
+    METRICS.inc('qr_http_requests_in_flight', (('route', g.metrics_route),))
+
+
+@app.after_request
+def _metrics_finish(response: Response) -> Response:
+    started = g.get('metrics_started')
+    if started is None:
+        return response
+    route = g.metrics_route
+    labels = (('route', route),)
+    METRICS.inc('qr_http_requests_total', (('route', route), ('method', request.method), ('status', str(response.status_code))))
+    if response.content_length is not None:
+        METRICS.observe('qr_http_response_bytes', labels, response.content_length)
+
+    def done() -> None:
+        METRICS.observe('qr_http_request_duration_seconds', labels, time.perf_counter() - started)
+        METRICS.inc('qr_http_requests_in_flight', labels, -1)
+    # Called by _metrics_wsgi once the body has been sent (see below).
+    request.environ['qr.metrics_done'] = done
+    g.metrics_started = None
+    return response
+
+
+def _metrics_wsgi(wsgi_app: Callable) -> Callable:
+    # Response.call_on_close is skipped for direct-passthrough bodies such as
+    # send_file, so close the request timer around the WSGI iterable instead.
+    def wrapped(environ, start_response):
+        iterable = wsgi_app(environ, start_response)
+        return ClosingIterator(iterable, lambda: environ.pop('qr.metrics_done', lambda: None)())
+    return wrapped
+
+
+app.wsgi_app = _metrics_wsgi(app.wsgi_app)  # type: ignore[method-assign]
+
+
+@app.get('/metrics')
+def metrics() -> Response:
+    cache = MATRIX_CACHE.stats()
+    for event in ('hits', 'misses', 'evictions'):
+        METRICS.set('qr_matrix_cache_events_total', (('event', event),), cache[event])
+    METRICS.set('qr_matrix_cache_entries', (), cache['entries'])
+    METRICS.set('qr_matrix_cache_bytes', (), cache['bytes'])
+    METRICS.set('qr_admission_active', (), RENDER_ADMISSION.active)
+    METRICS.set('qr_admission_waiting', (), RENDER_ADMISSION.waiting)
+    body = METRICS.render()
+    body += f"# HELP qr_process_info Process serving this scrape.\n# TYPE qr_process_info gauge\nqr_process_info{{pid=\"{os.getpid()}\"}} 1\n"
+    return Response(body, mimetype='text/plain', headers={'Cache-Control': 'no-store'},
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.errorhandler(Overloaded)
+def overloaded(exc: Overloaded) -> Response:
+    resp = jsonify({"error": str(exc), "retry_after": exc.retry_after})
+    resp.status_code = exc.status
+    resp.headers['Retry-After'] = str(exc.retry_after)
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+@app.get('/favicon.svg')
+def favicon_svg() -> Response:
+    svg = (
+        "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 64 64'>"
+        "<rect width='64' height='64' rx='8' fill='#000'/>"
+        "<rect x='10' y='10' width='44' height='44' fill='#fff'/>"
+        "<rect x='14' y='14' width='12' height='12' fill='#000'/>"
+        "<rect x='38' y='14' width='12' height='12' fill='#000'/>"
         "<rect x='14' y='38' width='12' height='12' fill='#000'/>"
         "<rect x='28' y='28' width='8' height='8' fill='#000'/>"
         "</svg>"
@@ -936,7 +3626,265 @@ def favicon_svg() -> Response:
     return Response(svg, mimetype='image/svg+xml')
 
 
+def preload() -> None:
+    # Warm the encode/render path once in the master (the backend was resolved at
+    # import) so forked workers start with everything already loaded.
+    print(f" * QR backend: {BACKEND.name}", flush=True)
+    if DISK_CACHE is None:
+        generate_qr_bytes('https://wplace.live')
+        MATRIX_CACHE.clear()
+        return
+    with DISK_CACHE.deferred_maintenance():
+        generate_qr_bytes('https://wplace.live')
+        MATRIX_CACHE.clear()
+        warmed = HOT_KEYS.warm(int(os.environ.get('QR_HOT_WARM', '100')),
+                               float(os.environ.get('QR_HOT_WARM_SECONDS', '30')))
+    print(f" * Pre-warmed {warmed} hot keys from {HOT_KEYS.path}", flush=True)
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    # Werkzeug server that handles connections on a fixed-size thread pool.
+    multithread = True
+
+    def __init__(self, *args: Any, threads: int = 8, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='qr-worker')
+
+    def process_request(self, request, client_address):  # type: ignore[override]
+        self._pool.submit(self._process_request_pooled, request, client_address)
+
+    def _process_request_pooled(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+class _ProductionRequestHandler(WSGIRequestHandler):
+    # One request per connection so idle keep-alive clients cannot pin pool threads.
+    protocol_version = 'HTTP/1.0'
+
+
+def _run_worker(sock: socket.socket, threads: int, workers: int = 1) -> None:
+    host, port = sock.getsockname()[:2]
+    global LIVE_MAX_CONNECTIONS, BATCH_PROCESSES
+    server = _PooledWSGIServer(host, port, app, handler=_ProductionRequestHandler, fd=sock.fileno(), threads=threads)
+    if 'QR_LIVE_MAX_CONNECTIONS' not in os.environ:
+        LIVE_MAX_CONNECTIONS = max(1, threads // 2)
+    # Running and queued heavy renders together hold at most half the threads.
+    if 'QR_HEAVY_CONCURRENCY' not in os.environ:
+        RENDER_ADMISSION.slots = max(1, threads // 4)
+    if 'QR_HEAVY_QUEUE' not in os.environ:
+        RENDER_ADMISSION.queue = max(1, threads // 4)
+    # Each worker has its own /batch pool; together they use one process per CPU.
+    if 'QR_BATCH_PROCESSES' not in os.environ:
+        BATCH_PROCESSES = max(1, (os.cpu_count() or 1) // max(1, workers))
+
+    def stop(signum, frame):
+        LIVE_SHUTDOWN.set()
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    server.serve_forever()
+    if DISK_CACHE is not None:
+        HOT_KEYS.save()
+
+
+def serve(host: str = '0.0.0.0', port: int = 5000, workers: int = 0, threads: int = 8,
+          graceful_timeout: float = 30.0) -> None:
+    # Pre-forking server: the master binds the socket and preloads the app, then
+    # forks workers that accept on the shared socket. SIGTERM/SIGINT stop the
+    # workers gracefully, SIGHUP replaces them one generation at a time, and
+    # workers that die unexpectedly are respawned.
+    workers = workers or os.cpu_count() or 1
+    preload()
+    sock = socket.create_server((host, port), backlog=2048)
+    sock.set_inheritable(True)
+    print(f" * Serving on http://{host}:{sock.getsockname()[1]} with {workers} workers x {threads} threads", flush=True)
+
+    if not hasattr(os, 'fork'):
+        # No fork() (Windows): serve from this process with the thread pool only.
+        _run_worker(sock, threads)
+        return
+
+    children: set = set()
+    retiring: Dict[int, float] = {}
+    state = dict(stopping=False, reload=False)
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            code = 0
+            try:
+                _run_worker(sock, threads, workers)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def on_stop(signum, frame):
+        state['stopping'] = True
+
+    def on_reload(signum, frame):
+        state['reload'] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_reload)
+
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        now = time.monotonic()
+        if state['stopping']:
+            for pid in children:
+                if pid not in retiring:
+                    retiring[pid] = now
+                    os.kill(pid, signal.SIGTERM)
+        elif state['reload']:
+            state['reload'] = False
+            old = [pid for pid in children if pid not in retiring]
+            for _ in range(workers):
+                spawn()
+            for pid in old:
+                retiring[pid] = now
+                os.kill(pid, signal.SIGTERM)
+        for pid, started in list(retiring.items()):
+            if pid in children and now - started > graceful_timeout:
+                os.kill(pid, signal.SIGKILL)
+        while children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                children.clear()
+                break
+            if not pid:
+                break
+            children.discard(pid)
+            if retiring.pop(pid, None) is None and not state['stopping']:
+                spawn()
+        time.sleep(0.2)
+    sock.close()
+
+
+def _read_bulk_items(stream, input_format: str):
+    if input_format == 'csv':
+        return _csv_items(stream)
+    if input_format == 'jsonl':
+        return _jsonl_items(stream)
+    return (line.rstrip('\r\n') for line in stream if line.strip())
+
+
+def bulk(source: str = '-', *, input_format: Optional[str] = None, out_dir: Optional[str] = None,
+         archive: Optional[str] = None, processes: int = 0, shared: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # Offline counterpart of /batch: streams payloads from a file (or stdin) through
+    # a process pool into a directory of PNGs plus manifest.jsonl, or into a ZIP.
+    if input_format is None:
+        ext = os.path.splitext(source)[1].lower()
+        input_format = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(ext, 'lines')
+    processes = processes or os.cpu_count() or 1
+    summary = BatchSummary()
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8', newline='')
+    try:
+        items = _read_bulk_items(stream, input_format)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            kwargs = dict(executor=executor, window=4 * processes, limit=None, summary=summary)
+            if archive:
+                with open(archive, 'wb') as out:
+                    for chunk in stream_qr_zip(items, shared, **kwargs):
+                        out.write(chunk)
+            else:
+                out_dir = out_dir or 'qr-out'
+                os.makedirs(out_dir, exist_ok=True)
+                unique_name = _UniqueNames()
+                with open(os.path.join(out_dir, 'manifest.jsonl'), 'w', encoding='utf-8') as manifest:
+                    for index, data, png_bytes, info in iter_batch_results(items, shared, **kwargs):
+                        entry: Dict[str, Any] = dict(index=index, data=data)
+                        if png_bytes is not None:
+                            entry['name'] = unique_name(data, OUTPUT_FORMATS[info['format']].ext)
+                            with open(os.path.join(out_dir, entry['name']), 'wb') as f:
+                                f.write(png_bytes)
+                        entry.update(info)
+                        manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return summary.as_dict()
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Minimal QR code generator for Wplace.")
+    commands = parser.add_subparsers(dest='command')
+    serve_cmd = commands.add_parser('serve', help="run the multi-process production server")
+    serve_cmd.add_argument('--host', default='0.0.0.0')
+    serve_cmd.add_argument('--port', type=int, default=5000)
+    serve_cmd.add_argument('--workers', type=int, default=0, help="worker processes (default: CPU count)")
+    serve_cmd.add_argument('--threads', type=int, default=8, help="request threads per worker")
+    serve_cmd.add_argument('--graceful-timeout', type=float, default=30.0,
+                           help="seconds a stopping worker may finish in-flight requests")
+    bulk_cmd = commands.add_parser('bulk', help="render many payloads offline, in parallel")
+    bulk_cmd.add_argument('input', nargs='?', default='-',
+                          help="payload file: one per line, .csv or .jsonl (default: stdin)")
+    bulk_cmd.add_argument('--input-format', choices=('lines', 'csv', 'jsonl'),
+                          help="override format detection from the file extension")
+    target = bulk_cmd.add_mutually_exclusive_group()
+    target.add_argument('--out', dest='out_dir', help="output directory (default: ./qr-out)")
+    target.add_argument('--zip', dest='archive', help="write a ZIP archive instead of a directory")
+    bulk_cmd.add_argument('--processes', type=int, default=0, help="worker processes (default: CPU count)")
+    bulk_cmd.add_argument('--dark', default='#000000')
+    bulk_cmd.add_argument('--light', default='#FFFFFF')
+    bulk_cmd.add_argument('--transparent', action='store_true')
+    bulk_cmd.add_argument('--border', type=int, default=0)
+    bulk_cmd.add_argument('--scale', type=int, default=1)
+    bulk_cmd.add_argument('--format', choices=tuple(OUTPUT_FORMATS), default='png',
+                          help="output format (default: png)")
+    backends_cmd = commands.add_parser('backends', help="benchmark the installed encoder backends")
+    backends_cmd.add_argument('input', nargs='?',
+                              help="payload file (as for bulk) to benchmark your own mix (default: built-in sample)")
+    backends_cmd.add_argument('--input-format', choices=('lines', 'csv', 'jsonl'))
+    backends_cmd.add_argument('--limit', type=int, default=200, help="payloads to read from the file")
+    backends_cmd.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args.host, args.port, args.workers, args.threads, args.graceful_timeout)
+    elif args.command == 'bulk':
+        shared = dict(dark=args.dark, light=args.light, transparent=args.transparent,
+                      border=args.border, scale=args.scale, format=args.format)
+        summary = bulk(args.input, input_format=args.input_format, out_dir=args.out_dir,
+                       archive=args.archive, processes=args.processes, shared=shared)
+        print(json.dumps(summary, indent=2))
+    elif args.command == 'backends':
+        payloads = BACKEND_SAMPLE_PAYLOADS
+        if args.input:
+            input_format = args.input_format or {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(
+                os.path.splitext(args.input)[1].lower(), 'lines')
+            with open(args.input, newline='', encoding='utf-8') as stream:
+                items = itertools.islice(_read_bulk_items(stream, input_format), args.limit)
+                payloads = tuple(data for data, _ in (_batch_item_options(item, {}) for item in items) if data)
+        timings = benchmark_backends(available_backends(), payloads, rounds=args.rounds)
+        for name, seconds in sorted(timings.items(), key=lambda kv: kv[1]):
+            print(f"{name:<10} {seconds * 1000:9.3f} ms/encode  {1 / seconds:9.1f} encodes/s")
+        print(f"active: {BACKEND.name} (QR_BACKEND={BACKEND_CHOICE})")
+    else:
+        # Development server with reloader and debugger.
+        app.run(host='0.0.0.0', port=5000, debug=True)
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    main()
 
 